@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from app.core.profiler import profile_store
+from app.services.analysis import AnalysisService
+from app.services.stats_refresh import stats_refresher
+
+router = APIRouter()
+
+def _ensure_enabled():
+    """分析功能未开启时不暴露管理接口"""
+    if not profile_store.config.enabled:
+        raise HTTPException(status_code=404, detail="性能分析未开启")
+
+@router.get("/profiles")
+async def list_profiles():
+    """列出最近的请求分析结果"""
+    _ensure_enabled()
+    return {"profiles": profile_store.list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "speedscope"):
+    """获取单个分析结果，format为speedscope或collapsed"""
+    _ensure_enabled()
+    profile = profile_store.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="分析结果不存在")
+    if format == "collapsed":
+        return PlainTextResponse(profile_store.to_collapsed(profile))
+    if format == "speedscope":
+        return profile_store.to_speedscope(profile)
+    raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+
+@router.post("/memory/snapshot")
+async def take_memory_snapshot():
+    """记录一次内存快照"""
+    _ensure_enabled()
+    result = profile_store.take_memory_snapshot()
+    result["stats_cache"] = AnalysisService.get_cache_info()
+    result["stats_refresh"] = stats_refresher.info()
+    return result
+
+@router.get("/memory/diff")
+async def get_memory_diff(top: int = 20, filename: Optional[str] = None):
+    """对比最近两次内存快照"""
+    _ensure_enabled()
+    return profile_store.memory_diff(top=top, filename=filename)
@@ -1,30 +1,87 @@
-import json
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List, Optional
-from app.core.database import db_config
-from app.services.analysis import AnalysisService
+from typing import Any, Dict, List, Optional
+from app.core import http_cache, serialization
+from app.core.database import DEFAULT_TARGET, db_config, redact_url
+from app.core.execution import AdmissionRejected, admission, find_options, query_options, run_stats_query
+from app.services.analysis import AnalysisService, LIST_PROJECTION
+from app.services.blob_store import BlobStoreService
+from app.services.catalog import catalog_for
+from app.services.complexity import ComplexityService
+from app.services.duckdb_mirror import REPORTS, DuckDBMirrorService, MirrorUnavailable
+from app.services.export import DEFAULT_BATCH_SIZE, EXPORT_FORMATS, ExportService
 from app.schemas import (
-    CollectionList, StatisticsSummary,
-    SearchFilters, PlanDetail, ComparisonData, Settings, ConnectionTest
+    CollectionList, StatisticsSummary, ComplexityLevel,
+    SearchFilters, ComparisonData, Settings, ConnectionTarget, ConnectionTest, LazyPlanTree, RetentionPolicy,
+    AnalysisQuery
 )
 from app.services.plan_parser import PlanParserService
+from app.services.plan_tree import PlanTreeService
+from app.services.retention import RetentionService
+from app.services.similarity import SIMILARITY_KINDS, SimilarityService
+from app.services.stats_refresh import stats_refresher
+from app.services.stats_stream import STREAM_FORMATS, ProgressiveStatsService
+from app.services.trend import TrendService
+from app.services.history import HistoryService
+from app.services.live import live_updates
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-async def get_database() -> AsyncIOMotorDatabase:
-    """获取数据库实例依赖注入"""
+async def get_target(request: Request) -> str:
+    """连接目标依赖注入，X-Mongo-Target请求头或target查询参数选择连接目标，默认为活动目标"""
+    target = request.headers.get("X-Mongo-Target") or request.query_params.get("target")
+    try:
+        db_config.use_target(target)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"连接目标不存在: {target}")
+    return db_config.current_target()
+
+async def get_database(target: str = Depends(get_target)) -> AsyncIOMotorDatabase:
+    """获取数据库实例依赖注入（所选连接目标的数据库）"""
     return db_config.get_database()
 
+def _remember(cache_key: str, func):
+    """不走后台刷新的统计：成功结果写入统计缓存，超时/过载时作为过期结果返回"""
+    async def load():
+        result = await func()
+        AnalysisService.set_cached(cache_key, result)
+        return result
+    return load
+
 @router.get("/collections", response_model=CollectionList)
 async def get_collections(db: AsyncIOMotorDatabase = Depends(get_database)):
-    """获取所有集合列表"""
+    """获取所有集合列表及目录信息（后台定期刷新，从内存返回）"""
     try:
-        collections = await db.list_collection_names()
-        return CollectionList(collections=collections)
+        collection_catalog = catalog_for(db_config.current_target())
+        catalog = await collection_catalog.get(db)
+        return CollectionList(
+            collections=collection_catalog.names(),
+            catalog=catalog,
+            refreshed_at=collection_catalog.refreshed_at
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取集合列表失败: {str(e)}")
 
+@router.post("/collections/refresh", response_model=CollectionList)
+async def refresh_collections(db: AsyncIOMotorDatabase = Depends(get_database)):
+    """立即刷新集合目录"""
+    try:
+        collection_catalog = catalog_for(db_config.current_target())
+        catalog = await collection_catalog.refresh(db)
+        return CollectionList(
+            collections=collection_catalog.names(),
+            catalog=catalog,
+            refreshed_at=collection_catalog.refreshed_at
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"刷新集合目录失败: {str(e)}")
+
 @router.get("/plans")
 async def get_plans(
     collection: str,
@@ -38,83 +95,301 @@ async def get_plans(
         skip = (page - 1) * size
         
         # 获取总数
-        total = await collection_obj.count_documents({})
+        total = await collection_obj.count_documents({}, **query_options("list"))
         
         # 分页查询
-        cursor = collection_obj.find({}).sort("timestamp", -1).skip(skip).limit(size)
+        cursor = collection_obj.find({}, LIST_PROJECTION, **find_options("list")).sort("timestamp", -1).skip(skip).limit(size)
         plans = await cursor.to_list(length=size)
         
         # 转换_id为字符串并处理复杂度信息
         for plan in plans:
             plan["_id"] = str(plan["_id"])
+            BlobStoreService.apply_list_preview(plan)
             # 处理复杂度信息
             plan = AnalysisService.process_record_complexity(plan)
         
-        return {
+        return serialization.respond({
             "items": plans,
             "total": total,
             "page": page,
             "size": size,
             "pages": (total + size - 1) // size
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取查询计划失败: {str(e)}")
 
 @router.get("/stats/summary", response_model=StatisticsSummary)
 async def get_stats_summary(
+    request: Request,
+    response: Response,
     collection: str,
     slow_sql_threshold: float = 100.0,
+    mode: str = "auto",
+    sample: Optional[int] = None,
+    sample_method: str = "random",
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """获取聚合统计信息"""
+    """获取聚合统计信息（mode: auto/exact/approx，approx时按sample抽样并返回置信区间）"""
     try:
-        return await AnalysisService.get_collection_stats(db, collection, slow_sql_threshold)
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        cache_key = AnalysisService.summary_cache_key(collection, slow_sql_threshold, mode, sample, sample_method)
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_summary",
+            lambda: stats_refresher.serve(
+                cache_key,
+                lambda: AnalysisService.get_collection_stats(
+                    db, collection, slow_sql_threshold, mode, sample, sample_method
+                ),
+                response
+            ),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
 
 @router.get("/stats/basic", response_model=StatisticsSummary)
 async def get_basic_stats(
+    request: Request,
+    response: Response,
     collection: str,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """获取基础统计信息（不依赖阈值）"""
     try:
-        return await AnalysisService.get_basic_collection_stats(db, collection)
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        cache_key = AnalysisService._get_cache_key(collection, is_basic=True)
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_basic",
+            lambda: stats_refresher.serve(
+                cache_key,
+                lambda: AnalysisService.get_basic_collection_stats(db, collection, use_cache=False),
+                response
+            ),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取基础统计信息失败: {str(e)}")
 
 @router.get("/stats/slow-sql", response_model=StatisticsSummary)
 async def get_slow_sql_stats(
+    request: Request,
+    response: Response,
     collection: str,
     slow_sql_threshold: float = 100.0,
+    mode: str = "auto",
+    sample: Optional[int] = None,
+    sample_method: str = "random",
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """获取慢SQL统计信息（依赖阈值）"""
+    """获取慢SQL统计信息（依赖阈值，mode: auto/exact/approx）"""
     try:
-        return await AnalysisService.get_slow_sql_stats(db, collection, slow_sql_threshold)
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        variant = AnalysisService._stats_variant(mode, sample, sample_method)
+        cache_key = AnalysisService._get_cache_key(collection, slow_sql_threshold, variant=variant)
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_slow_sql",
+            lambda: stats_refresher.serve(
+                cache_key,
+                lambda: AnalysisService.get_slow_sql_stats(
+                    db, collection, slow_sql_threshold, mode, sample, sample_method, use_cache=False
+                ),
+                response
+            ),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取慢SQL统计信息失败: {str(e)}")
 
+@router.get("/stats/slow-sql/stream")
+async def stream_slow_sql_stats(
+    collection: str,
+    slow_sql_threshold: float = 100.0,
+    mode: str = "auto",
+    sample: Optional[int] = None,
+    sample_method: str = "random",
+    format: str = "sse",
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """渐进式慢SQL统计：各部分并发计算，完成一部分推送一部分（format: sse / ndjson）
+
+    推送期间占用 /stats/slow-sql 的并发名额，名额已满时返回503。
+    """
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    try:
+        release = await admission.acquire("stats_slow_sql")
+    except AdmissionRejected:
+        raise HTTPException(status_code=503, detail="统计服务繁忙，请稍后重试", headers={"Retry-After": "2"})
+    events = ProgressiveStatsService.slow_sql_events(db, collection, slow_sql_threshold, mode, sample, sample_method)
+    return StreamingResponse(
+        ProgressiveStatsService.stream(events, format, release),
+        media_type=STREAM_FORMATS[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 流没有开始迭代就结束（例如客户端在首个分块前断开）时也释放名额
+        background=BackgroundTask(release),
+    )
+
 @router.get("/stats/slow-sql-list")
 async def get_slow_sql_list(
+    request: Request,
+    response: Response,
     collection: str,
     slow_sql_threshold: float = 100.0,
     limit: int = 50,
+    complexity_level: Optional[ComplexityLevel] = None,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """获取慢SQL列表数据（用于趋势图表）"""
+    """获取慢SQL列表数据（用于趋势图表），可按复杂度等级筛选"""
     try:
-        return await AnalysisService.get_slow_sql_list(db, collection, slow_sql_threshold, limit)
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        level = complexity_level.value if complexity_level else None
+        cache_key = AnalysisService._get_cache_key(collection, slow_sql_threshold, variant=f"slow_list_{limit}_{level}")
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_slow_sql_list",
+            _remember(cache_key, lambda: AnalysisService.get_slow_sql_list(db, collection, slow_sql_threshold, limit, level)),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取慢SQL列表失败: {str(e)}")
 
+@router.get("/stats/complexity")
+async def get_complexity_distribution(
+    request: Request,
+    response: Response,
+    collection: str,
+    slow_sql_threshold: Optional[float] = None,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """复杂度等级分布（需先执行 manage.py score-complexity 写入等级），指定slow_sql_threshold时只统计慢SQL"""
+    try:
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        cache_key = AnalysisService._get_cache_key(collection, slow_sql_threshold, variant="complexity")
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_complexity",
+            lambda: stats_refresher.serve(
+                cache_key,
+                lambda: ComplexityService.get_distribution(db, collection, slow_sql_threshold),
+                response
+            ),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取复杂度分布失败: {str(e)}")
+
+@router.get("/stats/trend")
+async def get_trend(
+    request: Request,
+    response: Response,
+    collection: str,
+    granularity: str = "hour",
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    file_name: Optional[str] = None,
+    fingerprint: Optional[str] = None,
+    slow_sql_threshold: float = 100.0,
+    use_rollups: bool = True,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """按时间桶（minute/hour/day）获取执行延迟趋势"""
+    try:
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        cache_key = AnalysisService._get_cache_key(
+            collection, slow_sql_threshold,
+            variant=f"trend_{granularity}_{start}_{end}_{file_name}_{fingerprint}_{use_rollups}"
+        )
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_trend",
+            _remember(cache_key, lambda: TrendService.get_trend(
+                db, collection, granularity, start, end,
+                file_name, fingerprint, slow_sql_threshold, use_rollups
+            )),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取趋势数据失败: {str(e)}")
+
+@router.post("/stats/trend/rollups/refresh")
+async def refresh_trend_rollups(
+    collection: str,
+    full: bool = False,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """刷新小时级趋势预聚合"""
+    try:
+        return await TrendService.refresh_rollups(db, collection, full)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"刷新趋势预聚合失败: {str(e)}")
+
+@router.get("/stats/history")
+async def get_script_history(
+    request: Request,
+    response: Response,
+    collection: str,
+    file_name: str,
+    points: int = 1000,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """获取单个脚本的执行历史（服务端LTTB降采样到points个点）"""
+    try:
+        not_modified = await http_cache.check_stats_etag(request, response, db, collection)
+        if not_modified:
+            return not_modified
+        cache_key = AnalysisService._get_cache_key(collection, variant=f"history_{file_name}_{points}_{start}_{end}")
+        return serialization.respond(await run_stats_query(
+            request, response, db, "stats_history",
+            _remember(cache_key, lambda: HistoryService.get_history(db, collection, file_name, points, start, end)),
+            stale=lambda: AnalysisService.get_cached(cache_key, allow_stale=True)
+        ), response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取执行历史失败: {str(e)}")
+
 @router.get("/plans/{plan_id}/detail")
 async def get_plan_detail(
+    request: Request,
     plan_id: str,
     collection: str,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """获取单个计划的详细信息，包括解析后的节点数据"""
+    """获取单个计划的详细信息，包括解析后的节点数据
+
+    记录写入后不变，返回强ETag；If-None-Match命中已知ETag时直接返回304。
+    Accept: application/msgpack时返回MessagePack。
+    """
+    representation = "msgpack" if http_cache.wants_msgpack(request) else "json"
+    etag_key = (db_config.qualify(collection), plan_id, representation)
+    known_etag = http_cache.detail_etags.get(etag_key)
+    if known_etag and http_cache.etag_matches(request, known_etag):
+        return http_cache.not_modified(known_etag, http_cache.DETAIL_CACHE_CONTROL, http_cache.DETAIL_VARY)
     try:
         # 获取原始记录
         record = await AnalysisService.get_record_detail(db, collection, plan_id)
@@ -125,34 +400,101 @@ async def get_plan_detail(
         parsed_plan = PlanParserService.extract_query_plan_json(record)
         if not parsed_plan:
             raise HTTPException(status_code=400, detail="无法找到执行计划数据")
+        plan_hash = record.get("plan_hash") or http_cache.content_hash(parsed_plan)
+        etag = http_cache.detail_etag(plan_id, plan_hash, representation)
+        http_cache.detail_etags.put(etag_key, etag)
+        if http_cache.etag_matches(request, etag):
+            return http_cache.not_modified(etag, http_cache.DETAIL_CACHE_CONTROL, http_cache.DETAIL_VARY)
         
         # 解析JSON
         parsed_plan = PlanParserService.parse_json_string(parsed_plan)
         if not parsed_plan:
             raise HTTPException(status_code=400, detail="执行计划JSON解析失败")
         
-        # 提取节点
-        nodes = PlanParserService.parse_execution_plan(parsed_plan)
-        root_node = PlanParserService.find_root_node(nodes)
-        
-        # 将计划转换为JSON字符串以便存储到PlanContent
-        plan_content = json.dumps(parsed_plan, ensure_ascii=False)
-        
-        return PlanDetail(
-            plan_id=plan_id,
-            sql_content=record["sql_content"],
-            execution_time_ms=record["execution_time_ms"],
-            status=record["status"],
-            row_count=record["row_count"],
-            nodes=nodes,
-            root_node=root_node,
-            plan_content=plan_content
-        )
+        detail = PlanParserService.build_plan_detail(plan_id, record, parsed_plan)
+        headers = {"ETag": etag, "Cache-Control": http_cache.DETAIL_CACHE_CONTROL, "Vary": http_cache.DETAIL_VARY}
+        if representation == "msgpack":
+            return http_cache.render(request, detail, headers)
+        return serialization.respond(detail, headers=headers)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取计划详情失败: {str(e)}")
 
+async def _load_plan_tree(db: AsyncIOMotorDatabase, collection: str, plan_id: str):
+    """已解析的扁平计划，缓存未命中时读取记录并解析一次"""
+    plan = PlanTreeService.get_cached(collection, plan_id)
+    if plan is not None:
+        return plan
+    record = await AnalysisService.get_record_detail(db, collection, plan_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="查询计划不存在")
+    parsed_plan = PlanParserService.parse_json_string(PlanParserService.extract_query_plan_json(record))
+    if not parsed_plan:
+        raise HTTPException(status_code=400, detail="执行计划JSON解析失败")
+    record_summary = {
+        field: record.get(field)
+        for field in ("file_name", "sql_content", "execution_time_ms", "status", "row_count", "timestamp")
+    }
+    return PlanTreeService.put(collection, plan_id, parsed_plan, record_summary)
+
+@router.get("/plans/{plan_id}/tree", response_model=LazyPlanTree)
+async def get_plan_tree(
+    plan_id: str,
+    collection: str,
+    depth: int = 3,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """获取计划概要和前depth层节点，更深的节点折叠并给出子节点数和子树耗时"""
+    try:
+        plan = await _load_plan_tree(db, collection, plan_id)
+        return PlanTreeService.build_tree(plan_id, plan, "n0", depth)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取计划树失败: {str(e)}")
+
+@router.get("/plans/{plan_id}/tree/{node_id}", response_model=LazyPlanTree)
+async def get_plan_subtree(
+    plan_id: str,
+    node_id: str,
+    collection: str,
+    depth: int = 3,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """展开指定节点，返回其下depth层的节点"""
+    try:
+        plan = await _load_plan_tree(db, collection, plan_id)
+        return PlanTreeService.build_tree(plan_id, plan, node_id, depth)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"节点不存在: {node_id}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取子树失败: {str(e)}")
+
+@router.get("/plans/{plan_id}/similar")
+async def get_similar_plans(
+    plan_id: str,
+    collection: str,
+    k: int = Query(10, ge=1, le=200),
+    by: str = "plan",
+    min_similarity: float = Query(0.0, ge=0, le=1),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """按计划结构（by=plan）或SQL文本（by=sql）查找相似的执行记录（MinHash/LSH估计的Jaccard相似度）"""
+    if by not in SIMILARITY_KINDS:
+        raise HTTPException(status_code=400, detail=f"by只能是: {', '.join(SIMILARITY_KINDS)}")
+    try:
+        result = await SimilarityService.find_similar(db, collection, plan_id, k=k, by=by, min_similarity=min_similarity)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"相似计划检索失败: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="查询计划不存在")
+    return serialization.respond(result)
+
 @router.post("/analysis/compare")
 async def compare_plans(
     plan_ids: List[str],
@@ -171,23 +513,7 @@ async def compare_plans(
                     parsed_plan = PlanParserService.parse_json_string(query_plan_json)
                     
                     if parsed_plan:
-                        nodes = PlanParserService.parse_execution_plan(parsed_plan)
-                        root_node = PlanParserService.find_root_node(nodes)
-                        
-                        # 将计划转换为JSON字符串以便存储到PlanContent
-                        plan_content = json.dumps(parsed_plan, ensure_ascii=False)
-                        
-                        plan_detail = PlanDetail(
-                            plan_id=plan_id,
-                            sql_content=record["sql_content"],
-                            execution_time_ms=record["execution_time_ms"],
-                            status=record["status"],
-                            row_count=record["row_count"],
-                            nodes=nodes,
-                            root_node=root_node,
-                            plan_content=plan_content
-                        )
-                        plans.append(plan_detail)
+                        plans.append(PlanParserService.build_plan_detail(plan_id, record, parsed_plan))
         
         # 生成对比指标
         comparison_metrics = {
@@ -197,13 +523,141 @@ async def compare_plans(
             'min_execution_time': min((p.execution_time_ms for p in plans), default=0)
         }
         
-        return ComparisonData(
+        return serialization.respond(ComparisonData.model_construct(
             plans=plans,
             comparison_metrics=comparison_metrics
-        )
+        ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"对比分析失败: {str(e)}")
 
+async def run_mirror_query(func):
+    """镜像查询的统一执行入口：并发控制，错误映射为HTTP状态码"""
+    try:
+        return serialization.respond(await admission.run("analysis_query", func))
+    except AdmissionRejected:
+        raise HTTPException(status_code=503, detail="分析服务繁忙，请稍后重试", headers={"Retry-After": "2"})
+    except MirrorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="分析查询超时")
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/analysis/mirror")
+async def get_mirror_status(target: str = Depends(get_target)):
+    """DuckDB镜像的文件大小和各集合的同步状态"""
+    return await run_mirror_query(lambda: DuckDBMirrorService.status(target))
+
+@router.post("/analysis/mirror/sync")
+async def sync_mirror(
+    collection: str,
+    full: bool = False,
+    target: str = Depends(get_target),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """把集合增量同步到DuckDB镜像（full=true时重建）"""
+    try:
+        return await DuckDBMirrorService.sync_collection(db, collection, full=full, target=target)
+    except MirrorUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"同步分析镜像失败: {str(e)}")
+
+@router.post("/analysis/query")
+async def query_mirror(query: AnalysisQuery, target: str = Depends(get_target)):
+    """在DuckDB镜像上执行只读查询（records/nodes/sync_state表），超时后中断"""
+    def run():
+        DuckDBMirrorService.validate_query(query.sql)
+        return DuckDBMirrorService.query(
+            query.sql, query.params, max_rows=query.max_rows, target=target
+        )
+    return await run_mirror_query(run)
+
+@router.get("/analysis/reports")
+async def list_mirror_reports():
+    """预置分析报表"""
+    return {"reports": DuckDBMirrorService.list_reports()}
+
+@router.get("/analysis/reports/{name}")
+async def get_mirror_report(
+    name: str,
+    collection: str,
+    days: float = Query(30, gt=0),
+    path_prefix: Optional[str] = None,
+    node_type: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    target: str = Depends(get_target),
+):
+    """在DuckDB镜像上执行预置报表"""
+    if name not in REPORTS:
+        raise HTTPException(status_code=404, detail=f"报表不存在: {name}")
+    return await run_mirror_query(lambda: DuckDBMirrorService.run_report(
+        name, collection, days=days, path_prefix=path_prefix, node_type=node_type, limit=limit, target=target,
+    ))
+
+@router.get("/storage/report")
+async def get_storage_report(
+    collection: str,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """集合存储大小及大字段外置节省的空间"""
+    try:
+        return await BlobStoreService.size_report(db, collection)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取存储报告失败: {str(e)}")
+
+@router.get("/retention/policies")
+async def list_retention_policies(db: AsyncIOMotorDatabase = Depends(get_database)):
+    """已配置的保留策略"""
+    try:
+        return {"policies": await RetentionService.get_policies(db)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取保留策略失败: {str(e)}")
+
+@router.put("/retention/policies/{collection}")
+async def set_retention_policy(
+    collection: str,
+    policy: RetentionPolicy,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """设置集合的保留策略（执行由 manage.py retention 或 RETENTION_INTERVAL_SECONDS 定期任务完成）"""
+    try:
+        return await RetentionService.set_policy(db, collection, policy.raw_days, policy.archive, policy.enabled)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"设置保留策略失败: {str(e)}")
+
+@router.delete("/retention/policies/{collection}")
+async def delete_retention_policy(collection: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """删除集合的保留策略"""
+    if not await RetentionService.delete_policy(db, collection):
+        raise HTTPException(status_code=404, detail="保留策略不存在")
+    return {"deleted": collection}
+
+@router.get("/retention/report")
+async def get_retention_report(
+    collection: str,
+    raw_days: Optional[int] = None,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """估算按保留策略（或指定raw_days）执行后可释放的空间和执行时间，不修改数据"""
+    try:
+        if raw_days is None:
+            policy = await RetentionService.get_policy(db, collection)
+            if not policy:
+                raise HTTPException(status_code=400, detail="集合没有保留策略，请指定raw_days")
+            raw_days = policy["raw_days"]
+        return await RetentionService.report(db, collection, raw_days)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取保留报告失败: {str(e)}")
+
 @router.get("/search")
 async def search_plans(
     collection: str,
@@ -212,6 +666,8 @@ async def search_plans(
     min_execution_time: float = None,
     max_execution_time: float = None,
     file_name: str = None,
+    complexity_level: Optional[ComplexityLevel] = None,
+    min_complexity_score: Optional[float] = None,
     page: int = 1,
     size: int = 20,
     db: AsyncIOMotorDatabase = Depends(get_database)
@@ -223,37 +679,151 @@ async def search_plans(
             status=status,
             min_execution_time=min_execution_time,
             max_execution_time=max_execution_time,
-            file_name=file_name
+            file_name=file_name,
+            complexity_level=complexity_level,
+            min_complexity_score=min_complexity_score
         )
         
         filters_dict = filters.dict(exclude_none=True)
-        return await AnalysisService.search_records(db, collection, filters_dict, page, size)
+        return serialization.respond(await AnalysisService.search_records(db, collection, filters_dict, page, size))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
+@router.get("/export")
+async def export_plans(
+    collection: str,
+    format: str = "ndjson",
+    q: str = None,
+    status: str = None,
+    min_execution_time: float = None,
+    max_execution_time: float = None,
+    file_name: str = None,
+    complexity_level: Optional[ComplexityLevel] = None,
+    min_complexity_score: Optional[float] = None,
+    fields: Optional[str] = None,
+    limit: int = 0,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """按搜索条件流式导出记录（NDJSON或CSV），fields为逗号分隔的字段列表"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+    try:
+        filters = SearchFilters(
+            q=q,
+            status=status,
+            min_execution_time=min_execution_time,
+            max_execution_time=max_execution_time,
+            file_name=file_name,
+            complexity_level=complexity_level,
+            min_complexity_score=min_complexity_score
+        )
+        query = AnalysisService.build_search_query(filters.dict(exclude_none=True))
+        selected = ExportService.resolve_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stream = ExportService.stream(
+        db, collection, query, selected, format, batch_size=min(max(batch_size, 1), 10000), limit=max(limit, 0)
+    )
+    extension = "csv" if format == "csv" else "ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{collection}.{extension}"'},
+    )
+
+@router.get("/live")
+async def subscribe_live_updates(
+    collection: str,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """订阅集合的实时增量（Server-Sent Events），需要MongoDB副本集"""
+    subscriber = live_updates.subscribe(db, collection)
+    return StreamingResponse(
+        live_updates.sse_stream(collection, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _resolve_url(settings_url: str, name: Optional[str]) -> str:
+    """表单回传的是隐藏密码后的地址时还原为已保存的地址"""
+    target = db_config.targets.get(name) if name else None
+    if target is not None and settings_url == redact_url(target.url):
+        return target.url
+    return settings_url
+
+def _app_settings(settings: Settings) -> Dict[str, Any]:
+    """设置中与连接目标无关的部分"""
+    return {
+        "slow_sql_threshold": settings.slow_sql_threshold,
+        "default_collection": settings.default_collection,
+        "page_size": settings.page_size
+    }
+
 @router.get("/settings", response_model=Settings)
 async def get_settings():
-    """获取当前设置"""
+    """获取当前设置（连接信息为活动目标，地址中的密码已隐藏）"""
     try:
-        # TODO: 从数据库或配置文件中读取设置
-        # 暂时返回默认设置
+        target = db_config.get_target(db_config.active)
+        try:
+            stored = await db_config.get_settings()
+        except Exception as e:
+            logger.warning("读取已保存的设置失败: %s", e)
+            stored = {}
         return Settings(
-            mongodb_url="mongodb://localhost:27017",
-            database_name="sql_results",
-            slow_sql_threshold=100.0,
-            default_collection=None,
-            page_size=20
+            mongodb_url=redact_url(target.url),
+            database_name=target.database_name,
+            slow_sql_threshold=stored.get("slow_sql_threshold", 100.0),
+            default_collection=stored.get("default_collection"),
+            page_size=stored.get("page_size", 20),
+            target=target.name,
+            read_preference=target.read_preference
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取设置失败: {str(e)}")
 
 @router.post("/settings")
 async def save_settings(settings: Settings):
-    """保存设置"""
+    """保存设置：新增或更新连接目标并设为活动目标（不需要重启，进行中的请求不受影响）
+
+    连接目标管理未开启时只保存阈值、默认集合和分页大小，连接信息必须与活动目标一致。
+    """
     try:
-        # TODO: 保存设置到数据库或配置文件
-        # 暂时只返回成功响应
-        return {"success": True, "message": "设置保存成功"}
+        if not db_config.management_enabled:
+            active = db_config.get_target(db_config.active)
+            url = _resolve_url(settings.mongodb_url, active.name)
+            if settings.target not in (None, active.name) or (url, settings.database_name, settings.read_preference) != (
+                active.url, active.database_name, active.read_preference
+            ):
+                raise HTTPException(status_code=403, detail="连接目标管理未开启（TARGET_MANAGEMENT_ENABLED），不能修改连接信息")
+            await db_config.save_settings(_app_settings(settings))
+            return {"success": True, "message": "设置保存成功", "target": active.name}
+        name = settings.target
+        if name is None:
+            # 未指定名称时按地址匹配已有目标，否则保存为custom
+            url = _resolve_url(settings.mongodb_url, db_config.active)
+            name = next(
+                (t.name for t in db_config.targets.values()
+                 if (t.url, t.database_name) == (url, settings.database_name)),
+                "custom"
+            )
+        url = _resolve_url(settings.mongodb_url, name)
+        current = db_config.targets.get(name)
+        if name == DEFAULT_TARGET:
+            if (url, settings.database_name) != (current.url, current.database_name):
+                raise HTTPException(status_code=400, detail="启动目标由环境变量配置，修改连接地址时请指定新的target名称")
+        else:
+            options = current.options() if current is not None else {}
+            options.update(url=url, database_name=settings.database_name, read_preference=settings.read_preference)
+            await db_config.put_target(name, options)
+        await db_config.activate(name)
+        await db_config.save_settings(_app_settings(settings))
+        return {"success": True, "message": "设置保存成功", "target": name}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"保存设置失败: {str(e)}")
 
@@ -261,16 +831,62 @@ async def save_settings(settings: Settings):
 async def test_connection(
     settings: Settings
 ):
-    """测试MongoDB连接"""
+    """测试提交的MongoDB连接地址（临时客户端，不影响已有连接池）"""
     try:
-        success = await db_config.test_connection()
-        if success:
-            return ConnectionTest(success=True, message="连接成功")
-        else:
-            return ConnectionTest(success=False, message="连接失败")
+        url = _resolve_url(settings.mongodb_url, settings.target or db_config.active)
+        success, message = await db_config.test_connection(url, settings.database_name)
+        return ConnectionTest(success=success, message=message)
     except Exception as e:
         return ConnectionTest(success=False, message=f"连接测试异常: {str(e)}")
 
+def require_target_management():
+    """连接目标管理接口未开启时不暴露（与管理接口的PROFILING_ENABLED相同处理）"""
+    if not db_config.management_enabled:
+        raise HTTPException(status_code=404, detail="连接目标管理未开启（TARGET_MANAGEMENT_ENABLED）")
+
+@router.get("/settings/targets")
+async def list_connection_targets():
+    """全部连接目标及健康状态"""
+    return db_config.describe()
+
+@router.put("/settings/targets/{name}", dependencies=[Depends(require_target_management)])
+async def put_connection_target(name: str, target: ConnectionTarget):
+    """新增或替换连接目标（替换时旧连接池在进行中的请求结束后关闭）"""
+    try:
+        options = target.model_dump(exclude={"activate"})
+        options["url"] = _resolve_url(options["url"], name)
+        saved = await db_config.put_target(name, options, activate=target.activate)
+        await saved.ping()
+        return db_config.describe()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"保存连接目标失败: {str(e)}")
+
+@router.delete("/settings/targets/{name}", dependencies=[Depends(require_target_management)])
+async def delete_connection_target(name: str):
+    """删除连接目标（不能删除启动目标和活动目标）"""
+    try:
+        await db_config.remove_target(name)
+        return db_config.describe()
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"连接目标不存在: {name}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除连接目标失败: {str(e)}")
+
+@router.post("/settings/targets/{name}/activate", dependencies=[Depends(require_target_management)])
+async def activate_connection_target(name: str):
+    """切换活动目标，各worker在下一次同步时切换"""
+    try:
+        await db_config.activate(name)
+        return db_config.describe()
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"连接目标不存在: {name}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"切换连接目标失败: {str(e)}")
+
 @router.get("/stats/script-names")
 async def get_script_names_by_range(
     collection: str,
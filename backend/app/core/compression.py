@@ -0,0 +1,137 @@
+"""响应压缩中间件
+
+按Accept-Encoding协商压缩算法：安装brotli时优先br，否则gzip。小于阈值的响应不压缩，
+已设置Content-Encoding的响应原样发送。流式响应（导出、渐进式统计）每个分块单独
+flush，客户端能及时收到已生成的部分。
+
+压缩后的响应内容与未压缩时不同，强ETag追加编码后缀（"abc" -> "abc-gzip"），
+比较If-None-Match时由http_cache.etag_matches去掉后缀。
+
+环境变量:
+    COMPRESSION_MIN_SIZE   压缩阈值（字节），默认1024
+    COMPRESSION_LEVEL      gzip压缩级别，默认6；brotli使用quality=COMPRESSION_LEVEL-1
+"""
+import os
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+# 不值得再压缩的内容类型
+SKIP_CONTENT_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "application/octet-stream")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按客户端支持的编码选择压缩算法"""
+    accepted = {item.split(";")[0].strip().lower() for item in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=max(level - 1, 0))
+        else:
+            # wbits=31: 带gzip头
+            self._impl = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._impl.process(data)
+            return out + (self._impl.finish() if final else self._impl.flush())
+        out = self._impl.compress(data)
+        return out + self._impl.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: Optional[int] = None, level: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+        self.level = level if level is not None else int(os.getenv("COMPRESSION_LEVEL", "6"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self.app, encoding, self.minimum_size, self.level)(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int, level: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.level = level
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor: Optional[_Compressor] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _prepare_headers(self, length: Optional[int]) -> None:
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/") and etag.endswith('"'):
+            headers["ETag"] = f'{etag[:-1]}-{self.encoding}"'
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("Content-Type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or message.get("status", 200) in (204, 304)
+                or content_type.startswith(SKIP_CONTENT_TYPES)
+            )
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if self.passthrough or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding, self.level)
+            compressed = self.compressor.compress(body, final=not more_body)
+            self._prepare_headers(None if more_body else len(compressed))
+            await self.send(self.initial_message)
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+        compressed = self.compressor.compress(body, final=not more_body)
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
@@ -1,30 +1,411 @@
-import motor.motor_asyncio
+"""MongoDB连接目标注册表
+
+一个服务可以连接多个集群（预发、生产只读副本、归档库等）。每个连接目标有独立的连接池、
+读偏好和超时设置；请求默认使用活动目标，也可以用请求头 X-Mongo-Target 或查询参数 target
+指定其他目标（见routes.get_database）。
+
+启动目标（名称default）来自环境变量，不能通过接口修改或删除。通过设置接口新增/修改的目标、
+活动目标和应用设置保存在启动目标数据库的 _connection_targets / _app_settings 集合中，
+各worker进程在后台健康检查时同步，不需要重启。替换或删除目标时旧连接池不立即关闭，
+进行中的请求继续使用，MONGODB_RETIRE_SECONDS后关闭。新增/替换/删除/切换目标的接口
+（/settings/targets）以及 POST /settings 中的连接信息可以把服务指向任意地址，只在
+TARGET_MANAGEMENT_ENABLED=true 时开放。
+
+环境变量:
+    MONGODB_URL                          启动目标连接地址
+    DATABASE_NAME                        启动目标数据库名
+    MONGODB_MAX_POOL_SIZE                默认连接池大小，默认100
+    MONGODB_READ_PREFERENCE              启动目标读偏好，默认primary
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS  默认服务器选择超时（毫秒），默认30000
+    MONGODB_CONNECT_TIMEOUT_MS           默认建立连接超时（毫秒），默认20000
+    MONGODB_SOCKET_TIMEOUT_MS            默认套接字超时（毫秒），默认0表示不限制
+    MONGODB_HEALTH_INTERVAL              健康检查与目标同步间隔（秒），默认15
+    MONGODB_RETIRE_SECONDS               被替换的连接池延迟关闭时间（秒），默认60
+    TARGET_MANAGEMENT_ENABLED            是否开放连接目标管理接口，默认false
+"""
+import asyncio
+import contextvars
+import logging
 import os
-from typing import Optional
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import motor.motor_asyncio
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET = "default"
+TARGETS_COLLECTION = "_connection_targets"
+SETTINGS_COLLECTION = "_app_settings"
+READ_PREFERENCES = ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+TARGET_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+# 健康检查单次ping的超时（秒）
+PING_TIMEOUT = 5.0
+
+# 当前请求选择的目标，None表示活动目标
+_request_target: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("mongo_target", default=None)
+
+
+def redact_url(url: str) -> str:
+    """隐藏连接地址中的密码"""
+    return re.sub(r"(//[^:/@]+):[^@/]*@", r"\1:***@", url)
+
+
+class MongoTarget:
+    """一个连接目标及其连接池"""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        database_name: str,
+        read_preference: str = "primary",
+        max_pool_size: Optional[int] = None,
+        server_selection_timeout_ms: Optional[int] = None,
+        connect_timeout_ms: Optional[int] = None,
+        socket_timeout_ms: Optional[int] = None,
+    ):
+        if not TARGET_NAME_RE.match(name):
+            raise ValueError(f"连接目标名称只能包含字母、数字和 _ . -: {name}")
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError(f"不支持的读偏好: {read_preference}")
+        self.name = name
+        self.url = url
+        self.database_name = database_name
+        self.read_preference = read_preference
+        self.max_pool_size = max_pool_size or int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+        self.server_selection_timeout_ms = server_selection_timeout_ms or int(
+            os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+        self.connect_timeout_ms = connect_timeout_ms or int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "20000"))
+        self.socket_timeout_ms = socket_timeout_ms if socket_timeout_ms is not None else int(
+            os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "0"))
+        self._client = None
+        self.healthy: Optional[bool] = None
+        self.latency_ms: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def options(self) -> Dict[str, Any]:
+        """可持久化的配置"""
+        return {
+            "url": self.url,
+            "database_name": self.database_name,
+            "read_preference": self.read_preference,
+            "max_pool_size": self.max_pool_size,
+            "server_selection_timeout_ms": self.server_selection_timeout_ms,
+            "connect_timeout_ms": self.connect_timeout_ms,
+            "socket_timeout_ms": self.socket_timeout_ms,
+        }
+
+    def get_client(self):
+        """目标的异步客户端（进程内共享同一个连接池）"""
+        if self._client is None:
+            self._client = motor.motor_asyncio.AsyncIOMotorClient(
+                self.url,
+                maxPoolSize=self.max_pool_size,
+                readPreference=self.read_preference,
+                serverSelectionTimeoutMS=self.server_selection_timeout_ms,
+                connectTimeoutMS=self.connect_timeout_ms,
+                socketTimeoutMS=self.socket_timeout_ms or None,
+            )
+        return self._client
+
+    def get_database(self):
+        return self.get_client()[self.database_name]
+
+    async def ping(self, timeout: float = PING_TIMEOUT) -> bool:
+        """ping并记录健康状态"""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.get_client().admin.command("ping"), timeout)
+            self.healthy, self.error = True, None
+            self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.healthy, self.latency_ms = False, None
+            self.error = str(e) or type(e).__name__
+        self.checked_at = time.time()
+        return self.healthy
+
+    def describe(self) -> Dict[str, Any]:
+        info = self.options()
+        info["url"] = redact_url(self.url)
+        info.update({
+            "name": self.name,
+            "healthy": self.healthy,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "error": self.error,
+        })
+        return info
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
 
 class DatabaseConfig:
     def __init__(self):
         self.mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
         self.database_name = os.getenv("DATABASE_NAME", "sql_results")
-        
-    def get_client(self):
-        """获取MongoDB异步客户端"""
-        return motor.motor_asyncio.AsyncIOMotorClient(self.mongodb_url)
-    
-    def get_database(self, client=None):
+        self.max_pool_size = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+        self.health_interval = float(os.getenv("MONGODB_HEALTH_INTERVAL", "15"))
+        self.retire_seconds = float(os.getenv("MONGODB_RETIRE_SECONDS", "60"))
+        self.management_enabled = os.getenv("TARGET_MANAGEMENT_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.targets: Dict[str, MongoTarget] = {
+            DEFAULT_TARGET: MongoTarget(
+                DEFAULT_TARGET, self.mongodb_url, self.database_name,
+                read_preference=os.getenv("MONGODB_READ_PREFERENCE", "primary"),
+                max_pool_size=self.max_pool_size,
+            )
+        }
+        self.active = DEFAULT_TARGET
+        self._retired: List[Tuple[float, MongoTarget]] = []
+        self._listeners: List[Callable[[str, str], Awaitable[None]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- 目标选择 ----
+
+    def get_target(self, name: Optional[str] = None) -> MongoTarget:
+        """按名称取目标，未指定时为当前请求选择的目标或活动目标；不存在时抛出KeyError"""
+        name = name or _request_target.get() or self.active
+        target = self.targets.get(name)
+        if target is None:
+            raise KeyError(name)
+        return target
+
+    def get_client(self, target: Optional[str] = None):
+        """获取MongoDB异步客户端（每个目标一个连接池）"""
+        return self.get_target(target).get_client()
+
+    def get_database(self, client=None, target: Optional[str] = None):
         """获取数据库实例"""
+        selected = self.get_target(target)
         if client is None:
-            client = self.get_client()
-        return client[self.database_name]
-    
-    async def test_connection(self) -> bool:
-        """测试数据库连接"""
-        try:
-            client = self.get_client()
-            await client.admin.command('ping')
-            return True
-        except Exception:
+            client = selected.get_client()
+        return client[selected.database_name]
+
+    def use_target(self, name: Optional[str]) -> str:
+        """设置当前请求使用的目标（请求依赖中调用），返回目标名"""
+        name = name or self.active
+        self.get_target(name)
+        _request_target.set(None if name == self.active else name)
+        return name
+
+    def current_target(self) -> str:
+        return _request_target.get() or self.active
+
+    def qualify(self, collection_name: str) -> str:
+        """进程内缓存使用的集合键：活动目标为集合名本身，其他目标加目标名前缀"""
+        target = _request_target.get()
+        if target is None or target == self.active:
+            return collection_name
+        return f"{target}/{collection_name}"
+
+    def scope(self, collection_name: str) -> Tuple[str, str, str]:
+        """当前目标的(连接地址, 数据库, 集合)，用于进程内"已创建索引"一类的标记
+
+        与qualify不同，活动目标切换或目标被替换为其他地址后键随之变化。
+        """
+        target = self.get_target()
+        return (target.url, target.database_name, collection_name)
+
+    def add_listener(self, callback: Callable[[str, str], Awaitable[None]]) -> None:
+        """注册目标变化回调 callback(event, name)，event为activate/replace/remove"""
+        self._listeners.append(callback)
+
+    async def _notify(self, event: str, name: str) -> None:
+        for callback in self._listeners:
+            try:
+                await callback(event, name)
+            except Exception as e:
+                logger.warning("连接目标变化回调失败: %s", e, extra={"event": event, "target": name})
+
+    # ---- 目标管理 ----
+
+    def _store(self):
+        return self.targets[DEFAULT_TARGET].get_database()
+
+    def _retire(self, target: MongoTarget) -> None:
+        """旧连接池延迟关闭，进行中的请求继续使用"""
+        self._retired.append((time.monotonic() + self.retire_seconds, target))
+
+    async def _apply_target(self, name: str, options: Dict[str, Any]) -> bool:
+        """在内存中新增或替换目标，配置未变化时返回False"""
+        current = self.targets.get(name)
+        target = MongoTarget(name, **options)
+        if current is not None and current.options() == target.options():
+            return False
+        self.targets[name] = target
+        if current is not None:
+            self._retire(current)
+            await self._notify("replace", name)
+        logger.info("连接目标已更新", extra={"target": name, "url": redact_url(target.url)})
+        return True
+
+    async def _apply_active(self, name: str) -> bool:
+        if name == self.active or name not in self.targets:
             return False
+        previous, self.active = self.active, name
+        logger.info("活动连接目标已切换", extra={"previous": previous, "target": name})
+        await self._notify("activate", name)
+        return True
+
+    async def _drop_target(self, name: str) -> None:
+        target = self.targets.pop(name, None)
+        if target is not None:
+            self._retire(target)
+            await self._notify("remove", name)
+
+    async def put_target(self, name: str, options: Dict[str, Any], activate: bool = False) -> MongoTarget:
+        """新增或替换目标并持久化（启动目标不能修改）"""
+        if name == DEFAULT_TARGET:
+            raise ValueError("启动目标由环境变量配置，不能修改")
+        options = {k: v for k, v in options.items() if v is not None}
+        MongoTarget(name, **options)  # 先校验，避免写入无效配置
+        await self._store()[TARGETS_COLLECTION].replace_one(
+            {"_id": name}, dict(options, updated_at=time.time()), upsert=True
+        )
+        await self._apply_target(name, options)
+        if activate:
+            await self.activate(name)
+        return self.targets[name]
+
+    async def remove_target(self, name: str) -> None:
+        if name == DEFAULT_TARGET:
+            raise ValueError("启动目标不能删除")
+        if name not in self.targets:
+            raise KeyError(name)
+        if name == self.active:
+            raise ValueError("不能删除活动目标，请先切换到其他目标")
+        await self._store()[TARGETS_COLLECTION].delete_one({"_id": name})
+        await self._drop_target(name)
+
+    async def activate(self, name: str) -> None:
+        """切换活动目标并持久化，其他worker在下一次同步时切换"""
+        self.get_target(name)
+        await self._store()[SETTINGS_COLLECTION].update_one(
+            {"_id": "settings"}, {"$set": {"active_target": name, "updated_at": time.time()}}, upsert=True
+        )
+        await self._apply_active(name)
+
+    async def load(self) -> None:
+        """从启动目标同步目标列表和活动目标"""
+        store = self._store()
+        stored = {}
+        async for doc in store[TARGETS_COLLECTION].find({}):
+            name = doc.pop("_id")
+            doc.pop("updated_at", None)
+            if name != DEFAULT_TARGET:
+                stored[name] = doc
+        for name, options in stored.items():
+            try:
+                await self._apply_target(name, options)
+            except (TypeError, ValueError) as e:
+                logger.warning("忽略无效的连接目标配置: %s", e, extra={"target": name})
+        settings = await store[SETTINGS_COLLECTION].find_one({"_id": "settings"}) or {}
+        active = settings.get("active_target") or DEFAULT_TARGET
+        if active in self.targets:
+            await self._apply_active(active)
+        for name in [n for n in self.targets if n != DEFAULT_TARGET and n not in stored and n != self.active]:
+            await self._drop_target(name)
+
+    # ---- 应用设置 ----
+
+    async def get_settings(self) -> Dict[str, Any]:
+        doc = await self._store()[SETTINGS_COLLECTION].find_one({"_id": "settings"}) or {}
+        doc.pop("_id", None)
+        return doc
+
+    async def save_settings(self, values: Dict[str, Any]) -> None:
+        await self._store()[SETTINGS_COLLECTION].update_one(
+            {"_id": "settings"}, {"$set": dict(values, updated_at=time.time())}, upsert=True
+        )
+
+    # ---- 健康检查 ----
+
+    async def check_health(self) -> Dict[str, bool]:
+        """并发ping全部目标"""
+        targets = list(self.targets.values())
+        results = await asyncio.gather(*(t.ping() for t in targets))
+        for target, healthy in zip(targets, results):
+            if not healthy:
+                logger.warning("连接目标不可用: %s", target.error, extra={"target": target.name})
+        return {t.name: healthy for t, healthy in zip(targets, results)}
+
+    def _close_retired(self) -> None:
+        now = time.monotonic()
+        keep = []
+        for deadline, target in self._retired:
+            if deadline <= now:
+                target.close()
+            else:
+                keep.append((deadline, target))
+        self._retired = keep
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("连接目标同步失败: %s", e)
+            try:
+                await self.check_health()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("连接目标健康检查失败: %s", e)
+            self._close_retired()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self) -> None:
+        """启动后台同步和健康检查"""
+        if self.health_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "targets": [dict(t.describe(), active=t.name == self.active) for t in self.targets.values()],
+            "retired": len(self._retired),
+        }
+
+    def close(self):
+        """关闭全部连接池"""
+        for target in self.targets.values():
+            target.close()
+        for _, target in self._retired:
+            target.close()
+        self._retired = []
+
+    async def test_connection(self, url: Optional[str] = None, database_name: Optional[str] = None,
+                              timeout_ms: int = 5000) -> Tuple[bool, str]:
+        """测试数据库连接；指定url时用临时客户端测试该地址，不影响已有连接池"""
+        if url is None:
+            target = self.get_target()
+            return (await target.ping(), target.error or "连接成功")
+        target = MongoTarget("test", url, database_name or self.database_name,
+                             server_selection_timeout_ms=timeout_ms, connect_timeout_ms=timeout_ms)
+        try:
+            if await target.ping(timeout=timeout_ms / 1000 + 1):
+                return True, f"连接成功（{target.latency_ms}ms）"
+            return False, target.error or "连接失败"
+        finally:
+            target.close()
 
 # 全局数据库配置实例
-db_config = DatabaseConfig()
\ No newline at end of file
+db_config = DatabaseConfig()
@@ -0,0 +1,209 @@
+"""查询执行控制
+
+- 按查询类别设置MongoDB的maxTimeMS
+- 客户端断开时取消请求，并终止MongoDB中仍在运行的操作和游标
+- 按端点限制并发，排队超时则拒绝
+- 超时或被拒绝时，由调用方回退到过期的缓存结果
+
+环境变量:
+    QUERY_TIMEOUT_STATS_MS     统计聚合maxTimeMS，默认15000
+    QUERY_TIMEOUT_LIST_MS      列表/搜索查询maxTimeMS，默认5000
+    QUERY_TIMEOUT_DETAIL_MS    详情查询maxTimeMS，默认5000
+    QUERY_TIMEOUT_EXPORT_MS    导出游标maxTimeMS（按游标累计），默认0即不限制
+    STATS_MAX_CONCURRENCY      每个统计端点的最大并发数，默认4
+    STATS_QUEUE_TIMEOUT        排队等待秒数，超过则拒绝，默认2
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from fastapi import HTTPException, Request, Response
+from pymongo.errors import ExecutionTimeout
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的操作标记，写入MongoDB命令的comment，用于断开时定位并终止操作
+_op_tag: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("op_tag", default=None)
+# 断开后在独立任务中终止操作，保存引用避免任务被回收
+_kill_tasks: Set[asyncio.Task] = set()
+
+
+class ExecutionConfig:
+    def __init__(self):
+        self.timeouts = {
+            "stats": int(os.getenv("QUERY_TIMEOUT_STATS_MS", "15000")),
+            "list": int(os.getenv("QUERY_TIMEOUT_LIST_MS", "5000")),
+            "detail": int(os.getenv("QUERY_TIMEOUT_DETAIL_MS", "5000")),
+            "export": int(os.getenv("QUERY_TIMEOUT_EXPORT_MS", "0")),
+        }
+        self.max_concurrency = int(os.getenv("STATS_MAX_CONCURRENCY", "4"))
+        self.queue_timeout = float(os.getenv("STATS_QUEUE_TIMEOUT", "2"))
+        self.disconnect_poll_interval = 0.2
+
+
+execution_config = ExecutionConfig()
+
+
+class AdmissionRejected(Exception):
+    """并发已满且排队超时"""
+
+
+def query_options(query_class: str) -> Dict[str, Any]:
+    """aggregate/count_documents使用的参数"""
+    options: Dict[str, Any] = {"maxTimeMS": execution_config.timeouts.get(query_class, 0)}
+    tag = _op_tag.get()
+    if tag:
+        options["comment"] = tag
+    return options
+
+
+def find_options(query_class: str) -> Dict[str, Any]:
+    """find使用的参数（参数名与aggregate不同）"""
+    options: Dict[str, Any] = {"max_time_ms": execution_config.timeouts.get(query_class, 0)}
+    tag = _op_tag.get()
+    if tag:
+        options["comment"] = tag
+    return options
+
+
+def new_operation_tag() -> str:
+    return f"sqlplan:{uuid.uuid4().hex}"
+
+
+def start_tagged(tag: str, func: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+    """在带操作标记的上下文中启动func（任务复制创建时的上下文，其中的查询都带该标记）"""
+    token = _op_tag.set(tag)
+    try:
+        return asyncio.ensure_future(func())
+    finally:
+        _op_tag.reset(token)
+
+
+def detach_operation() -> None:
+    """在后台任务开头调用：不继承创建它的请求的操作标记，请求断开时不会被一并终止"""
+    _op_tag.set(None)
+
+
+class AdmissionController:
+    """按端点名限制并发"""
+
+    def __init__(self):
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(execution_config.max_concurrency)
+        return self._semaphores[name]
+
+    async def acquire(self, name: str) -> Callable[[], None]:
+        """占用一个名额，返回释放函数（可重复调用）；用于生命周期超出单次调用的流式响应"""
+        semaphore = self._semaphore(name)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=execution_config.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected(name)
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                semaphore.release()
+        return release
+
+    async def run(self, name: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        release = await self.acquire(name)
+        try:
+            return await func()
+        finally:
+            release()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            name: {"available": sem._value, "limit": execution_config.max_concurrency}
+            for name, sem in self._semaphores.items()
+        }
+
+
+admission = AdmissionController()
+
+
+async def kill_tagged_operations(db, tag: str) -> int:
+    """终止带有指定comment的运行中操作和空闲游标，返回终止数量"""
+    killed = 0
+    try:
+        admin = db.client.admin
+        ops = await admin.aggregate([
+            {"$currentOp": {"idleCursors": True}},
+            {"$match": {"$or": [
+                {"command.comment": tag},
+                {"cursor.originatingCommand.comment": tag},
+            ]}},
+        ]).to_list(None)
+        for op in ops:
+            if op.get("type") == "idleCursor":
+                namespace = op.get("ns", "")
+                cursor_id = op.get("cursor", {}).get("cursorId")
+                if "." in namespace and cursor_id:
+                    database_name, collection_name = namespace.split(".", 1)
+                    await db.client[database_name].command("killCursors", collection_name, cursors=[cursor_id])
+                    killed += 1
+            elif "opid" in op:
+                await admin.command("killOp", op=op["opid"])
+                killed += 1
+    except Exception as e:
+        # 没有权限或部署不支持时只记录日志
+        logger.warning("终止MongoDB操作失败: %s", e, extra={"op_tag": tag})
+    return killed
+
+
+def kill_tagged_operations_later(db, tag: str) -> None:
+    """在独立任务中终止带标记的操作（调用方已被取消，不能再等待）"""
+    task = asyncio.ensure_future(kill_tagged_operations(db, tag))
+    _kill_tasks.add(task)
+    task.add_done_callback(_kill_tasks.discard)
+
+
+async def run_with_disconnect_cancel(request: Request, db, func: Callable[[], Awaitable[Any]]) -> Any:
+    """运行func，客户端断开时取消并终止MongoDB侧的操作"""
+    tag = new_operation_tag()
+    task = start_tagged(tag, func)
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=execution_config.disconnect_poll_interval)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            killed = await kill_tagged_operations(db, tag)
+            logger.info("客户端已断开，取消请求", extra={"path": request.url.path, "killed_ops": killed})
+            # 499: 客户端关闭连接（nginx约定），响应不会被读取
+            raise HTTPException(status_code=499, detail="客户端已断开")
+
+
+async def run_stats_query(
+    request: Request,
+    response: Response,
+    db,
+    endpoint: str,
+    func: Callable[[], Awaitable[Any]],
+    stale: Callable[[], Optional[Any]],
+) -> Any:
+    """统计端点的统一执行入口：并发控制 + 断开取消 + 超时/拒绝时回退过期缓存"""
+    try:
+        return await admission.run(endpoint, lambda: run_with_disconnect_cancel(request, db, func))
+    except (AdmissionRejected, ExecutionTimeout) as e:
+        stale_result = stale()
+        reason = "overloaded" if isinstance(e, AdmissionRejected) else "timeout"
+        if stale_result is not None:
+            response.headers["X-Stale"] = reason
+            # 过期结果与当前高水位不对应，不能用于缓存校验
+            if "etag" in response.headers:
+                del response.headers["etag"]
+            return stale_result
+        if reason == "overloaded":
+            raise HTTPException(status_code=503, detail="统计服务繁忙，请稍后重试", headers={"Retry-After": "2"})
+        raise HTTPException(status_code=504, detail="统计查询超时")
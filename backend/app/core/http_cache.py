@@ -0,0 +1,167 @@
+"""HTTP缓存校验
+
+- 详情: 记录写入后不再变化，使用强ETag "<_id>-<计划哈希>"。已返回过的ETag保存在进程内，
+  If-None-Match命中时直接返回304，不访问MongoDB
+- 统计: 结果只随集合变化，使用弱ETag，由集合高水位（最大timestamp + 文档数估计）与查询参数
+  计算。高水位在进程内缓存HTTP_ETAG_HWM_TTL秒，期间的304不访问MongoDB；集合变化通知可调用
+  high_water_marks.invalidate()立即失效
+- 详情支持MessagePack表示（Accept: application/msgpack，需要安装msgpack）
+- 进程内的ETag和高水位按 db_config.qualify(集合名) 索引，X-Mongo-Target 选择的不同目标互不影响，
+  详情响应带 Vary: X-Mongo-Target
+
+环境变量:
+    HTTP_ETAG_HWM_TTL        集合高水位缓存秒数，默认5
+    HTTP_DETAIL_ETAG_SIZE    进程内保存的详情ETag数，默认10000
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.core import serialization
+from app.core.database import db_config
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+# 压缩中间件追加的编码后缀
+ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+def _normalize(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match是否命中（弱比较）"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    target = _normalize(etag)
+    return any(_normalize(tag) == target for tag in header.split(","))
+
+
+def not_modified(etag: str, cache_control: str, vary: Optional[str] = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if vary:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("Accept", "")
+    return msgpack is not None and any(t in accept for t in MSGPACK_TYPES)
+
+
+def render(request: Request, payload: Any, headers: Dict[str, str]) -> Any:
+    """按Accept返回MessagePack或交给FastAPI按JSON序列化"""
+    if not wants_msgpack(request):
+        return payload
+    body = msgpack.packb(serialization.to_jsonable(payload), use_bin_type=True)
+    return Response(content=body, media_type=MSGPACK_TYPES[0], headers=headers)
+
+
+def content_hash(value: Any) -> str:
+    """计划内容哈希（记录没有plan_hash时使用）"""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+class DetailETags:
+    """已返回的详情ETag，按(带目标的集合名, id, 表示)索引"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._tags: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[str]:
+        tag = self._tags.get(key)
+        if tag is not None:
+            self._tags.move_to_end(key)
+        return tag
+
+    def put(self, key: Tuple[str, str, str], tag: str) -> None:
+        self._tags[key] = tag
+        self._tags.move_to_end(key)
+        while len(self._tags) > self.max_size:
+            self._tags.popitem(last=False)
+
+    def invalidate(self, collection_name: str) -> None:
+        scope = db_config.qualify(collection_name)
+        for key in [k for k in self._tags if k[0] == scope]:
+            del self._tags[key]
+
+    def clear(self) -> None:
+        self._tags.clear()
+
+
+class HighWaterMarks:
+    """集合高水位缓存"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._marks: Dict[str, Tuple[float, str]] = {}
+
+    async def get(self, db, collection_name: str) -> str:
+        key = db_config.qualify(collection_name)
+        cached = self._marks.get(key)
+        now = time.monotonic()
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+        collection = db[collection_name]
+        latest = await collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", -1)])
+        count = await collection.estimated_document_count()
+        mark = f"{(latest or {}).get('timestamp')}:{count}"
+        self._marks[key] = (now, mark)
+        return mark
+
+    def invalidate(self, collection_name: Optional[str] = None) -> None:
+        """清理集合的高水位（与get使用相同的带目标的键），不指定集合时全部清理"""
+        if collection_name is None:
+            self._marks.clear()
+        else:
+            self._marks.pop(db_config.qualify(collection_name), None)
+
+
+detail_etags = DetailETags(int(os.getenv("HTTP_DETAIL_ETAG_SIZE", "10000")))
+high_water_marks = HighWaterMarks(float(os.getenv("HTTP_ETAG_HWM_TTL", "5")))
+
+DETAIL_CACHE_CONTROL = "private, max-age=3600"
+# 同一URL按请求头选择连接目标和表示
+DETAIL_VARY = "Accept, X-Mongo-Target"
+STATS_CACHE_CONTROL = "no-cache"
+
+
+def detail_etag(record_id: str, plan_hash: str, representation: str) -> str:
+    suffix = "" if representation == "json" else f"-{representation}"
+    return f'"{record_id}-{plan_hash}{suffix}"'
+
+
+async def check_stats_etag(request: Request, response: Response, db, collection_name: str) -> Optional[Response]:
+    """计算统计接口的弱ETag；命中If-None-Match时返回304响应，否则写入响应头并返回None"""
+    mark = await high_water_marks.get(db, collection_name)
+    params = sorted(request.query_params.multi_items())
+    scope = db_config.qualify(collection_name)
+    digest = hashlib.sha256(f"{request.url.path}|{scope}|{mark}|{params}".encode("utf-8")).hexdigest()[:20]
+    etag = f'W/"{digest}"'
+    if etag_matches(request, etag):
+        return not_modified(etag, STATS_CACHE_CONTROL)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = STATS_CACHE_CONTROL
+    return None
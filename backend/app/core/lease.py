@@ -0,0 +1,37 @@
+"""后台任务的集群租约
+
+多worker（WEB_CONCURRENCY）或多主机部署时，每个进程都会启动相同的定期任务。结果写回数据库、
+与进程无关的任务（趋势rollup刷新、复杂度增量计算）每轮先在 _scheduler_leases 中抢占租约，
+只有抢到的进程执行本轮；租约不主动释放，约一个间隔后到期，下一轮再由任意进程抢占，
+因此整个集群每个间隔大约执行一次。执行时间超过间隔时下一轮可能与之重叠，这些任务是幂等的。
+"""
+import os
+import socket
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# 本进程的租约持有者标识
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# 定期任务的租约时长取间隔的比例，略短于间隔使持有者下一轮醒来时租约已到期
+ROUND_FRACTION = 0.9
+
+
+def _leases(db):
+    return db["_scheduler_leases"]
+
+
+async def acquire(db, name: str, seconds: float) -> bool:
+    """抢占名为name的租约seconds秒；其他进程持有未到期的租约时返回False"""
+    now = time.time()
+    try:
+        await _leases(db).find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": OWNER}]},
+            {"$set": {"owner": OWNER, "expires_at": now + seconds, "acquired_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # 文档存在且被其他进程持有，upsert插入同一_id失败
+        return False
+    return True
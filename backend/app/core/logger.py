@@ -0,0 +1,123 @@
+"""日志配置
+
+基于标准库logging，通过QueueHandler/QueueListener把实际的格式化和输出
+放到后台线程中执行，请求处理协程只负责把日志记录放入队列。
+
+环境变量:
+    LOG_LEVEL          根日志级别，默认INFO
+    LOG_LEVELS         按模块设置级别，例如 "app.services.analysis=DEBUG,app.services.complexity=WARNING"
+    LOG_FORMAT         输出格式，json（默认）或 text
+    LOG_SAMPLE_RATE    逐记录调试日志的采样率，0~1，默认0.01
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional
+
+# 标准LogRecord自带的属性，JSON输出时只追加额外字段
+_RESERVED_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志格式"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """对标记了sampled=True的日志按比例采样，其余日志不受影响
+
+    使用计数器而不是随机数，采样结果稳定且开销固定。
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        rate = min(max(rate, 0.0), 1.0)
+        self.every = int(round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        if self.every == 0:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+def _parse_module_levels(spec: str) -> Dict[str, int]:
+    """解析 "模块=级别,模块=级别" 格式的配置"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        name, level = name.strip(), level.strip().upper()
+        if name and level in logging._nameToLevel:
+            levels[name] = logging._nameToLevel[level]
+    return levels
+
+
+def setup_logging() -> None:
+    """初始化日志系统，重复调用是安全的"""
+    global _listener
+    if _listener is not None:
+        return
+
+    root_level = os.getenv("LOG_LEVEL", "INFO").upper()
+    log_format = os.getenv("LOG_FORMAT", "json").lower()
+    sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if log_format == "text":
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(logging._nameToLevel.get(root_level, logging.INFO))
+
+    for name, level in _parse_module_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """停止后台日志线程，并刷新队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志对象"""
+    return logging.getLogger(name)
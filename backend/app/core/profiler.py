@@ -0,0 +1,241 @@
+"""请求级采样分析器
+
+按需对单个请求进行采样分析：后台线程按固定间隔抓取事件循环线程的调用栈，
+请求结束后把结果保存为折叠栈（collapsed stacks，可直接用于flamegraph.pl）
+或speedscope格式，保存在有界环形缓冲区中，通过管理接口读取。
+
+ProfileMiddleware是纯ASGI中间件，receive原样传给应用：BaseHTTPMiddleware会包装receive，
+路由中的request.is_disconnected()因此检测不到客户端断开（execution.run_with_disconnect_cancel失效）。
+分析在响应头发出时结束，与响应体的发送耗时无关。
+
+注意：事件循环线程上同时运行的其他协程也会被采样到，因此在高并发下
+结果反映的是请求期间整个事件循环的耗时分布。等待MongoDB返回的时间
+表现为selector的select/epoll帧。
+
+环境变量:
+    PROFILING_ENABLED       是否允许分析，默认false
+    PROFILING_HEADER        触发分析的请求头，默认X-Profile（查询参数__profile=1同样有效）
+    PROFILING_SAMPLE_EVERY  自动每N个请求分析一次，0表示关闭，默认0
+    PROFILING_INTERVAL_MS   采样间隔毫秒，默认5
+    PROFILING_BUFFER_SIZE   保留的分析结果数量，默认50
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class ProfilerConfig:
+    def __init__(self):
+        self.enabled = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.header = os.getenv("PROFILING_HEADER", "X-Profile")
+        self.sample_every = int(os.getenv("PROFILING_SAMPLE_EVERY", "0"))
+        self.interval = int(os.getenv("PROFILING_INTERVAL_MS", "5")) / 1000.0
+        self.buffer_size = int(os.getenv("PROFILING_BUFFER_SIZE", "50"))
+
+
+class SamplingProfiler:
+    """对指定线程进行栈采样"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+
+class ProfileStore:
+    """分析结果的有界环形缓冲区"""
+
+    def __init__(self):
+        self.config = ProfilerConfig()
+        self._profiles: deque = deque(maxlen=self.config.buffer_size)
+        self._counter = itertools.count(1)
+        self._snapshots: deque = deque(maxlen=2)
+
+    def should_profile(self, headers, query_params) -> bool:
+        """根据请求头、查询参数和采样频率决定是否分析当前请求"""
+        if not self.config.enabled:
+            return False
+        if headers.get(self.config.header, "").lower() in ("1", "true", "yes"):
+            return True
+        if query_params.get("__profile") in ("1", "true"):
+            return True
+        every = self.config.sample_every
+        return every > 0 and next(self._counter) % every == 0
+
+    def start(self) -> SamplingProfiler:
+        profiler = SamplingProfiler(threading.get_ident(), self.config.interval)
+        profiler.start()
+        return profiler
+
+    def finish(self, profiler: SamplingProfiler, method: str, path: str, status_code: int, duration_ms: float) -> str:
+        profiler.stop()
+        profile_id = uuid.uuid4().hex[:12]
+        self._profiles.append({
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "samples": profiler.samples,
+            "interval_ms": profiler.interval * 1000,
+            "created_at": time.time(),
+            "stacks": profiler.stacks,
+        })
+        return profile_id
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        return [
+            {k: v for k, v in p.items() if k != "stacks"}
+            for p in reversed(self._profiles)
+        ]
+
+    def get_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for profile in self._profiles:
+            if profile["id"] == profile_id:
+                return profile
+        return None
+
+    @staticmethod
+    def to_collapsed(profile: Dict[str, Any]) -> str:
+        """折叠栈格式：每行 "帧;帧;帧 次数" """
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in profile["stacks"].most_common()
+        )
+
+    @staticmethod
+    def to_speedscope(profile: Dict[str, Any]) -> Dict[str, Any]:
+        """speedscope的sampled格式"""
+        frame_index: Dict[str, int] = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in profile["stacks"].items():
+            indexes = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indexes.append(frame_index[name])
+            samples.append(indexes)
+            weights.append(count * profile["interval_ms"])
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{profile['method']} {profile['path']}",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": profile["id"],
+            "exporter": "sqlplan-visualizer",
+        }
+
+    def take_memory_snapshot(self) -> Dict[str, Any]:
+        """记录一次tracemalloc快照，首次调用时开始追踪"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "10")))
+        self._snapshots.append((time.time(), tracemalloc.take_snapshot()))
+        current, peak = tracemalloc.get_traced_memory()
+        return {"snapshots": len(self._snapshots), "traced_current": current, "traced_peak": peak}
+
+    def memory_diff(self, top: int = 20, filename: Optional[str] = None) -> Dict[str, Any]:
+        """对比最近两次快照，返回增长最多的分配位置"""
+        if len(self._snapshots) < 2:
+            return {"ready": False, "snapshots": len(self._snapshots), "top": []}
+        (t1, old), (t2, new) = self._snapshots[0], self._snapshots[1]
+        if filename:
+            filters = [tracemalloc.Filter(True, f"*{filename}*")]
+            old, new = old.filter_traces(filters), new.filter_traces(filters)
+        stats = new.compare_to(old, "lineno")
+        return {
+            "ready": True,
+            "interval_seconds": round(t2 - t1, 1),
+            "total_diff": sum(s.size_diff for s in stats),
+            "top": [
+                {
+                    "location": str(s.traceback),
+                    "size_diff": s.size_diff,
+                    "size": s.size,
+                    "count_diff": s.count_diff,
+                }
+                for s in stats[:top]
+            ],
+        }
+
+
+# 全局分析结果存储
+profile_store = ProfileStore()
+
+
+class ProfileMiddleware:
+    """按需对请求进行采样分析，响应头X-Profile-Id返回分析结果ID"""
+
+    def __init__(self, app: ASGIApp, store: Optional[ProfileStore] = None):
+        self.app = app
+        self.store = store or profile_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.store.should_profile(
+            Headers(scope=scope), QueryParams(scope.get("query_string", b""))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = self.store.start()
+        start = time.perf_counter()
+        finished = False
+
+        def finish(status_code: int) -> str:
+            nonlocal finished
+            finished = True
+            return self.store.finish(
+                profiler, scope["method"], scope["path"], status_code, (time.perf_counter() - start) * 1000
+            )
+
+        async def send_with_profile(message: Message) -> None:
+            if message["type"] == "http.response.start" and not finished:
+                MutableHeaders(scope=message)["X-Profile-Id"] = finish(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if not finished:
+                finish(500)
@@ -0,0 +1,128 @@
+"""运行时状态：就绪检查、启动预热与优雅下线
+
+- 启动后在后台连接MongoDB（失败时重试），同步已保存的连接目标并启动健康检查，
+  随后预热活动目标的集合目录和默认集合的统计缓存，完成后 /ready 才返回200；/health 只表示进程存活
+- 收到SIGTERM时先进入draining状态（/ready返回503，负载均衡摘除流量），
+  等待DRAIN_SECONDS后再停止接收连接并等待进行中的请求完成（见server.py）
+- 预热、集合目录和统计刷新填充的都是进程内缓存，多工作进程（WEB_CONCURRENCY=N）时每个进程
+  各自预热和刷新：启动时默认集合的统计聚合执行N次，目录刷新（CATALOG_REFRESH_SECONDS）和
+  统计刷新（STATS_REFRESH_CONCURRENCY）对MongoDB的负载也随N增长
+
+环境变量:
+    DEFAULT_COLLECTION        预热的默认集合，不设置时只预热集合目录
+    DEFAULT_SLOW_SQL_THRESHOLD  预热使用的慢SQL阈值，默认100
+    WARMUP_TIMEOUT            预热超时秒数，超时后仍置为就绪，默认60
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeState:
+    def __init__(self):
+        self.default_collection = os.getenv("DEFAULT_COLLECTION") or None
+        self.default_threshold = float(os.getenv("DEFAULT_SLOW_SQL_THRESHOLD", "100"))
+        self.warmup_timeout = float(os.getenv("WARMUP_TIMEOUT", "60"))
+        self.started_at = time.time()
+        self.mongo_connected = False
+        self.warmed_up = False
+        self.draining = False
+        self.warmup: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.mongo_connected and self.warmed_up and not self.draining
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "mongo_connected": self.mongo_connected,
+            "warmed_up": self.warmed_up,
+            "draining": self.draining,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "warmup": self.warmup,
+        }
+
+    async def _connect(self, client) -> None:
+        delay = 1.0
+        while True:
+            try:
+                await client.admin.command("ping")
+                self.mongo_connected = True
+                return
+            except Exception as e:
+                logger.warning("MongoDB连接失败，%.0f秒后重试: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _warm(self, db) -> None:
+        from app.services.analysis import AnalysisService
+        from app.services.catalog import collection_catalog
+        from app.services.stats_refresh import stats_refresher
+
+        steps = {"catalog": collection_catalog.get(db)}
+        if self.default_collection:
+            # 经由后台刷新调度器预热，键在被请求前也会保持新鲜
+            name, threshold = self.default_collection, self.default_threshold
+            steps["basic_stats"] = stats_refresher.serve(
+                AnalysisService._get_cache_key(name, is_basic=True),
+                lambda: AnalysisService.get_basic_collection_stats(db, name, use_cache=False),
+            )
+            steps["summary_stats"] = stats_refresher.serve(
+                AnalysisService.summary_cache_key(name, threshold),
+                lambda: AnalysisService.get_collection_stats(db, name, threshold),
+            )
+            steps["slow_sql_stats"] = stats_refresher.serve(
+                AnalysisService._get_cache_key(name, threshold),
+                lambda: AnalysisService.get_slow_sql_stats(db, name, threshold, use_cache=False),
+            )
+
+        async def timed(name: str, coro) -> None:
+            started = time.perf_counter()
+            try:
+                await coro
+                self.warmup[name] = {"ok": True}
+            except Exception as e:
+                self.warmup[name] = {"ok": False, "error": str(e)}
+                logger.warning("预热失败: %s", e, extra={"step": name})
+            self.warmup[name]["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        await asyncio.gather(*(timed(name, coro) for name, coro in steps.items()))
+
+    async def _start(self, config) -> None:
+        from app.core.database import DEFAULT_TARGET
+        await self._connect(config.get_client(DEFAULT_TARGET))
+        try:
+            await config.load()
+        except Exception as e:
+            logger.warning("连接目标同步失败，使用启动目标: %s", e)
+        config.start()
+        try:
+            await asyncio.wait_for(self._warm(config.get_database()), timeout=self.warmup_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("预热超时，直接开始接收流量", extra={"timeout": self.warmup_timeout})
+        self.warmed_up = True
+        logger.info("服务已就绪", extra={"warmup": self.warmup})
+
+    def start(self, config) -> None:
+        """后台连接与预热，不阻塞启动（存活检查在此期间可用），config为DatabaseConfig"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._start(config))
+
+    def begin_drain(self) -> None:
+        if not self.draining:
+            self.draining = True
+            logger.info("开始下线，停止接收新流量")
+
+    async def stop(self) -> None:
+        self.draining = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+runtime_state = RuntimeState()
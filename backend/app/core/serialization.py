@@ -0,0 +1,103 @@
+"""响应序列化快速路径
+
+响应数据来自自己的数据库，或是服务端刚解析出来的计划，序列化前不需要再校验一遍：
+
+- 服务端构造的模型用model_construct创建（PlanParserService.build_plan_detail），数百个PlanNode不再逐字段校验
+- 模型经预编译的TypeAdapter直接编码为JSON字节，绕过FastAPI按response_model重新校验、
+  再用jsonable_encoder逐层遍历的两次Python开销（端点上的response_model仍保留，用于OpenAPI文档）
+- 列表端点的Mongo文档（dict）直接由pydantic_core编码为字节，ObjectId等BSON类型转为字符串
+
+model_construct得到的对象可能带有与声明类型不一致的值（计划JSON由外部工具生成），
+序列化时关闭类型不匹配警告，按原值输出。
+
+pydantic_core对dict和Any字段中的NaN/Infinity原样输出（不是合法JSON），编码结果中出现这些字样时
+把非有限浮点数换成null后重新编码；正常数据只多一次字节查找。
+"""
+import math
+from typing import Any, Dict, Optional
+
+import pydantic_core
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+from app.schemas import ComparisonData, LazyPlanTree, PlanDetail, StatisticsSummary
+
+# 导入时编译，请求中不再构建序列化器
+MODEL_ADAPTERS: Dict[type, TypeAdapter] = {
+    model: TypeAdapter(model)
+    for model in (StatisticsSummary, PlanDetail, ComparisonData, LazyPlanTree)
+}
+
+
+def _fallback(value: Any) -> Any:
+    """pydantic_core无法直接编码的类型（ObjectId、Decimal128、Int64等BSON类型）"""
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    to_decimal = getattr(value, "to_decimal", None)
+    if to_decimal is not None:
+        return float(to_decimal())
+    return str(value)
+
+
+def _finite(value: Any) -> Any:
+    """非有限浮点数换成None（输入为to_jsonable的结果）"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_finite(item) for item in value]
+    return value
+
+
+def _encode(payload: Any) -> bytes:
+    adapter = MODEL_ADAPTERS.get(type(payload))
+    if adapter is not None:
+        return adapter.serializer.to_json(payload, warnings=False, fallback=_fallback)
+    if isinstance(payload, BaseModel):
+        return payload.__pydantic_serializer__.to_json(payload, warnings=False, fallback=_fallback)
+    return pydantic_core.to_json(payload, fallback=_fallback)
+
+
+def dump_json(payload: Any) -> bytes:
+    """模型或原始dict/list直接编码为UTF-8 JSON字节，NaN/Infinity编码为null"""
+    body = _encode(payload)
+    if b"NaN" in body or b"Infinity" in body:
+        # 也可能只是字符串中含有这些字样，重新编码的结果相同
+        body = pydantic_core.to_json(_finite(to_jsonable(payload)))
+    return body
+
+
+def to_jsonable(payload: Any) -> Any:
+    """转换为JSON兼容的Python对象（MessagePack等其他编码使用）"""
+    adapter = MODEL_ADAPTERS.get(type(payload))
+    if adapter is not None:
+        return adapter.serializer.to_python(payload, mode="json", warnings=False, fallback=_fallback)
+    return pydantic_core.to_jsonable_python(payload, fallback=_fallback)
+
+
+class FastJSONResponse(Response):
+    """内容已确认可信的JSON响应，不经过jsonable_encoder"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def respond(payload: Any, response: Optional[Response] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+    """端点返回值转换为FastJSONResponse
+
+    payload已是Response（如304）时原样返回；response为端点注入的Response参数，
+    其上设置的头（ETag、X-Stale等）合并到返回的响应中。
+    """
+    if isinstance(payload, Response):
+        return payload
+    result = FastJSONResponse(payload, headers=headers)
+    if response is not None:
+        for key, value in response.raw_headers:
+            if key not in (b"content-length", b"content-type"):
+                result.raw_headers.append((key, value))
+        if response.status_code:
+            result.status_code = response.status_code
+    return result
@@ -1,6 +1,26 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router
+from app.api.admin import router as admin_router
+from app.core import http_cache
+from app.core.compression import CompressionMiddleware
+from app.core.database import db_config
+from app.core.logger import setup_logging, shutdown_logging
+from app.core.profiler import ProfileMiddleware
+from app.core.runtime import runtime_state
+from app.services.analysis import AnalysisService
+from app.services.catalog import reset_catalogs
+from app.services.complexity import complexity_scheduler
+from app.services.live import live_updates
+from app.services.plan_tree import PlanTreeService
+from app.services.duckdb_mirror import mirror_scheduler
+from app.services.retention import retention_scheduler
+from app.services.stats_refresh import stats_refresher
+from app.services.trend import trend_scheduler
+
+# 初始化日志（后台线程输出，不阻塞事件循环）
+setup_logging()
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -18,10 +38,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Stale", "X-Profile-Id"],
 )
 
+# 按Accept-Encoding压缩响应（br/gzip），小响应不压缩
+app.add_middleware(CompressionMiddleware)
+
+# 按需采样分析（纯ASGI中间件，不包装receive，路由仍能检测客户端断开）
+app.add_middleware(ProfileMiddleware)
+
 # 注册路由
 app.include_router(router, prefix="/api", tags=["SQL执行计划"])
+app.include_router(admin_router, prefix="/api/admin", tags=["管理"])
+
+async def on_target_change(event: str, name: str) -> None:
+    """连接目标变化：活动目标切换或被替换时清理按集合名缓存的数据，后台任务改用新目标"""
+    # 详情ETag和计划树缓存按带目标的集合名索引，活动目标的键不带前缀，任何变化都整体清理
+    http_cache.detail_etags.clear()
+    PlanTreeService.clear_cache()
+    if event == "remove" or name != db_config.active:
+        await reset_catalogs(name)
+        return
+    AnalysisService.clear_cache()
+    http_cache.high_water_marks.invalidate()
+    stats_refresher.reset()
+    await reset_catalogs()
+    await live_updates.shutdown()
+    await retention_scheduler.stop()
+    retention_scheduler.start(db_config.get_database(target=name))
+    await trend_scheduler.stop()
+    trend_scheduler.start(db_config.get_database(target=name))
+    await complexity_scheduler.stop()
+    complexity_scheduler.start(db_config.get_database(target=name))
+    await mirror_scheduler.stop()
+    mirror_scheduler.start(db_config.get_database(target=name), target=name)
+
+@app.on_event("startup")
+async def on_startup():
+    """后台连接MongoDB并预热缓存，完成后/ready返回200
+
+    每个工作进程（WEB_CONCURRENCY）都会执行：集合目录、统计刷新和预热填充的是进程内缓存，
+    各进程各自运行；保留策略按集合加租约，趋势rollup和复杂度计算每个间隔由抢到集群租约
+    （app.core.lease）的一个进程执行；DuckDB镜像是本机文件，同一主机的进程经文件锁串行写入。
+    """
+    db_config.add_listener(on_target_change)
+    runtime_state.start(db_config)
+    retention_scheduler.start(db_config.get_database())
+    trend_scheduler.start(db_config.get_database())
+    complexity_scheduler.start(db_config.get_database())
+    mirror_scheduler.start(db_config.get_database(), target=db_config.active)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """关闭时停止后台任务、关闭连接池并刷新剩余日志"""
+    await runtime_state.stop()
+    await live_updates.shutdown()
+    await reset_catalogs()
+    await stats_refresher.stop()
+    await retention_scheduler.stop()
+    await trend_scheduler.stop()
+    await complexity_scheduler.stop()
+    await mirror_scheduler.stop()
+    await db_config.stop()
+    db_config.close()
+    shutdown_logging()
 
 @app.get("/")
 async def root():
@@ -35,4 +115,10 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查端点"""
-    return {"status": "healthy", "service": "SQL Plan Visualizer API"}
\ No newline at end of file
+    return {"status": "healthy", "service": "SQL Plan Visualizer API"}
+
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：MongoDB已连接且预热完成、未处于下线状态时返回200"""
+    status = runtime_state.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
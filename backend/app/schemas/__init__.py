@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Union
 from datetime import datetime
 from enum import Enum
 
@@ -32,13 +32,32 @@ class SQLExecutionRecord(BaseModel):
     # 复杂度相关字段
     actual_processing_complexity: Optional[float] = Field(None, description="实际处理复杂度数值")
     complexity_level: Optional[ComplexityLevel] = Field(None, description="复杂度等级")
+    complexity_score: Optional[float] = Field(None, description="复杂度分数")
     table_count: Optional[int] = Field(None, description="表数量")
     sql_plan: Optional[str] = Field(None, description="SQL执行计划")
     sql_plan_metrics: Optional[Dict[str, Any]] = Field(None, description="SQL计划指标")
 
+class CollectionInfo(BaseModel):
+    """集合目录信息"""
+    name: str = Field(..., description="集合名")
+    estimated_count: Optional[int] = Field(None, description="文档数估计")
+    size: Optional[int] = Field(None, description="数据大小（字节）")
+    storage_size: Optional[int] = Field(None, description="存储大小（字节）")
+    avg_obj_size: Optional[float] = Field(None, description="平均文档大小")
+    total_index_size: Optional[int] = Field(None, description="索引总大小")
+    min_timestamp: Optional[float] = Field(None, description="最早记录时间戳")
+    max_timestamp: Optional[float] = Field(None, description="最新记录时间戳")
+    field_coverage: Dict[str, float] = Field(default_factory=dict, description="派生字段覆盖率（抽样）")
+    indexes: List[str] = Field(default_factory=list, description="已有索引")
+    missing_indexes: List[str] = Field(default_factory=list, description="缺失的推荐索引")
+    probed_at: Optional[float] = Field(None, description="探测时间")
+    error: Optional[str] = Field(None, description="探测错误")
+
 class CollectionList(BaseModel):
     """集合列表响应"""
     collections: List[str]
+    catalog: Dict[str, CollectionInfo] = Field(default_factory=dict, description="集合目录")
+    refreshed_at: Optional[float] = Field(None, description="目录刷新时间")
 
 class PaginatedResponse(BaseModel):
     """分页响应"""
@@ -68,12 +87,17 @@ class StatisticsSummary(BaseModel):
     avg_plan_nodes: float = Field(default=0, description="平均计划节点数量")
     max_from_tables: int = Field(default=0, description="最大FROM表数量")
     max_plan_nodes: int = Field(default=0, description="最大计划节点数量")
+    # 近似统计（抽样）相关字段
+    approximate: bool = Field(default=False, description="是否为抽样近似结果")
+    sample_size: Optional[int] = Field(None, description="样本量")
+    confidence_level: Optional[float] = Field(None, description="置信水平")
+    confidence_intervals: Dict[str, List[float]] = Field(default_factory=dict, description="各指标的置信区间[下限, 上限]")
 
 class PlanNode(BaseModel):
     """执行计划节点"""
     node_type: str = Field(..., description="节点类型")
     actual_total_time: Optional[float] = Field(None, description="实际总时间")
-    actual_rows: Optional[int] = Field(None, description="实际行数")
+    actual_rows: Optional[float] = Field(None, description="实际行数（PostgreSQL 18起为每次循环的平均值，可为小数）")
     loops: Optional[int] = Field(None, description="循环次数")
     shared_hit_blocks: Optional[int] = Field(None, description="共享缓存命中块")
     shared_read_blocks: Optional[int] = Field(None, description="共享读取块")
@@ -92,6 +116,31 @@ class PlanDetail(BaseModel):
     root_node: Optional[str] = Field(None, description="根节点ID")
     plan_content: str = Field(..., description='查询执行计划的文本')
 
+class LazyPlanNode(BaseModel):
+    """按需展开的计划节点，id为前序遍历序号，同一记录内稳定"""
+    id: str = Field(..., description="节点ID")
+    parent: Optional[str] = Field(None, description="父节点ID")
+    depth: int = Field(..., description="节点深度")
+    node_type: str = Field(..., description="节点类型")
+    actual_total_time: Optional[float] = Field(None, description="实际总时间")
+    actual_rows: Optional[float] = Field(None, description="实际行数（PostgreSQL 18起为每次循环的平均值，可为小数）")
+    loops: Optional[int] = Field(None, description="循环次数")
+    child_count: int = Field(0, description="直接子节点数")
+    subtree_size: int = Field(1, description="子树节点总数（含自身）")
+    subtree_time: Optional[float] = Field(None, description="子树总耗时（实际总时间×循环次数）")
+    self_time: Optional[float] = Field(None, description="节点自身耗时")
+    collapsed: bool = Field(False, description="子节点未包含在本次响应中")
+    attributes: Dict[str, Any] = Field(default_factory=dict, description="节点原始属性（不含子计划）")
+
+class LazyPlanTree(BaseModel):
+    """计划概要与前若干层节点"""
+    plan_id: str = Field(..., description="计划ID")
+    root_node: Optional[str] = Field(None, description="本次返回的子树根节点ID")
+    total_nodes: int = Field(..., description="计划节点总数")
+    max_depth: int = Field(..., description="计划最大深度")
+    nodes: List[LazyPlanNode] = Field(..., description="节点列表（前序）")
+    summary: Dict[str, Any] = Field(default_factory=dict, description="计划概要")
+
 class ComparisonData(BaseModel):
     """对比数据"""
     plans: List[PlanDetail] = Field(..., description="对比的计划列表")
@@ -104,6 +153,20 @@ class SearchFilters(BaseModel):
     min_execution_time: Optional[float] = Field(None, description="最小执行时间")
     max_execution_time: Optional[float] = Field(None, description="最大执行时间")
     file_name: Optional[str] = Field(None, description="文件名筛选")
+    complexity_level: Optional[ComplexityLevel] = Field(None, description="复杂度等级筛选")
+    min_complexity_score: Optional[float] = Field(None, description="最小复杂度分数")
+
+class RetentionPolicy(BaseModel):
+    """集合的保留策略"""
+    raw_days: int = Field(..., ge=1, description="原始记录保留天数")
+    archive: str = Field(default="collection", description="归档方式: collection / parquet / none")
+    enabled: bool = Field(default=True, description="是否启用")
+
+class AnalysisQuery(BaseModel):
+    """DuckDB镜像上的只读查询"""
+    sql: str = Field(..., description="单条查询语句（SELECT/WITH等）")
+    params: Optional[Union[List[Any], Dict[str, Any]]] = Field(None, description="位置参数(?)或命名参数($name)")
+    max_rows: Optional[int] = Field(None, ge=1, description="最多返回的行数，不超过DUCKDB_QUERY_MAX_ROWS")
 
 class Settings(BaseModel):
     """应用设置"""
@@ -112,6 +175,19 @@ class Settings(BaseModel):
     slow_sql_threshold: float = Field(default=100.0, description="慢SQL阈值")
     default_collection: Optional[str] = Field(None, description="默认集合")
     page_size: int = Field(default=20, description="默认分页大小")
+    target: Optional[str] = Field(None, description="连接目标名称；保存时以mongodb_url/database_name新增或更新该目标并设为活动目标")
+    read_preference: str = Field(default="primary", description="读偏好（分析查询可使用secondaryPreferred）")
+
+class ConnectionTarget(BaseModel):
+    """MongoDB连接目标"""
+    url: str = Field(..., description="连接地址")
+    database_name: str = Field(default="sql_results", description="数据库名")
+    read_preference: str = Field(default="primary", description="读偏好: primary/primaryPreferred/secondary/secondaryPreferred/nearest")
+    max_pool_size: Optional[int] = Field(None, ge=1, description="连接池大小，默认MONGODB_MAX_POOL_SIZE")
+    server_selection_timeout_ms: Optional[int] = Field(None, ge=1, description="服务器选择超时（毫秒）")
+    connect_timeout_ms: Optional[int] = Field(None, ge=1, description="建立连接超时（毫秒）")
+    socket_timeout_ms: Optional[int] = Field(None, ge=0, description="套接字超时（毫秒），0表示不限制")
+    activate: bool = Field(default=False, description="保存后设为活动目标")
 
 class ConnectionTest(BaseModel):
     """连接测试结果"""
@@ -1,35 +1,138 @@
+import asyncio
+import logging
+import os
 import statistics
 import time
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import ExecutionTimeout
+from app.core.database import db_config
+from app.core.execution import find_options, query_options
 from app.schemas import SQLExecutionRecord, StatisticsSummary
+from app.services.blob_store import BLOB_FIELDS, BlobStoreService
+from app.services.plan_store import PlanStoreService
 from app.services.complexity import ComplexityService
+from app.services.sampling import ApproxStatsService
+
+logger = logging.getLogger(__name__)
+
+# 列表不需要结果行和去重存储的计划实际值
+LIST_PROJECTION = {"data": 0, "plan_actuals": 0, "plan_top": 0}
 
 class AnalysisService:
     """数据分析服务"""
     
-    # 缓存统计结果，避免重复计算
-    _stats_cache = {}
+    # 缓存统计结果，避免重复计算；按最近使用淘汰，键含自由参数（时间范围、脚本名等），需要上限
+    _stats_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
     _cache_ttl = 300  # 缓存5分钟
+    _cache_max_size = int(os.getenv("STATS_CACHE_SIZE", "1000"))
+    # 缓存键 -> 带目标的集合名；集合名本身可以含下划线，按键前缀无法区分plans和plans_archive
+    _key_collections: Dict[str, str] = {}
     
     @staticmethod
-    def _get_cache_key(collection_name: str, threshold: Optional[float] = None, is_basic: bool = False) -> str:
-        """生成缓存键"""
+    def _get_cache_key(collection_name: str, threshold: Optional[float] = None, is_basic: bool = False,
+                       variant: Optional[str] = None) -> str:
+        """生成缓存键（按请求选择了非活动连接目标时，集合名带目标前缀）"""
+        collection_name = db_config.qualify(collection_name)
         if is_basic:
-            return f"{collection_name}_basic"
+            key = f"{collection_name}_basic"
         else:
-            return f"{collection_name}_{threshold}"
+            key = f"{collection_name}_{threshold}"
+        key = f"{key}_{variant}" if variant else key
+        AnalysisService._key_collections[key] = collection_name
+        return key
+    
+    @staticmethod
+    def _stats_variant(mode: str = "auto", sample: Optional[int] = None, sample_method: str = "random") -> Optional[str]:
+        """统计模式对应的缓存键后缀，默认参数返回None"""
+        if mode == "auto" and sample is None and sample_method == "random":
+            return None
+        return f"{mode}_{sample or ''}_{sample_method}"
+    
+    @staticmethod
+    def summary_cache_key(collection_name: str, threshold: float, mode: str = "auto",
+                          sample: Optional[int] = None, sample_method: str = "random") -> str:
+        """聚合统计（/stats/summary）的缓存键，与慢SQL统计区分"""
+        variant = AnalysisService._stats_variant(mode, sample, sample_method)
+        return AnalysisService._get_cache_key(
+            collection_name, threshold, variant=f"summary_{variant}" if variant else "summary"
+        )
     
     @staticmethod
     def _is_cache_valid(timestamp: float) -> bool:
         """检查缓存是否有效"""
         return (time.time() - timestamp) < AnalysisService._cache_ttl
     
+    @staticmethod
+    def get_cached(cache_key: str, allow_stale: bool = False) -> Optional[Any]:
+        """读取缓存，allow_stale为True时忽略过期时间（用于超时/过载时降级）"""
+        cached_data = AnalysisService._stats_cache.get(cache_key)
+        if cached_data is None:
+            return None
+        if allow_stale or AnalysisService._is_cache_valid(cached_data['timestamp']):
+            AnalysisService._stats_cache.move_to_end(cache_key)
+            return cached_data['data']
+        return None
+    
+    @staticmethod
+    def get_cache_age(cache_key: str) -> Optional[float]:
+        """缓存已存在的秒数，没有缓存时返回None"""
+        cached_data = AnalysisService._stats_cache.get(cache_key)
+        if cached_data is None:
+            return None
+        return time.time() - cached_data['timestamp']
+    
+    @staticmethod
+    def set_cached(cache_key: str, data: Any, collection_name: Optional[str] = None) -> None:
+        """写入缓存，超过STATS_CACHE_SIZE时淘汰最久未使用的键
+
+        collection_name为生成键时的带目标集合名，键的集合记录已被淘汰时（后台刷新）用于重新登记。
+        """
+        cache = AnalysisService._stats_cache
+        if collection_name is not None:
+            AnalysisService._key_collections[cache_key] = collection_name
+        cache[cache_key] = {
+            'data': data,
+            'timestamp': time.time()
+        }
+        cache.move_to_end(cache_key)
+        while len(cache) > AnalysisService._cache_max_size:
+            evicted, _ = cache.popitem(last=False)
+            AnalysisService._key_collections.pop(evicted, None)
+        # 只生成过键而没有写入缓存的集合记录（请求超时、304等）
+        if len(AnalysisService._key_collections) > 2 * AnalysisService._cache_max_size:
+            for key in [k for k in AnalysisService._key_collections if k not in cache]:
+                del AnalysisService._key_collections[key]
+
+    @staticmethod
+    def drop_cached(cache_key: str) -> None:
+        """删除一个键的缓存值和集合记录"""
+        AnalysisService._stats_cache.pop(cache_key, None)
+        AnalysisService._key_collections.pop(cache_key, None)
+    
     @staticmethod
     def clear_cache():
         """清理所有缓存"""
         AnalysisService._stats_cache.clear()
-        print("统计缓存已清理")
+        AnalysisService._key_collections.clear()
+        logger.info("统计缓存已清理")
+    
+    @staticmethod
+    def invalidate_collection(collection_name: str, keep: Tuple[str, ...] = ()) -> int:
+        """清理某个集合的统计缓存（keep中的键保留），返回清理数量
+
+        集合名按当前请求的连接目标加前缀，与_get_cache_key生成的键一致；按生成键时记录的集合名
+        精确匹配，不会清理名称以该集合名加下划线开头的其他集合（如plans_archive）。
+        """
+        scope = db_config.qualify(collection_name)
+        keys = [
+            k for k in AnalysisService._stats_cache
+            if AnalysisService._key_collections.get(k) == scope and k not in keep
+        ]
+        for key in keys:
+            del AnalysisService._stats_cache[key]
+        return len(keys)
     
     @staticmethod
     def get_cache_info() -> dict:
@@ -37,46 +140,59 @@ class AnalysisService:
         return {
             'cache_size': len(AnalysisService._stats_cache),
             'cache_ttl': AnalysisService._cache_ttl,
+            'cache_max_size': AnalysisService._cache_max_size,
             'cached_keys': list(AnalysisService._stats_cache.keys())
         }
     
     @staticmethod
     def process_record_complexity(record: Dict[str, Any]) -> Dict[str, Any]:
         """处理记录中的复杂度信息 - 如果没有enhanced_complexity_analysis字段则保持不变"""
-        try:
-            # 检查是否有enhanced_complexity_analysis字段
-            if 'enhanced_complexity_analysis' in record:
-                print(f"[ANALYSIS] 记录包含enhanced_complexity_analysis字段，记录ID: {record.get('_id', 'Unknown')}")
-                # 如果有该字段，可以进行一些基本验证，但不进行复杂计算
-                enhanced = record['enhanced_complexity_analysis']
-                if enhanced and isinstance(enhanced, dict):
-                    # 验证是否有必需的字段
-                    if 'total_complexity_score' in enhanced:
-                        print(f"[ANALYSIS] 记录包含total_complexity_score: {enhanced['total_complexity_score']}")
-                    else:
-                        print(f"[ANALYSIS] enhanced_complexity_analysis缺少total_complexity_score字段")
-            else:
-                print(f"[ANALYSIS] 记录不包含enhanced_complexity_analysis字段，记录ID: {record.get('_id', 'Unknown')}")
-            
-            # 不再进行复杂度计算，让前端直接显示"未知"
-            return record
-        except Exception as e:
-            print(f"[ANALYSIS] 处理复杂度信息失败: {e}")
+        # 逐记录调用的热路径，未开启DEBUG时直接返回
+        if not logger.isEnabledFor(logging.DEBUG):
             return record
+        
+        enhanced = record.get('enhanced_complexity_analysis')
+        if enhanced is None:
+            logger.debug("记录不包含enhanced_complexity_analysis字段",
+                         extra={"record_id": record.get('_id'), "sampled": True})
+        elif isinstance(enhanced, dict):
+            logger.debug("记录包含enhanced_complexity_analysis字段",
+                         extra={"record_id": record.get('_id'),
+                                "total_complexity_score": enhanced.get('total_complexity_score'),
+                                "sampled": True})
+        
+        # 不再进行复杂度计算，让前端直接显示"未知"
+        return record
     
     @staticmethod
-    async def get_collection_stats(db: AsyncIOMotorDatabase, collection_name: str, slow_sql_threshold: float = 100.0) -> 'StatisticsSummary':
-        """获取集合统计信息"""
+    async def get_collection_stats(
+        db: AsyncIOMotorDatabase,
+        collection_name: str,
+        slow_sql_threshold: float = 100.0,
+        mode: str = "auto",
+        sample: Optional[int] = None,
+        sample_method: str = "random"
+    ) -> 'StatisticsSummary':
+        """获取集合统计信息
+        
+        mode: exact 全量精确统计；approx 抽样近似统计；auto 超过APPROX_STATS_THRESHOLD时自动使用近似统计
+        """
         collection = db[collection_name]
         
+        total = await ApproxStatsService.approximate_population(collection, mode)
+        if total is not None:
+            return await ApproxStatsService.compute_stats(
+                collection, {}, total, slow_sql_threshold, sample, sample_method
+            )
+        
         # 获取总记录数
-        total_count = await collection.count_documents({})
+        total_count = await collection.count_documents({}, **query_options("stats"))
         
         # 获取状态统计
         status_pipeline = [
             {"$group": {"_id": "$status", "count": {"$sum": 1}}}
         ]
-        status_results = await collection.aggregate(status_pipeline).to_list(None)
+        status_results = await collection.aggregate(status_pipeline, **query_options("stats")).to_list(None)
         
         success_count = 0
         error_count = 0
@@ -98,7 +214,7 @@ class AnalysisService:
                 }
             }
         ]
-        time_results = await collection.aggregate(time_pipeline).to_list(None)
+        time_results = await collection.aggregate(time_pipeline, **query_options("stats")).to_list(None)
         
         all_times = []
         if time_results:
@@ -124,13 +240,13 @@ class AnalysisService:
         row_pipeline = [
             {"$group": {"_id": None, "total_rows": {"$sum": "$row_count"}}}
         ]
-        row_results = await collection.aggregate(row_pipeline).to_list(None)
+        row_results = await collection.aggregate(row_pipeline, **query_options("stats")).to_list(None)
         total_rows = row_results[0]["total_rows"] if row_results else 0
         
         # 计算慢SQL数量
         slow_sql_count = await collection.count_documents({
             "execution_time_ms": {"$gt": slow_sql_threshold}
-        })
+        }, **query_options("stats"))
         
         # 获取执行时间分布
         execution_time_distribution = AnalysisService._get_time_distribution(all_times)
@@ -150,28 +266,28 @@ class AnalysisService:
         )
     
     @staticmethod
-    async def get_basic_collection_stats(db: AsyncIOMotorDatabase, collection_name: str) -> 'StatisticsSummary':
-        """获取基础统计信息（不依赖阈值）"""
+    async def get_basic_collection_stats(db: AsyncIOMotorDatabase, collection_name: str,
+                                         use_cache: bool = True) -> 'StatisticsSummary':
+        """获取基础统计信息（不依赖阈值），use_cache为False时跳过缓存读取；结果由调用方（stats_refresher）写入缓存"""
         
         # 检查缓存
         cache_key = AnalysisService._get_cache_key(collection_name, is_basic=True)
-        if cache_key in AnalysisService._stats_cache:
-            cached_data = AnalysisService._stats_cache[cache_key]
-            if AnalysisService._is_cache_valid(cached_data['timestamp']):
-                print(f"使用缓存的基础统计数据: {cache_key}")
-                return cached_data['data']
+        cached = AnalysisService.get_cached(cache_key) if use_cache else None
+        if cached is not None:
+            logger.debug("使用缓存的基础统计数据", extra={"cache_key": cache_key})
+            return cached
         
-        print(f"计算基础统计数据: {collection_name}")
+        logger.info("计算基础统计数据", extra={"collection": collection_name})
         collection = db[collection_name]
         
         # 获取总记录数
-        total_count = await collection.count_documents({})
+        total_count = await collection.count_documents({}, **query_options("stats"))
         
         # 获取状态统计
         status_pipeline = [
             {"$group": {"_id": "$status", "count": {"$sum": 1}}}
         ]
-        status_results = await collection.aggregate(status_pipeline).to_list(None)
+        status_results = await collection.aggregate(status_pipeline, **query_options("stats")).to_list(None)
         
         success_count = 0
         error_count = 0
@@ -190,14 +306,14 @@ class AnalysisService:
                 }
             }
         ]
-        time_results = await collection.aggregate(time_pipeline).to_list(None)
+        time_results = await collection.aggregate(time_pipeline, **query_options("stats")).to_list(None)
         avg_time = time_results[0]["avg_time"] if time_results else 0
         
         # 获取总行数
         row_pipeline = [
             {"$group": {"_id": None, "total_rows": {"$sum": "$row_count"}}}
         ]
-        row_results = await collection.aggregate(row_pipeline).to_list(None)
+        row_results = await collection.aggregate(row_pipeline, **query_options("stats")).to_list(None)
         total_rows = row_results[0]["total_rows"] if row_results else 0
         
         # 计算平均返回行数
@@ -224,162 +340,151 @@ class AnalysisService:
             max_plan_nodes=0  # 基础统计最大节点数量
         )
         
-        # 缓存结果
-        AnalysisService._stats_cache[cache_key] = {
-            'data': result,
-            'timestamp': time.time()
-        }
-        
         return result
 
     @staticmethod
-    async def get_slow_sql_stats(db: AsyncIOMotorDatabase, collection_name: str, slow_sql_threshold: float) -> 'StatisticsSummary':
-        """获取慢SQL统计信息（依赖阈值）"""
+    async def get_slow_sql_stats(
+        db: AsyncIOMotorDatabase,
+        collection_name: str,
+        slow_sql_threshold: float,
+        mode: str = "auto",
+        sample: Optional[int] = None,
+        sample_method: str = "random",
+        use_cache: bool = True
+    ) -> 'StatisticsSummary':
+        """获取慢SQL统计信息（依赖阈值），use_cache为False时跳过缓存读取；结果由调用方（stats_refresher）写入缓存"""
         
         # 检查缓存
-        cache_key = AnalysisService._get_cache_key(collection_name, slow_sql_threshold)
-        if cache_key in AnalysisService._stats_cache:
-            cached_data = AnalysisService._stats_cache[cache_key]
-            if AnalysisService._is_cache_valid(cached_data['timestamp']):
-                print(f"使用缓存的慢SQL统计数据: {cache_key}")
-                return cached_data['data']
-        
-        print(f"计算慢SQL统计数据: {collection_name}, 阈值: {slow_sql_threshold}")
+        variant = AnalysisService._stats_variant(mode, sample, sample_method)
+        cache_key = AnalysisService._get_cache_key(collection_name, slow_sql_threshold, variant=variant)
+        cached = AnalysisService.get_cached(cache_key) if use_cache else None
+        if cached is not None:
+            logger.debug("使用缓存的慢SQL统计数据", extra={"cache_key": cache_key})
+            return cached
+        
+        logger.info("计算慢SQL统计数据", extra={"collection": collection_name, "threshold": slow_sql_threshold, "mode": mode})
         collection = db[collection_name]
         
         # 只获取慢SQL记录
         slow_sql_query = {"execution_time_ms": {"$gt": slow_sql_threshold}}
-        slow_sql_count = await collection.count_documents(slow_sql_query)
-        
-        if slow_sql_count == 0:
-            # 如果没有慢SQL，返回空统计
-            result = StatisticsSummary(
-                total_plans=0,
-                success_count=0,
-                error_count=0,
-                avg_execution_time=0.0,
-                max_execution_time=0.0,
-                min_execution_time=0.0,
-                p95_execution_time=0.0,
-                p99_execution_time=0.0,
-                total_rows=0,
-                slow_sql_count=0,
-                execution_time_distribution=[],
-                from_table_distribution=[],
-                plan_node_distribution=[],
-                avg_from_tables=0.0,
-                avg_plan_nodes=0.0,
-                max_from_tables=0,
-                max_plan_nodes=0
-            )
-            
-            # 缓存空结果
-            AnalysisService._stats_cache[cache_key] = {
-                'data': result,
-                'timestamp': time.time()
+        
+        if await ApproxStatsService.should_approximate(collection, mode):
+            sample_size = sample or ApproxStatsService.default_sample
+            # 数量精确计数，只在慢SQL内部抽样；慢SQL不多于样本量时下面直接精确统计
+            slow_count = await ApproxStatsService.count_slow(collection, slow_sql_threshold)
+            if slow_count > sample_size:
+                result = await ApproxStatsService.compute_stats(
+                    collection, slow_sql_query, slow_count, slow_sql_threshold,
+                    sample_size, sample_method, include_shape_stats=True
+                )
+                result.total_plans = result.slow_sql_count = slow_count
+                result.confidence_intervals["slow_sql_count"] = [slow_count, slow_count]
+                result.confidence_intervals["total_plans"] = [slow_count, slow_count]
+                return result
+        # 各部分相互独立，并发执行
+        sections = AnalysisService.slow_sql_sections(collection, slow_sql_threshold)
+        results = await asyncio.gather(*(section() for section in sections.values()))
+        fields: Dict[str, Any] = {}
+        for result in results:
+            fields.update(result)
+        result = StatisticsSummary(total_plans=fields["slow_sql_count"], **fields)
+        
+        return result
+    
+    @staticmethod
+    def slow_sql_sections(collection, slow_sql_threshold: float) -> Dict[str, Callable[[], Awaitable[Dict[str, Any]]]]:
+        """慢SQL统计拆分为相互独立的部分，按通常的完成先后排列，每部分返回StatisticsSummary的若干字段
+        
+        counts: 数量和成功/失败数；summary: 平均/最小/最大耗时和总行数；
+        percentiles: P95/P99和执行时间分布；from_tables / plan_nodes: FROM表数量和计划节点数量分布
+        """
+        slow_sql_query = {"execution_time_ms": {"$gt": slow_sql_threshold}}
+        
+        async def counts() -> Dict[str, Any]:
+            status_pipeline = [
+                {"$match": slow_sql_query},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ]
+            status_results = await collection.aggregate(status_pipeline, **query_options("stats")).to_list(None)
+            by_status = {result["_id"]: result["count"] for result in status_results}
+            return {
+                "slow_sql_count": sum(by_status.values()),
+                "success_count": by_status.get("success", 0),
+                "error_count": by_status.get("error", 0),
             }
-            
-            return result
         
-        # 获取慢SQL的执行时间统计
-        time_pipeline = [
-            {"$match": {"execution_time_ms": {"$gt": slow_sql_threshold}}},
-            {
-                "$group": {
+        async def summary() -> Dict[str, Any]:
+            pipeline = [
+                {"$match": slow_sql_query},
+                {"$group": {
                     "_id": None,
                     "avg_time": {"$avg": "$execution_time_ms"},
                     "max_time": {"$max": "$execution_time_ms"},
                     "min_time": {"$min": "$execution_time_ms"},
-                    "all_times": {"$push": "$execution_time_ms"}
-                }
+                    "total_rows": {"$sum": "$row_count"},
+                }}
+            ]
+            results = await collection.aggregate(pipeline, **query_options("stats")).to_list(None)
+            data = results[0] if results else {}
+            return {
+                "avg_execution_time": data.get("avg_time") or 0.0,
+                "max_execution_time": data.get("max_time") or 0.0,
+                "min_execution_time": data.get("min_time") or 0.0,
+                "total_rows": data.get("total_rows") or 0,
             }
-        ]
-        time_results = await collection.aggregate(time_pipeline).to_list(None)
         
-        if time_results:
-            time_data = time_results[0]
-            avg_time = time_data["avg_time"]
-            max_time = time_data["max_time"]
-            min_time = time_data["min_time"]
-            all_times = time_data["all_times"]
-            
-            # 计算百分位数
-            sorted_times = sorted(all_times)
+        async def percentiles() -> Dict[str, Any]:
+            pipeline = [
+                {"$match": slow_sql_query},
+                {"$group": {"_id": None, "all_times": {"$push": "$execution_time_ms"}}}
+            ]
+            results = await collection.aggregate(pipeline, **query_options("stats")).to_list(None)
+            sorted_times = sorted(results[0]["all_times"]) if results else []
             total_times = len(sorted_times)
-            
-            p95_index = int(total_times * 0.95) - 1
-            p99_index = int(total_times * 0.99) - 1
-            
-            p95_time = sorted_times[p95_index] if p95_index < total_times else max_time
-            p99_time = sorted_times[p99_index] if p99_index < total_times else max_time
-        else:
-            avg_time = max_time = min_time = p95_time = p99_time = 0
-            all_times = []
-        
-        # 获取慢SQL的总行数
-        row_pipeline = [
-            {"$match": {"execution_time_ms": {"$gt": slow_sql_threshold}}},
-            {"$group": {"_id": None, "total_rows": {"$sum": "$row_count"}}}
-        ]
-        row_results = await collection.aggregate(row_pipeline).to_list(None)
-        total_rows = row_results[0]["total_rows"] if row_results else 0
-        
-        # 获取慢SQL的状态统计
-        status_pipeline = [
-            {"$match": {"execution_time_ms": {"$gt": slow_sql_threshold}}},
-            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-        ]
-        status_results = await collection.aggregate(status_pipeline).to_list(None)
-        
-        success_count = 0
-        error_count = 0
-        for result in status_results:
-            if result["_id"] == "success":
-                success_count = result["count"]
-            elif result["_id"] == "error":
-                error_count = result["count"]
-        
-        # 获取执行时间分布（只针对慢SQL）
-        execution_time_distribution = AnalysisService._get_time_distribution(all_times)
+            if total_times:
+                # 计算百分位数
+                p95_index = int(total_times * 0.95) - 1
+                p99_index = int(total_times * 0.99) - 1
+                p95_time = sorted_times[p95_index]
+                p99_time = sorted_times[p99_index]
+            else:
+                p95_time = p99_time = 0.0
+            return {
+                "p95_execution_time": p95_time,
+                "p99_execution_time": p99_time,
+                "execution_time_distribution": AnalysisService._get_time_distribution(sorted_times),
+            }
         
-        # 获取FROM表数量和node节点数量的统计
-        from_table_stats = await AnalysisService._get_from_table_stats(collection, slow_sql_query)
-        plan_node_stats = await AnalysisService._get_plan_node_stats(collection, slow_sql_query)
+        async def from_tables() -> Dict[str, Any]:
+            stats = await AnalysisService._get_from_table_stats(collection, slow_sql_query)
+            return {
+                "from_table_distribution": stats["distribution"],
+                "avg_from_tables": stats["avg"],
+                "max_from_tables": stats["max"],
+            }
         
-        result = StatisticsSummary(
-            total_plans=slow_sql_count,  # 使用慢SQL数量作为总计划数
-            success_count=success_count,
-            error_count=error_count,
-            avg_execution_time=avg_time,
-            max_execution_time=max_time,
-            min_execution_time=min_time,
-            p95_execution_time=p95_time,
-            p99_execution_time=p99_time,
-            total_rows=total_rows,
-            slow_sql_count=slow_sql_count,
-            execution_time_distribution=execution_time_distribution,
-            from_table_distribution=from_table_stats["distribution"],
-            plan_node_distribution=plan_node_stats["distribution"],
-            avg_from_tables=from_table_stats["avg"],
-            avg_plan_nodes=plan_node_stats["avg"],
-            max_from_tables=from_table_stats["max"],
-            max_plan_nodes=from_table_stats["max"]
-        )
+        async def plan_nodes() -> Dict[str, Any]:
+            stats = await AnalysisService._get_plan_node_stats(collection, slow_sql_query)
+            return {
+                "plan_node_distribution": stats["distribution"],
+                "avg_plan_nodes": stats["avg"],
+                "max_plan_nodes": stats["max"],
+            }
         
-        # 缓存结果
-        AnalysisService._stats_cache[cache_key] = {
-            'data': result,
-            'timestamp': time.time()
+        return {
+            "counts": counts,
+            "summary": summary,
+            "percentiles": percentiles,
+            "from_tables": from_tables,
+            "plan_nodes": plan_nodes,
         }
-        
-        return result
     
     @staticmethod
     async def _get_from_table_stats(collection, query: dict) -> Dict[str, Any]:
         """获取FROM表数量统计 - 直接读取数据库中的table_count字段"""
         try:
             # 直接从数据库读取table_count字段，不进行复杂的SQL解析
-            cursor = collection.find(query, {"table_count": 1})
+            cursor = collection.find(query, {"table_count": 1}, **find_options("stats"))
             docs = await cursor.to_list(None)
             
             if not docs:
@@ -421,9 +526,12 @@ class AnalysisService:
                 "avg": avg_from_tables,
                 "max": max_from_tables
             }
+        except ExecutionTimeout:
+            # 超时交给上层执行控制处理
+            raise
         except Exception as e:
             # 如果字段不存在或其他错误，返回默认统计
-            print(f"获取FROM表数量统计失败: {e}")
+            logger.warning("获取FROM表数量统计失败: %s", e)
             return {
                 "distribution": [],
                 "avg": 0,
@@ -435,7 +543,7 @@ class AnalysisService:
         """获取计划节点数量统计 - 直接读取数据库中的sql_plan_metrics.nodes字段"""
         try:
             # 直接从数据库读取sql_plan_metrics字段
-            cursor = collection.find(query, {"sql_plan_metrics": 1})
+            cursor = collection.find(query, {"sql_plan_metrics": 1}, **find_options("stats"))
             docs = await cursor.to_list(None)
             
             if not docs:
@@ -485,9 +593,12 @@ class AnalysisService:
                 "avg": avg_plan_nodes,
                 "max": max_plan_nodes
             }
+        except ExecutionTimeout:
+            # 超时交给上层执行控制处理
+            raise
         except Exception as e:
             # 如果字段不存在或其他错误，返回默认统计
-            print(f"获取计划节点数量统计失败: {e}")
+            logger.warning("获取计划节点数量统计失败: %s", e)
             return {
                 "distribution": [],
                 "avg": 0,
@@ -496,47 +607,10 @@ class AnalysisService:
 
     @staticmethod
     def _count_from_tables(sql_content: str) -> int:
-        """从SQL语句中计算FROM表的数量"""
-        if not sql_content:
-            return 0
-        
-        try:
-            import re
-            # 去除注释
-            sql_clean = re.sub(r'--.*', '', sql_content, flags=re.MULTILINE)
-            sql_clean = re.sub(r'/\*.*?\*/', '', sql_clean, flags=re.DOTALL)
-            
-            # 查找FROM子句
-            from_matches = list(re.finditer(r'\bFROM\b', sql_clean, re.IGNORECASE))
-            
-            table_count = 0
-            for match in from_matches:
-                # 获取FROM之后的内容，直到WHERE、GROUP BY、ORDER BY、LIMIT、UNION等
-                from_pos = match.end()
-                remaining_sql = sql_clean[from_pos:].strip()
-                
-                # 找到下一个关键词的位置
-                next_keywords = ['WHERE', 'GROUP BY', 'ORDER BY', 'LIMIT', 'UNION', 'HAVING', 'WITH', 'JOIN']
-                end_pos = len(remaining_sql)
-                
-                for keyword in next_keywords:
-                    keyword_match = re.search(r'\b' + keyword + r'\b', remaining_sql, re.IGNORECASE)
-                    if keyword_match:
-                        end_pos = min(end_pos, keyword_match.start())
-                
-                # 提取FROM之后的内容
-                from_clause = remaining_sql[:end_pos].strip()
-                
-                # 简单的表名计数（这只是一个近似算法）
-                # 将逗号分隔的表名和JOIN后的表名都计算在内
-                tables = re.findall(r'\b[A-Za-z_][A-Za-z0-9_]*\s*(?:as\s+)?[A-Za-z_][A-Za-z0-9_]*\s*(?:,|\b(?:LEFT|RIGHT|INNER|OUTER)?\s*JOIN\b|\b(?:WHERE|GROUP|ORDER|LIMIT|UNION|HAVING|WITH)\b)', from_clause, re.IGNORECASE)
-                table_count += len(tables)
-            
-            return max(table_count, 0)
-        except Exception as e:
-            print(f"计算FROM表数量失败: {e}")
-            return 0
-    
+        """从SQL语句中计算引用的基础表数量（不含CTE名，结果按SQL哈希缓存）"""
+        from app.services.sql_analysis import SqlAnalysisService
+        return SqlAnalysisService.analyze(sql_content)["table_count"]
+
     @staticmethod
     def _count_plan_nodes(data: List[Dict[str, Any]]) -> int:
         """从执行计划数据中统计节点数量"""
@@ -566,7 +640,7 @@ class AnalysisService:
             
             return total_nodes
         except Exception as e:
-            print(f"计算计划节点数量失败: {e}")
+            logger.warning("计算计划节点数量失败: %s", e)
             return 0
 
     @staticmethod
@@ -602,17 +676,8 @@ class AnalysisService:
         return distribution
     
     @staticmethod
-    async def search_records(
-        db: 'AsyncIOMotorDatabase',
-        collection_name: str,
-        filters: Dict[str, Any],
-        page: int = 1,
-        size: int = 20
-    ) -> Dict[str, Any]:
-        """搜索记录"""
-        collection = db[collection_name]
-        
-        # 构建查询条件
+    def build_search_query(filters: Dict[str, Any]) -> Dict[str, Any]:
+        """根据SearchFilters构建查询条件，搜索和导出共用"""
         query = {}
         
         if filters.get("q"):
@@ -633,17 +698,39 @@ class AnalysisService:
         if filters.get("file_name"):
             query["file_name"] = {"$regex": filters["file_name"], "$options": "i"}
         
+        # 复杂度等级和分数由批量计算写入，均有索引
+        if filters.get("complexity_level"):
+            query["complexity_level"] = filters["complexity_level"]
+        
+        if filters.get("min_complexity_score") is not None:
+            query["complexity_score"] = {"$gte": filters["min_complexity_score"]}
+        
+        return query
+    
+    @staticmethod
+    async def search_records(
+        db: 'AsyncIOMotorDatabase',
+        collection_name: str,
+        filters: Dict[str, Any],
+        page: int = 1,
+        size: int = 20
+    ) -> Dict[str, Any]:
+        """搜索记录"""
+        collection = db[collection_name]
+        query = AnalysisService.build_search_query(filters)
+        
         # 获取总数
-        total = await collection.count_documents(query)
+        total = await collection.count_documents(query, **query_options("list"))
         
         # 分页查询
         skip = (page - 1) * size
-        cursor = collection.find(query).sort("timestamp", -1).skip(skip).limit(size)
+        cursor = collection.find(query, LIST_PROJECTION, **find_options("list")).sort("timestamp", -1).skip(skip).limit(size)
         records = await cursor.to_list(length=size)
         
         # 转换_id为字符串并处理复杂度信息
         for record in records:
             record["_id"] = str(record["_id"])
+            BlobStoreService.apply_list_preview(record)
             # 处理复杂度信息
             record = AnalysisService.process_record_complexity(record)
         
@@ -656,26 +743,47 @@ class AnalysisService:
         }
     
     @staticmethod
-    async def get_record_detail(db: AsyncIOMotorDatabase, collection_name: str, record_id: str) -> 'Optional[Dict[str, Any]]':
-        """获取记录详情"""
+    async def get_record_detail(
+        db: AsyncIOMotorDatabase,
+        collection_name: str,
+        record_id: str,
+        fields: Tuple[str, ...] = ("sql_plan",)
+    ) -> 'Optional[Dict[str, Any]]':
+        """获取记录详情
+        
+        fields为需要的大字段，外置存储的字段只在这里按需读取解压；不需要的大字段不从MongoDB读取。
+        """
         from bson.objectid import ObjectId
         
+        projection = {field: 0 for field in BLOB_FIELDS if field not in fields}
+        if "sql_plan" not in fields:
+            projection.update({"plan_actuals": 0, "plan_top": 0})
+        projection = projection or None
         try:
-            record = await db[collection_name].find_one({"_id": ObjectId(record_id)})
+            record = await db[collection_name].find_one(
+                {"_id": ObjectId(record_id)}, projection, **find_options("detail")
+            )
             if record:
+                record = await BlobStoreService.hydrate(db, record, fields)
+                if "sql_plan" in fields:
+                    record = await PlanStoreService.hydrate(db, record)
                 record["_id"] = str(record["_id"])
             return record
         except Exception:
             return None
 
     @staticmethod
-    async def get_slow_sql_list(db: AsyncIOMotorDatabase, collection_name: str, slow_sql_threshold: float, limit: int = 50) -> 'Dict[str, Any]':
-        """获取慢SQL列表数据（用于趋势图表）"""
+    async def get_slow_sql_list(db: AsyncIOMotorDatabase, collection_name: str, slow_sql_threshold: float, limit: int = 50,
+                                complexity_level: Optional[str] = None) -> 'Dict[str, Any]':
+        """获取慢SQL列表数据（用于趋势图表），可按复杂度等级筛选"""
         collection = db[collection_name]
         
         # 获取慢SQL记录，按执行时间降序排列
         slow_sql_query = {"execution_time_ms": {"$gt": slow_sql_threshold}}
-        cursor = collection.find(slow_sql_query).sort("execution_time_ms", -1).limit(limit)
+        if complexity_level:
+            slow_sql_query["complexity_level"] = complexity_level
+        projection = {"file_name": 1, "execution_time_ms": 1, "timestamp": 1, "complexity_level": 1, "complexity_score": 1}
+        cursor = collection.find(slow_sql_query, projection, **find_options("stats")).sort("execution_time_ms", -1).limit(limit)
         slow_sql_records = await cursor.to_list(length=limit)
         
         # 转换_id为字符串
@@ -696,13 +804,16 @@ class AnalysisService:
                 "file_name": display_name,
                 "execution_time": record.get("execution_time_ms", 0),
                 "timestamp": record.get("timestamp", 0),
-                "original_name": file_name  # 保存原始文件名
+                "original_name": file_name,  # 保存原始文件名
+                "complexity_level": record.get("complexity_level"),
+                "complexity_score": record.get("complexity_score")
             })
         
         return {
             "data": chart_data,
             "total": len(chart_data),
-            "threshold": slow_sql_threshold
+            "threshold": slow_sql_threshold,
+            "complexity_level": complexity_level
         }
     
     @staticmethod
@@ -743,7 +854,7 @@ class AnalysisService:
             # 这里需要额外处理，因为MongoDB不能直接查询数组长度
         
         # 获取匹配的文档
-        cursor = collection.find(query, {"file_name": 1, "sql_content": 1}).limit(10)
+        cursor = collection.find(query, {"file_name": 1, "sql_content": 1}, **find_options("stats")).limit(10)
         docs = await cursor.to_list(None)
         
         script_names = []
@@ -0,0 +1,216 @@
+"""大字段外置存储服务
+
+记录中的data（查询结果行）和sql_plan体积大，但只有详情页需要。超过阈值的字段
+压缩后写入GridFS（bucket: record_blobs），记录中只保留引用：
+
+    data_ref / sql_plan_ref: {"id": 文件ID, "codec": "zstd"|"zlib", "size": 原始字节数, "stored": 压缩后字节数}
+
+sql_plan外置时额外保存sql_plan_preview（首尾各200字符），供列表页显示。
+安装zstandard时使用zstd压缩，否则使用zlib；读取时按引用中的codec解压。
+
+环境变量:
+    BLOB_SIZE_THRESHOLD   外置阈值（BSON字节数），默认65536
+"""
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BLOB_FIELDS = ("data", "sql_plan")
+PREVIEW_LENGTH = 200
+
+
+class BlobStoreService:
+    """记录大字段的压缩外置存储"""
+
+    bucket_name = "record_blobs"
+    size_threshold = int(os.getenv("BLOB_SIZE_THRESHOLD", "65536"))
+
+    @staticmethod
+    def _bucket(db) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(db, bucket_name=BlobStoreService.bucket_name)
+
+    @staticmethod
+    def default_codec() -> str:
+        return "zstd" if zstandard is not None else "zlib"
+
+    @staticmethod
+    def encode(value: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        """BSON编码后压缩，返回压缩数据和大小信息"""
+        codec = codec or BlobStoreService.default_codec()
+        raw = bson.encode({"v": value})
+        if codec == "zstd":
+            payload = zstandard.ZstdCompressor(level=6).compress(raw)
+        else:
+            payload = zlib.compress(raw, 6)
+        return {"payload": payload, "codec": codec, "size": len(raw), "stored": len(payload)}
+
+    @staticmethod
+    def decode(payload: bytes, codec: str) -> Any:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("读取zstd压缩数据需要安装zstandard")
+            raw = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            raw = zlib.decompress(payload)
+        return bson.decode(raw)["v"]
+
+    @staticmethod
+    def field_size(value: Any) -> int:
+        """字段的BSON字节数"""
+        return len(bson.encode({"v": value}))
+
+    @staticmethod
+    def plan_preview(sql_plan: Any) -> str:
+        """与列表页一致的首尾截断文本"""
+        text = ",".join(str(item) for item in sql_plan) if isinstance(sql_plan, list) else str(sql_plan)
+        if len(text) <= PREVIEW_LENGTH * 2:
+            return text
+        return f"{text[:PREVIEW_LENGTH]}\n...\n{text[-PREVIEW_LENGTH:]}"
+
+    @staticmethod
+    async def externalize_record(
+        db, collection_name: str, record: Dict[str, Any], threshold: Optional[int] = None, dry_run: bool = False
+    ) -> Dict[str, int]:
+        """把记录中超过阈值的大字段写入GridFS并替换为引用，返回 {"size": 原始, "stored": 压缩后}"""
+        threshold = BlobStoreService.size_threshold if threshold is None else threshold
+        bucket = BlobStoreService._bucket(db)
+        updates: Dict[str, Any] = {}
+        unset: Dict[str, str] = {}
+        totals = {"size": 0, "stored": 0}
+        for field in BLOB_FIELDS:
+            value = record.get(field)
+            if value is None or f"{field}_ref" in record:
+                continue
+            if BlobStoreService.field_size(value) < threshold:
+                continue
+            encoded = BlobStoreService.encode(value)
+            totals["size"] += encoded["size"]
+            totals["stored"] += encoded["stored"]
+            if dry_run:
+                continue
+            file_id = await bucket.upload_from_stream(
+                f"{collection_name}/{record['_id']}/{field}",
+                encoded["payload"],
+                metadata={
+                    "collection": collection_name,
+                    "record_id": record["_id"],
+                    "field": field,
+                    "codec": encoded["codec"],
+                    "raw_size": encoded["size"],
+                },
+            )
+            updates[f"{field}_ref"] = {
+                "id": file_id, "codec": encoded["codec"], "size": encoded["size"], "stored": encoded["stored"]
+            }
+            unset[field] = ""
+            if field == "sql_plan":
+                updates["sql_plan_preview"] = BlobStoreService.plan_preview(value)
+        if updates:
+            await db[collection_name].update_one({"_id": record["_id"]}, {"$set": updates, "$unset": unset})
+        return totals
+
+    @staticmethod
+    async def hydrate(db, record: Dict[str, Any], fields: Iterable[str] = ("sql_plan",)) -> Dict[str, Any]:
+        """按需从GridFS读取外置字段并解压回记录中"""
+        bucket = None
+        for field in fields:
+            ref = record.get(f"{field}_ref")
+            if not ref or field in record:
+                continue
+            bucket = bucket or BlobStoreService._bucket(db)
+            stream = await bucket.open_download_stream(ref["id"])
+            record[field] = BlobStoreService.decode(await stream.read(), ref["codec"])
+        return record
+
+    @staticmethod
+    def apply_list_preview(record: Dict[str, Any]) -> Dict[str, Any]:
+        """列表接口只需截断后的计划文本"""
+        if "sql_plan" not in record and "sql_plan_preview" in record:
+            record["sql_plan"] = record["sql_plan_preview"]
+        for field in BLOB_FIELDS:
+            record.pop(f"{field}_ref", None)
+        record.pop("sql_plan_preview", None)
+        return record
+
+    @staticmethod
+    async def migrate_collection(
+        db, collection_name: str, threshold: Optional[int] = None, batch_size: int = 200, dry_run: bool = False
+    ) -> Dict[str, Any]:
+        """把已有集合中超过阈值的大字段外置"""
+        threshold = BlobStoreService.size_threshold if threshold is None else threshold
+        started = time.perf_counter()
+        query = {"$or": [{field: {"$exists": True}} for field in BLOB_FIELDS]}
+        projection = {field: 1 for field in BLOB_FIELDS}
+        projection.update({f"{field}_ref": 1 for field in BLOB_FIELDS})
+        scanned = moved = 0
+        totals = {"size": 0, "stored": 0}
+        cursor = db[collection_name].find(query, projection, batch_size=batch_size, no_cursor_timeout=True)
+        try:
+            async for record in cursor:
+                scanned += 1
+                result = await BlobStoreService.externalize_record(db, collection_name, record, threshold, dry_run)
+                if result["size"]:
+                    moved += 1
+                    totals["size"] += result["size"]
+                    totals["stored"] += result["stored"]
+                if scanned % 1000 == 0:
+                    logger.info("大字段外置进度", extra={"collection": collection_name, "scanned": scanned, "moved": moved})
+        finally:
+            await cursor.close()
+        return {
+            "collection": collection_name,
+            "dry_run": dry_run,
+            "threshold": threshold,
+            "scanned": scanned,
+            "externalized_records": moved,
+            "raw_bytes": totals["size"],
+            "stored_bytes": totals["stored"],
+            "saved_bytes": totals["size"] - totals["stored"],
+            "elapsed_seconds": round(time.perf_counter() - started, 1),
+        }
+
+    @staticmethod
+    async def size_report(db, collection_name: str) -> Dict[str, Any]:
+        """集合大小与外置存储节省的字节数"""
+        stats = await db.command("collStats", collection_name)
+        blob_totals = await db[f"{BlobStoreService.bucket_name}.files"].aggregate([
+            {"$match": {"metadata.collection": collection_name}},
+            {"$group": {
+                "_id": "$metadata.field",
+                "files": {"$sum": 1},
+                "raw_bytes": {"$sum": "$metadata.raw_size"},
+                "stored_bytes": {"$sum": "$length"},
+            }},
+        ]).to_list(None)
+        fields = {
+            item["_id"]: {
+                "files": item["files"],
+                "raw_bytes": item["raw_bytes"],
+                "stored_bytes": item["stored_bytes"],
+                "saved_bytes": item["raw_bytes"] - item["stored_bytes"],
+            }
+            for item in blob_totals
+        }
+        return {
+            "collection": collection_name,
+            "count": stats.get("count", 0),
+            "size": stats.get("size", 0),
+            "storage_size": stats.get("storageSize", 0),
+            "avg_obj_size": stats.get("avgObjSize", 0),
+            "total_index_size": stats.get("totalIndexSize", 0),
+            "codec": BlobStoreService.default_codec(),
+            "externalized": fields,
+            "saved_bytes": sum(item["saved_bytes"] for item in fields.values()),
+        }
@@ -0,0 +1,224 @@
+"""集合目录服务
+
+在后台定期探测每个集合，结果保存在内存中，/collections直接返回，打开页面时不再对每个
+集合分别计算基础统计。每个集合的探测项并发执行，集合之间用asyncio.gather并发、信号量限流：
+
+- 文档数估计（estimated_document_count，读取元数据，不扫描）
+- 存储大小（collStats）
+- timestamp最小/最大值（走timestamp索引）
+- 派生字段覆盖率（$sample抽样统计字段存在比例）
+- 索引状态（已有索引、趋势/去重等功能依赖但缺失的索引）
+
+平台自身的辅助集合（预聚合、计划结构、GridFS等）不列入目录。按请求选择非活动连接目标时，
+该目标使用单独的目录（catalog_for）。
+
+环境变量:
+    CATALOG_REFRESH_SECONDS   后台刷新间隔，默认300
+    CATALOG_CONCURRENCY       同时探测的集合数，默认8
+    CATALOG_COVERAGE_SAMPLE   覆盖率抽样文档数，默认1000
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.database import db_config
+
+logger = logging.getLogger(__name__)
+
+# 录入后计算的派生字段
+DERIVED_FIELDS = (
+    "table_count",
+    "sql_plan_metrics",
+    "enhanced_complexity_analysis",
+    "complexity_level",
+    "complexity_score",
+    "sql_fingerprint",
+    "plan_hash",
+)
+# 各功能依赖的索引（按键序列比较）
+EXPECTED_INDEXES = {
+    "timestamp": [("timestamp", 1)],
+    "file_name_timestamp": [("file_name", 1), ("timestamp", 1)],
+    "sql_fingerprint_timestamp": [("sql_fingerprint", 1), ("timestamp", 1)],
+    "plan_hash": [("plan_hash", 1)],
+    "complexity_level_timestamp": [("complexity_level", 1), ("timestamp", -1)],
+}
+
+
+def is_internal_collection(name: str) -> bool:
+    """平台自身的辅助集合"""
+    return (
+        name.startswith(("_", "system."))
+        or "__" in name
+        or name.startswith("record_blobs.")
+        or name == "plan_shapes"
+    )
+
+
+class CollectionCatalog:
+    """集合元信息的内存目录"""
+
+    def __init__(self):
+        self.refresh_seconds = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+        self.concurrency = int(os.getenv("CATALOG_CONCURRENCY", "8"))
+        self.coverage_sample = int(os.getenv("CATALOG_COVERAGE_SAMPLE", "1000"))
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+
+    async def _coverage(self, collection) -> Dict[str, float]:
+        group: Dict[str, Any] = {"_id": None, "n": {"$sum": 1}}
+        for index, field in enumerate(DERIVED_FIELDS):
+            group[f"f{index}"] = {"$sum": {"$cond": [{"$eq": [{"$type": f"${field}"}, "missing"]}, 0, 1]}}
+        result = await collection.aggregate([{"$sample": {"size": self.coverage_sample}}, {"$group": group}]).to_list(None)
+        if not result or not result[0]["n"]:
+            return {field: 0.0 for field in DERIVED_FIELDS}
+        n = result[0]["n"]
+        return {field: round(result[0][f"f{index}"] / n, 4) for index, field in enumerate(DERIVED_FIELDS)}
+
+    @staticmethod
+    async def _indexes(collection) -> Dict[str, Any]:
+        indexes = await collection.index_information()
+        key_sets = [[(k, int(d)) for k, d in info["key"]] for info in indexes.values()]
+        missing = [name for name, keys in EXPECTED_INDEXES.items() if keys not in key_sets]
+        return {"names": sorted(indexes), "missing": missing}
+
+    @staticmethod
+    async def _time_range(collection) -> Dict[str, Optional[float]]:
+        query = {"timestamp": {"$type": "number"}}
+        first, last = await asyncio.gather(
+            collection.find_one(query, {"timestamp": 1}, sort=[("timestamp", 1)]),
+            collection.find_one(query, {"timestamp": 1}, sort=[("timestamp", -1)]),
+        )
+        return {
+            "min_timestamp": (first or {}).get("timestamp"),
+            "max_timestamp": (last or {}).get("timestamp"),
+        }
+
+    async def probe(self, db, name: str) -> Dict[str, Any]:
+        """探测单个集合"""
+        collection = db[name]
+        started = time.perf_counter()
+        count, stats, time_range, coverage, indexes = await asyncio.gather(
+            collection.estimated_document_count(),
+            db.command("collStats", name),
+            self._time_range(collection),
+            self._coverage(collection),
+            self._indexes(collection),
+        )
+        entry = {
+            "name": name,
+            "estimated_count": count,
+            "size": stats.get("size", 0),
+            "storage_size": stats.get("storageSize", 0),
+            "avg_obj_size": stats.get("avgObjSize", 0),
+            "total_index_size": stats.get("totalIndexSize", 0),
+            "field_coverage": coverage,
+            "indexes": indexes["names"],
+            "missing_indexes": indexes["missing"],
+            "probed_at": time.time(),
+            "probe_ms": round((time.perf_counter() - started) * 1000, 1),
+            "error": None,
+        }
+        entry.update(time_range)
+        return entry
+
+    async def refresh(self, db) -> Dict[str, Dict[str, Any]]:
+        """并发探测全部集合"""
+        async with self._refresh_lock:
+            started = time.perf_counter()
+            names = [n for n in await db.list_collection_names() if not is_internal_collection(n)]
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def limited(name: str):
+                async with semaphore:
+                    return await self.probe(db, name)
+
+            results = await asyncio.gather(*(limited(name) for name in names), return_exceptions=True)
+            entries = {}
+            for name, result in zip(names, results):
+                if isinstance(result, Exception):
+                    # 单个集合失败时保留上次的结果
+                    previous = self.entries.get(name, {"name": name})
+                    entries[name] = dict(previous, error=str(result))
+                    logger.warning("集合探测失败: %s", result, extra={"collection": name})
+                else:
+                    entries[name] = result
+            self.entries = entries
+            self.refreshed_at = time.time()
+            logger.info("集合目录已刷新", extra={
+                "collections": len(entries), "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+            return entries
+
+    async def _refresh_loop(self, db) -> None:
+        while True:
+            if self.refreshed_at is not None:
+                await asyncio.sleep(max(self.refresh_seconds - (time.time() - self.refreshed_at), 0))
+            try:
+                await self.refresh(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("集合目录刷新失败: %s", e)
+                await asyncio.sleep(self.refresh_seconds)
+
+    def start(self, db) -> None:
+        """启动后台定期刷新"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get(self, db) -> Dict[str, Dict[str, Any]]:
+        """返回内存中的目录；首次调用时同步刷新一次并启动后台刷新"""
+        if self.refreshed_at is None:
+            await self.refresh(db)
+        self.start(db)
+        return self.entries
+
+    def names(self) -> List[str]:
+        return sorted(self.entries)
+
+    async def reset(self) -> None:
+        """停止后台刷新并清空目录，下次访问时重新探测"""
+        await self.stop()
+        self.entries = {}
+        self.refreshed_at = None
+
+
+collection_catalog = CollectionCatalog()
+# 非活动连接目标的目录
+target_catalogs: Dict[str, CollectionCatalog] = {}
+
+
+def catalog_for(target: Optional[str] = None) -> CollectionCatalog:
+    """连接目标对应的目录，活动目标使用collection_catalog"""
+    if target is None or target == db_config.active:
+        return collection_catalog
+    catalog = target_catalogs.get(target)
+    if catalog is None:
+        catalog = target_catalogs[target] = CollectionCatalog()
+    return catalog
+
+
+async def reset_catalogs(target: Optional[str] = None) -> None:
+    """连接目标变化后重置目录，target为None时重置全部"""
+    if target is None:
+        await collection_catalog.reset()
+        catalogs = list(target_catalogs.values())
+        target_catalogs.clear()
+    else:
+        catalogs = [c for c in [target_catalogs.pop(target, None)] if c is not None]
+    for catalog in catalogs:
+        await catalog.stop()
@@ -1,78 +1,103 @@
-"""复杂度计算服务"""
-from typing import Optional, Dict, Any
-from enum import Enum
+"""复杂度计算服务
+
+逐条计算（calculate_complexity_from_record）之外提供批量计算：在MongoDB中把每条记录投影为
+数值列（执行时间、表数量、行数、节点数及计划特征），用NumPy一次计算整批的分数和等级，
+写回 complexity_score / complexity_level，并建立 (complexity_level, timestamp) 索引，
+按复杂度筛选和分布统计都走索引查询。
+
+新写入的记录没有等级，由 manage.py score-complexity 或后台增量任务补上：设置
+COMPLEXITY_SCORE_INTERVAL后，服务每隔该秒数对各业务集合（或COMPLEXITY_SCORE_COLLECTIONS）
+处理最多COMPLEXITY_SCORE_LIMIT条 complexity_level 不存在的记录。
+
+环境变量:
+    COMPLEXITY_SCORE_INTERVAL      后台增量计算间隔（秒），默认0即不在服务内计算
+    COMPLEXITY_SCORE_COLLECTIONS   后台计算的集合，逗号分隔，默认全部业务集合
+    COMPLEXITY_SCORE_LIMIT         每个集合每轮最多计算的记录数，默认50000
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+from app.core import lease
+from app.core.database import db_config
+from app.core.execution import query_options
 from app.schemas import ComplexityLevel
+from app.services.catalog import is_internal_collection
+
+logger = logging.getLogger(__name__)
+
+# 计划特征对应的节点类型（sql_plan_metrics.nodes为前序的节点类型列表）
+JOIN_NODE_TYPES = ["Nested Loop", "Hash Join", "Merge Join"]
+SORT_NODE_TYPES = ["Sort", "Incremental Sort", "Aggregate", "HashAggregate", "GroupAggregate", "WindowAgg"]
+SCAN_NODE_TYPES = ["Seq Scan", "Parallel Seq Scan"]
 
 class ComplexityService:
     """复杂度计算和转换服务"""
     
+    # 复杂度等级对应的代表数值
+    LEVEL_SCORES = {
+        'LOW': 15,
+        'MEDIUM': 50,
+        'HIGH': 95,
+        'VERY_HIGH': 160,
+        'EXTREME': 250
+    }
+    
+    # 等级上界（含），与calculate_complexity_level一致
+    LEVEL_BOUNDS = np.array([50.0, 100.0, 200.0, 400.0])
+    LEVEL_NAMES = np.array([level.value for level in ComplexityLevel])
+    
+    # 批量计算的列权重；前三项与calculate_complexity_from_record的公式一致
+    BATCH_WEIGHTS = {
+        'execution_time_ms': 0.1,
+        'table_count': 10.0,
+        'row_count': 0.0005,
+        'node_count': 1.0,
+        'join_count': 5.0,
+        'sort_count': 3.0,
+        'seq_scan_count': 2.0,
+    }
+    
     @staticmethod
     def get_complexity_from_database(record: Dict[str, Any]) -> Optional[float]:
         """从数据库记录中获取复杂度数值"""
-        print(f"[DEBUG] 正在检查记录字段，key数量: {len(record.keys())}")
-        
         # 优先从 enhanced_complexity_analysis 中获取真实的total_complexity
         enhanced_analysis = record.get('enhanced_complexity_analysis')
-        print(f"[DEBUG] enhanced_complexity_analysis字段: {enhanced_analysis}")
         if enhanced_analysis and isinstance(enhanced_analysis, dict):
-            print(f"[DEBUG] enhanced_analysis字段: {list(enhanced_analysis.keys())}")
-            
-            # 优先获取total_complexity_score（真实的复杂度数值）
-            total_complexity = enhanced_analysis.get('total_complexity_score')
-            print(f"[DEBUG] total_complexity_score: {total_complexity}")
-            if total_complexity is not None:
-                try:
-                    result = float(total_complexity)
-                    print(f"[DEBUG] 从total_complexity_score获取到真实复杂度: {result}")
-                    return result
-                except (ValueError, TypeError) as e:
-                    print(f"[DEBUG] 无法转换total_complexity_score为数值: {e}")
-            
-            # 备选：尝试complexity_score
-            complexity_score = enhanced_analysis.get('complexity_score')
-            print(f"[DEBUG] complexity_score: {complexity_score}")
-            if complexity_score is not None:
+            # 优先获取total_complexity_score（真实的复杂度数值），备选complexity_score
+            for field in ('total_complexity_score', 'complexity_score'):
+                value = enhanced_analysis.get(field)
+                if value is None:
+                    continue
                 try:
-                    result = float(complexity_score)
-                    print(f"[DEBUG] 从complexity_score获取到复杂度: {result}")
-                    return result
-                except (ValueError, TypeError) as e:
-                    print(f"[DEBUG] 无法转换complexity_score为数值: {e}")
+                    return float(value)
+                except (ValueError, TypeError):
+                    logger.debug("无法转换%s为数值", field, extra={"value": repr(value), "sampled": True})
         
         # 备选：使用actual_processing_complexity字段
         complexity = record.get('actual_processing_complexity')
-        print(f"[DEBUG] actual_processing_complexity字段: {complexity} (类型: {type(complexity)})")
+        if complexity is None:
+            return None
         
-        if complexity is not None:
-            # 如果是字符串，可能是复杂度等级，需要转换为数值
-            if isinstance(complexity, str):
-                print(f"[DEBUG] actual_processing_complexity是字符串，尝试解析为复杂度等级")
-                level_mapping = {
-                    'LOW': 15,        # 低复杂度等级对应15
-                    'MEDIUM': 50,     # 中等复杂度等级对应50
-                    'HIGH': 95,       # 高复杂度等级对应95
-                    'VERY_HIGH': 160, # 非常高复杂度等级对应160
-                    'EXTREME': 250    # 极高复杂度等级对应250
-                }
-                if complexity in level_mapping:
-                    result = level_mapping[complexity]
-                    print(f"[DEBUG] 从复杂度等级 '{complexity}' 转换为数值: {result}")
-                    return result
-                else:
-                    print(f"[DEBUG] 未知的复杂度等级: {complexity}")
-                    return None
-            else:
-                # 如果是数值，直接转换
-                try:
-                    result = float(complexity)
-                    print(f"[DEBUG] 从actual_processing_complexity获取到数值复杂度: {result}")
-                    return result
-                except (ValueError, TypeError) as e:
-                    print(f"[DEBUG] 无法转换actual_processing_complexity为数值: {e}")
-                    return None
+        # 如果是字符串，可能是复杂度等级，需要转换为数值
+        if isinstance(complexity, str):
+            result = ComplexityService.LEVEL_SCORES.get(complexity)
+            if result is None:
+                logger.debug("未知的复杂度等级", extra={"value": complexity, "sampled": True})
+            return result
         
-        print(f"[DEBUG] 数据库中未找到可用的复杂度数值，返回None")
-        return None
+        # 如果是数值，直接转换
+        try:
+            return float(complexity)
+        except (ValueError, TypeError):
+            logger.debug("无法转换actual_processing_complexity为数值",
+                         extra={"value": repr(complexity), "sampled": True})
+            return None
     
     @staticmethod
     def calculate_complexity_from_record(record: Dict[str, Any]) -> float:
@@ -97,7 +122,7 @@ class ComplexityService:
             
             return max(complexity, 1.0)  # 最小复杂度为1
         except Exception as e:
-            print(f"计算复杂度失败: {e}")
+            logger.warning("计算复杂度失败: %s", e)
             return 1.0
     
     @staticmethod
@@ -153,4 +178,236 @@ class ComplexityService:
             ComplexityLevel.EXTREME: '极高'
         }
         
-        return text_map.get(complexity_level, '未知')
\ No newline at end of file
+        return text_map.get(complexity_level, '未知')
+    @staticmethod
+    def score_batch(columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """按列批量计算复杂度分数，existing_score列中非NaN的值（库中已有的分数）优先"""
+        n = len(columns['execution_time_ms'])
+        scores = np.zeros(n, dtype=np.float64)
+        for field, weight in ComplexityService.BATCH_WEIGHTS.items():
+            values = columns.get(field)
+            if values is not None:
+                scores += np.nan_to_num(np.asarray(values, dtype=np.float64)) * weight
+        scores = np.maximum(scores, 1.0)  # 最小复杂度为1
+        existing = columns.get('existing_score')
+        if existing is not None:
+            existing = np.asarray(existing, dtype=np.float64)
+            scores = np.where(np.isnan(existing), scores, existing)
+        return scores
+    
+    @staticmethod
+    def levels_batch(scores: np.ndarray, existing_levels: Optional[np.ndarray] = None) -> np.ndarray:
+        """分数数组对应的等级名数组；existing_levels中非空的等级（库中直接记录的等级名）优先"""
+        levels = ComplexityService.LEVEL_NAMES[np.searchsorted(ComplexityService.LEVEL_BOUNDS, scores, side='left')]
+        if existing_levels is not None:
+            levels = np.where(existing_levels != '', existing_levels, levels)
+        return levels
+    
+    @staticmethod
+    def _existing_score(value: Any) -> float:
+        """库中已有的分数（数值或等级名），无法识别时为NaN"""
+        if isinstance(value, str) and value in ComplexityService.LEVEL_SCORES:
+            return float(ComplexityService.LEVEL_SCORES[value])
+        try:
+            return float(value) if value is not None else np.nan
+        except (ValueError, TypeError):
+            return np.nan
+    
+    @staticmethod
+    def feature_projection() -> Dict[str, Any]:
+        """把记录投影为批量计算需要的数值列（在MongoDB中完成类型转换和节点计数）"""
+        nodes = {"$cond": [{"$isArray": "$sql_plan_metrics.nodes"}, "$sql_plan_metrics.nodes", []]}
+        
+        def number(field: str) -> Dict[str, Any]:
+            return {"$convert": {"input": f"${field}", "to": "double", "onError": 0.0, "onNull": 0.0}}
+        
+        def count_types(types: List[str]) -> Dict[str, Any]:
+            # 节点可能是类型字符串，也可能是带Node Type的对象
+            node_type = {"$ifNull": ["$$this.Node Type", "$$this"]}
+            return {"$size": {"$filter": {"input": nodes, "cond": {"$in": [node_type, types]}}}}
+        
+        return {
+            "execution_time_ms": number("execution_time_ms"),
+            "table_count": number("table_count"),
+            "row_count": number("row_count"),
+            "node_count": {"$size": nodes},
+            "join_count": count_types(JOIN_NODE_TYPES),
+            "sort_count": count_types(SORT_NODE_TYPES),
+            "seq_scan_count": count_types(SCAN_NODE_TYPES),
+            "existing_score": {"$ifNull": [
+                "$enhanced_complexity_analysis.total_complexity_score",
+                {"$ifNull": ["$enhanced_complexity_analysis.complexity_score", "$actual_processing_complexity"]},
+            ]},
+        }
+    
+    @staticmethod
+    def columns_from_docs(docs: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """feature_projection的结果转换为列数组"""
+        columns = {
+            field: np.fromiter((doc.get(field) or 0 for doc in docs), dtype=np.float64, count=len(docs))
+            for field in ComplexityService.BATCH_WEIGHTS
+        }
+        columns['existing_score'] = np.fromiter(
+            (ComplexityService._existing_score(doc.get('existing_score')) for doc in docs),
+            dtype=np.float64, count=len(docs)
+        )
+        columns['existing_level'] = np.array(
+            [value if isinstance(value, str) and value in ComplexityService.LEVEL_SCORES else '' for value in (doc.get('existing_score') for doc in docs)],
+            dtype=ComplexityService.LEVEL_NAMES.dtype
+        )
+        return columns
+    
+    # (连接地址, 数据库, 集合名)，见db_config.scope
+    _indexed_collections: Set[Tuple[str, str, str]] = set()
+    
+    @staticmethod
+    async def ensure_indexes(db, collection_name: str) -> None:
+        scope = db_config.scope(collection_name)
+        if scope in ComplexityService._indexed_collections:
+            return
+        collection = db[collection_name]
+        await collection.create_index([("complexity_level", 1), ("timestamp", -1)])
+        await collection.create_index([("complexity_score", -1)], sparse=True)
+        ComplexityService._indexed_collections.add(scope)
+    
+    @staticmethod
+    async def score_collection(
+        db,
+        collection_name: str,
+        batch_size: int = 5000,
+        rescore: bool = False,
+        dry_run: bool = False,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """批量计算并写回复杂度分数和等级，默认只处理尚未计算的记录，limit限制本次处理的记录数"""
+        started = time.perf_counter()
+        collection = db[collection_name]
+        if not dry_run:
+            await ComplexityService.ensure_indexes(db, collection_name)
+        match = {} if rescore else {"complexity_level": {"$exists": False}}
+        pipeline: List[Dict[str, Any]] = [{"$match": match}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": ComplexityService.feature_projection()})
+        cursor = collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+        scanned = updated = 0
+        levels = {str(name): 0 for name in ComplexityService.LEVEL_NAMES}
+        
+        async def flush(docs: List[Dict[str, Any]]) -> None:
+            nonlocal scanned, updated
+            columns = ComplexityService.columns_from_docs(docs)
+            scores = ComplexityService.score_batch(columns)
+            names = ComplexityService.levels_batch(scores, columns['existing_level'])
+            scanned += len(docs)
+            for name, count in zip(*np.unique(names, return_counts=True)):
+                levels[str(name)] += int(count)
+            if dry_run:
+                return
+            result = await collection.bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"complexity_score": round(float(score), 2), "complexity_level": str(name)}})
+                for doc, score, name in zip(docs, scores, names)
+            ], ordered=False)
+            updated += result.modified_count
+        
+        batch: List[Dict[str, Any]] = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+        
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("复杂度批量计算完成", extra={"collection": collection_name, "scanned": scanned, "updated": updated, "elapsed_ms": elapsed})
+        return {"collection": collection_name, "scanned": scanned, "updated": updated,
+                "levels": levels, "dry_run": dry_run, "elapsed_ms": elapsed}
+    
+    @staticmethod
+    async def get_distribution(db, collection_name: str, slow_sql_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """复杂度等级分布（每个等级的记录数、平均分数和平均执行时间），slow_sql_threshold为空时统计全部记录"""
+        match = {} if slow_sql_threshold is None else {"execution_time_ms": {"$gt": slow_sql_threshold}}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"$ifNull": ["$complexity_level", None]},
+                "count": {"$sum": 1},
+                "avg_score": {"$avg": "$complexity_score"},
+                "avg_execution_time": {"$avg": "$execution_time_ms"},
+                "max_execution_time": {"$max": "$execution_time_ms"},
+            }},
+        ]
+        results = await db[collection_name].aggregate(pipeline, **query_options("stats")).to_list(None)
+        by_level = {result["_id"]: result for result in results}
+        
+        distribution = []
+        for level in ComplexityLevel:
+            result = by_level.get(level.value, {})
+            distribution.append({
+                "level": level.value,
+                "label": ComplexityService.get_complexity_display_text(level),
+                "color": ComplexityService.get_complexity_color(level),
+                "count": result.get("count", 0),
+                "avg_score": result.get("avg_score"),
+                "avg_execution_time": result.get("avg_execution_time"),
+                "max_execution_time": result.get("max_execution_time"),
+            })
+        known = {level.value for level in ComplexityLevel}
+        unscored = sum(r["count"] for key, r in by_level.items() if key not in known)
+        return {
+            "distribution": distribution,
+            "unscored": unscored,
+            "total": sum(r["count"] for r in results),
+            "threshold": slow_sql_threshold,
+        }
+
+
+class ComplexityScoringScheduler:
+    """服务内按COMPLEXITY_SCORE_INTERVAL定期为新记录计算复杂度等级"""
+
+    def __init__(self):
+        self.interval = float(os.getenv("COMPLEXITY_SCORE_INTERVAL", "0"))
+        self.collections = [c.strip() for c in os.getenv("COMPLEXITY_SCORE_COLLECTIONS", "").split(",") if c.strip()]
+        self.limit = int(os.getenv("COMPLEXITY_SCORE_LIMIT", "50000"))
+        self.last_results: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def score_all(self, db) -> List[Dict[str, Any]]:
+        names = self.collections or [n for n in await db.list_collection_names() if not is_internal_collection(n)]
+        results = []
+        for name in names:
+            try:
+                results.append(await ComplexityService.score_collection(db, name, limit=self.limit))
+            except Exception as e:
+                logger.warning("复杂度增量计算失败: %s", e, extra={"collection": name})
+                results.append({"collection": name, "error": str(e)})
+        return results
+
+    async def _loop(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # 多worker/多主机时每个间隔只由抢到租约的进程执行
+                if not await lease.acquire(db, "complexity_scoring", self.interval * lease.ROUND_FRACTION):
+                    continue
+                self.last_results = await self.score_all(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("复杂度定期计算失败: %s", e)
+
+    def start(self, db) -> None:
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+complexity_scheduler = ComplexityScoringScheduler()
@@ -0,0 +1,600 @@
+"""DuckDB分析镜像
+
+把记录的标量指标和按节点展开的计划指标增量同步到本地DuckDB文件，临时性的分析
+（例如"上个月/etl/下脚本各关系上Hash Join自身耗时的中位数"）在列式引擎中执行，
+不占用业务MongoDB：
+
+    records(collection, record_id, file_name, file_path, status, execution_time_ms, row_count, table_count,
+            node_count, timestamp, planning_time, plan_execution_time, plan_hash, sql_fingerprint,
+            complexity_level, complexity_score)
+    nodes(collection, record_id, timestamp, node_index, parent_index, depth, node_type, relation_name,
+          index_name, join_type, <节点数值指标>, exclusive_time)
+    sync_state(collection, high_water_mark, records, updated_at)
+
+节点展开与Parquet导出相同（ParquetExportService.flatten_plan），exclusive_time为节点自身耗时。
+同步按timestamp高水位增量读取，每批在一个事务中写入并推进高水位，中断后从上次提交处继续；
+保留策略删除的记录不会从镜像中删除，需要时用full=True重建。
+
+DuckDB文件同一时刻只能被一个进程写入：同步时只在每批写入时短暂打开写连接（被查询占用时等待重试），
+查询使用只读连接，并禁止访问外部文件、安装扩展和修改配置；查询超时后中断执行。
+每个连接目标使用单独的镜像文件。
+
+duckdb和pyarrow为可选依赖，未安装时调用会抛出RuntimeError。
+
+环境变量:
+    DUCKDB_MIRROR_PATH        镜像文件路径，默认exports/mirror.duckdb（非默认连接目标追加目标名）
+    DUCKDB_QUERY_TIMEOUT      查询超时秒数，默认30
+    DUCKDB_QUERY_MAX_ROWS     查询最多返回的行数，默认10000
+    DUCKDB_MEMORY_LIMIT       查询连接的内存上限，默认1GB
+    DUCKDB_THREADS            查询连接的线程数，默认2
+    DUCKDB_SYNC_INTERVAL      后台增量同步间隔（秒），默认0即不启用
+    DUCKDB_SYNC_COLLECTIONS   后台同步的集合（逗号分隔），默认全部业务集合
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from app.core.database import DEFAULT_TARGET
+from app.core.execution import find_options
+from app.services.catalog import is_internal_collection
+from app.services.parquet_export import NODE_LABELS, NODE_METRICS, ParquetExportService
+from app.services.sql_analysis import SqlAnalysisService, tokenize
+
+try:
+    import duckdb
+    import pyarrow as pa
+except ImportError:  # 可选依赖
+    duckdb = None
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+RECORD_COLUMNS = (
+    ("collection", "VARCHAR"),
+    ("record_id", "VARCHAR"),
+    ("file_name", "VARCHAR"),
+    ("file_path", "VARCHAR"),
+    ("status", "VARCHAR"),
+    ("execution_time_ms", "DOUBLE"),
+    ("row_count", "BIGINT"),
+    ("table_count", "INTEGER"),
+    ("node_count", "INTEGER"),
+    ("timestamp", "DOUBLE"),
+    ("planning_time", "DOUBLE"),
+    ("plan_execution_time", "DOUBLE"),
+    ("plan_hash", "VARCHAR"),
+    ("sql_fingerprint", "VARCHAR"),
+    ("complexity_level", "VARCHAR"),
+    ("complexity_score", "DOUBLE"),
+)
+NODE_COLUMNS = (
+    ("collection", "VARCHAR"),
+    ("record_id", "VARCHAR"),
+    ("timestamp", "DOUBLE"),
+    ("node_index", "INTEGER"),
+    ("parent_index", "INTEGER"),
+    ("depth", "SMALLINT"),
+    *((name, "VARCHAR") for name, _ in NODE_LABELS),
+    *((name, "DOUBLE" if kind == "float" else "BIGINT") for name, _, kind in NODE_METRICS),
+    ("exclusive_time", "DOUBLE"),
+)
+# 记录中原样复制的字段
+COPIED_FIELDS = (
+    "file_name", "file_path", "status", "execution_time_ms", "row_count", "table_count", "timestamp",
+    "plan_hash", "sql_fingerprint", "complexity_level", "complexity_score",
+)
+ARROW_TYPES = {
+    "VARCHAR": "string", "DOUBLE": "float64", "BIGINT": "int64", "INTEGER": "int32", "SMALLINT": "int16",
+}
+# /analysis/query允许的语句（首个关键词）
+READ_STATEMENTS = frozenset({"SELECT", "WITH", "FROM", "VALUES", "DESCRIBE", "SHOW", "SUMMARIZE", "PIVOT", "UNPIVOT"})
+
+# 预置报表：参数在调用时按名称绑定（$since由days换算）
+REPORTS: Dict[str, Dict[str, Any]] = {
+    "node_self_time": {
+        "description": "各节点类型、关系上的自身耗时中位数/P95/合计（可按脚本路径前缀和节点类型筛选）",
+        "params": ("collection", "since", "path_prefix", "node_type", "limit"),
+        "sql": """
+            SELECT n.node_type, n.relation_name, count(*) AS nodes,
+                   median(n.exclusive_time) AS median_self_ms,
+                   quantile_cont(n.exclusive_time, 0.95) AS p95_self_ms,
+                   sum(n.exclusive_time) AS total_self_ms
+            FROM nodes n
+            JOIN records r ON r.collection = n.collection AND r.record_id = n.record_id
+            WHERE n.collection = $collection AND n.timestamp >= $since
+              AND (CAST($path_prefix AS VARCHAR) IS NULL OR starts_with(r.file_path, $path_prefix))
+              AND (CAST($node_type AS VARCHAR) IS NULL OR n.node_type = $node_type)
+            GROUP BY n.node_type, n.relation_name
+            ORDER BY total_self_ms DESC NULLS LAST
+            LIMIT $limit
+        """,
+    },
+    "script_latency": {
+        "description": "各脚本的执行次数、失败率和耗时分位数",
+        "params": ("collection", "since", "path_prefix", "limit"),
+        "sql": """
+            SELECT file_name, any_value(file_path) AS file_path, count(*) AS executions,
+                   avg(CASE WHEN status = 'error' THEN 1 ELSE 0 END) AS error_rate,
+                   median(execution_time_ms) AS median_ms,
+                   quantile_cont(execution_time_ms, 0.95) AS p95_ms,
+                   quantile_cont(execution_time_ms, 0.99) AS p99_ms,
+                   max(execution_time_ms) AS max_ms
+            FROM records
+            WHERE collection = $collection AND timestamp >= $since
+              AND (CAST($path_prefix AS VARCHAR) IS NULL OR starts_with(file_path, $path_prefix))
+            GROUP BY file_name
+            ORDER BY p95_ms DESC NULLS LAST
+            LIMIT $limit
+        """,
+    },
+    "fingerprint_regressions": {
+        "description": "按SQL指纹比较最近days天与之前days天的中位耗时，按变慢倍数排序",
+        "params": ("collection", "since", "previous_since", "limit"),
+        "sql": """
+            WITH windows AS (
+                SELECT sql_fingerprint, any_value(file_name) AS file_name,
+                       median(execution_time_ms) FILTER (WHERE timestamp >= $since) AS recent_median_ms,
+                       median(execution_time_ms) FILTER (WHERE timestamp < $since) AS previous_median_ms,
+                       count(*) FILTER (WHERE timestamp >= $since) AS recent_executions,
+                       count(*) FILTER (WHERE timestamp < $since) AS previous_executions
+                FROM records
+                WHERE collection = $collection AND timestamp >= $previous_since AND sql_fingerprint IS NOT NULL
+                GROUP BY sql_fingerprint
+            )
+            SELECT *, recent_median_ms / nullif(previous_median_ms, 0) AS slowdown
+            FROM windows
+            WHERE recent_executions >= 5 AND previous_executions >= 5
+            ORDER BY slowdown DESC NULLS LAST
+            LIMIT $limit
+        """,
+    },
+    "daily_latency": {
+        "description": "每天的执行次数和耗时分位数",
+        "params": ("collection", "since", "path_prefix"),
+        "sql": """
+            SELECT CAST(to_timestamp(timestamp) AS DATE) AS day, count(*) AS executions,
+                   median(execution_time_ms) AS median_ms,
+                   quantile_cont(execution_time_ms, 0.95) AS p95_ms,
+                   quantile_cont(execution_time_ms, 0.99) AS p99_ms
+            FROM records
+            WHERE collection = $collection AND timestamp >= $since
+              AND (CAST($path_prefix AS VARCHAR) IS NULL OR starts_with(file_path, $path_prefix))
+            GROUP BY day
+            ORDER BY day
+        """,
+    },
+    "plan_churn": {
+        "description": "执行计划结构变化最多的脚本（不同plan_hash数及各计划中位耗时的差距）",
+        "params": ("collection", "since", "limit"),
+        "sql": """
+            WITH per_plan AS (
+                SELECT file_name, plan_hash, count(*) AS executions, median(execution_time_ms) AS median_ms
+                FROM records
+                WHERE collection = $collection AND timestamp >= $since AND plan_hash IS NOT NULL
+                GROUP BY file_name, plan_hash
+            )
+            SELECT file_name, count(*) AS distinct_plans, sum(executions) AS executions,
+                   min(median_ms) AS best_plan_median_ms, max(median_ms) AS worst_plan_median_ms
+            FROM per_plan
+            GROUP BY file_name
+            HAVING count(*) > 1
+            ORDER BY distinct_plans DESC, worst_plan_median_ms DESC
+            LIMIT $limit
+        """,
+    },
+    "seq_scan_hotspots": {
+        "description": "顺序扫描自身耗时最多的表",
+        "params": ("collection", "since", "limit"),
+        "sql": """
+            SELECT relation_name, count(*) AS scans, count(DISTINCT record_id) AS executions,
+                   sum(exclusive_time) AS total_self_ms, median(actual_rows) AS median_rows
+            FROM nodes
+            WHERE collection = $collection AND timestamp >= $since AND node_type = 'Seq Scan'
+            GROUP BY relation_name
+            ORDER BY total_self_ms DESC NULLS LAST
+            LIMIT $limit
+        """,
+    },
+}
+
+
+class MirrorUnavailable(Exception):
+    """镜像文件尚未同步或正被同步进程占用"""
+
+
+class MirrorLocked(MirrorUnavailable):
+    """镜像文件的锁被其他连接持有"""
+
+
+def _require_duckdb() -> None:
+    if duckdb is None or pa is None:
+        raise RuntimeError("DuckDB分析镜像需要安装duckdb和pyarrow")
+
+
+class DuckDBMirrorService:
+    """DuckDB镜像的同步与查询"""
+
+    base_path = os.getenv("DUCKDB_MIRROR_PATH", os.path.join("exports", "mirror.duckdb"))
+    query_timeout = float(os.getenv("DUCKDB_QUERY_TIMEOUT", "30"))
+    max_rows = int(os.getenv("DUCKDB_QUERY_MAX_ROWS", "10000"))
+    memory_limit = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+    threads = int(os.getenv("DUCKDB_THREADS", "2"))
+    # 本进程内同一镜像文件、同一集合的同步串行执行
+    _sync_locks: Dict[Any, asyncio.Lock] = {}
+
+    @staticmethod
+    def mirror_path(target: Optional[str] = None) -> str:
+        """连接目标对应的镜像文件，默认目标使用DUCKDB_MIRROR_PATH"""
+        base = DuckDBMirrorService.base_path
+        if target is None or target == DEFAULT_TARGET:
+            return base
+        root, ext = os.path.splitext(base)
+        return f"{root}-{target}{ext or '.duckdb'}"
+
+    # ---- 同步 ----
+
+    @staticmethod
+    def _ensure_schema(con) -> None:
+        for table, columns in (("records", RECORD_COLUMNS), ("nodes", NODE_COLUMNS)):
+            definition = ", ".join(f"{name} {kind}" for name, kind in columns)
+            con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            "collection VARCHAR PRIMARY KEY, high_water_mark DOUBLE, records BIGINT, updated_at DOUBLE)"
+        )
+
+    @staticmethod
+    def _arrow_table(rows: List[Dict[str, Any]], columns: Sequence) -> "pa.Table":
+        return pa.table({
+            name: pa.array([row.get(name) for row in rows], type=getattr(pa, ARROW_TYPES[kind])())
+            for name, kind in columns
+        })
+
+    @staticmethod
+    def _write_batch(path: str, collection_name: str, record_rows: List[Dict[str, Any]],
+                     node_rows: List[Dict[str, Any]], previous: Optional[float], high_water: float) -> None:
+        """打开写连接，一个事务内写入一批记录和节点并推进高水位，写完立即关闭
+
+        高水位与读取时不同说明其他进程同时在同步该集合，放弃本批避免重复写入。
+        """
+        con = DuckDBMirrorService._connect_writer(path)
+        try:
+            DuckDBMirrorService._ensure_schema(con)
+            con.execute("BEGIN TRANSACTION")
+            try:
+                row = con.execute("SELECT high_water_mark FROM sync_state WHERE collection = ?", [collection_name]).fetchone()
+                if (row[0] if row else None) != previous:
+                    raise MirrorUnavailable("该集合正在被其他进程同步")
+                for table, rows, columns in (("records", record_rows, RECORD_COLUMNS), ("nodes", node_rows, NODE_COLUMNS)):
+                    if not rows:
+                        continue
+                    con.register("_batch", DuckDBMirrorService._arrow_table(rows, columns))
+                    names = ", ".join(name for name, _ in columns)
+                    con.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM _batch")
+                    con.unregister("_batch")
+                con.execute(
+                    "INSERT INTO sync_state VALUES (?, ?, ?, ?) ON CONFLICT (collection) DO UPDATE SET "
+                    "high_water_mark = excluded.high_water_mark, records = sync_state.records + excluded.records, "
+                    "updated_at = excluded.updated_at",
+                    [collection_name, high_water, len(record_rows), time.time()],
+                )
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        finally:
+            con.close()
+
+    @staticmethod
+    def _read_high_water(path: str, collection_name: str, full: bool) -> Optional[float]:
+        """读取集合的高水位，full=True时先删除该集合的镜像数据"""
+        con = DuckDBMirrorService._connect_writer(path)
+        try:
+            DuckDBMirrorService._ensure_schema(con)
+            if full:
+                for table in ("records", "nodes", "sync_state"):
+                    con.execute(f"DELETE FROM {table} WHERE collection = ?", [collection_name])
+            row = con.execute("SELECT high_water_mark FROM sync_state WHERE collection = ?", [collection_name]).fetchone()
+            return row[0] if row else None
+        finally:
+            con.close()
+
+    @staticmethod
+    def _connect_writer(path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            return duckdb.connect(path)
+        except (duckdb.IOException, duckdb.ConnectionException) as e:
+            raise MirrorLocked(f"镜像文件正被查询或其他进程占用: {e}")
+
+    @staticmethod
+    async def _with_writer(func, *args) -> Any:
+        """在线程中执行写操作；文件被查询的只读连接占用时重试，最多等待一个查询超时"""
+        deadline = time.monotonic() + DuckDBMirrorService.query_timeout + 5
+        while True:
+            try:
+                return await asyncio.to_thread(func, *args)
+            except MirrorLocked:
+                if time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+    @staticmethod
+    async def sync_collection(
+        db,
+        collection_name: str,
+        full: bool = False,
+        target: Optional[str] = None,
+        batch_rows: int = 20000,
+        cursor_batch_size: int = 500,
+    ) -> Dict[str, Any]:
+        """把timestamp高水位之后的记录同步到镜像；full=True时删除该集合已有数据后重建
+
+        读取MongoDB和展开计划时不持有镜像文件，只在每批写入时短暂打开写连接，
+        同步期间查询和报表照常可用。
+        """
+        _require_duckdb()
+        started = time.perf_counter()
+        path = DuckDBMirrorService.mirror_path(target)
+        lock = DuckDBMirrorService._sync_locks.setdefault((path, collection_name), asyncio.Lock())
+        counts = {"records": 0, "nodes": 0, "unparsed": 0, "batches": 0}
+        async with lock:
+            high_water = await DuckDBMirrorService._with_writer(
+                DuckDBMirrorService._read_high_water, path, collection_name, full
+            )
+            committed = high_water
+            query: Dict[str, Any] = {"timestamp": {"$gt": high_water}} if high_water is not None else {"timestamp": {"$ne": None}}
+            cursor = db[collection_name].find(
+                query, {"data": 0, "data_ref": 0, "sql_content": 0},
+                batch_size=cursor_batch_size, no_cursor_timeout=True, **find_options("export")
+            ).sort("timestamp", 1)
+
+            record_rows: List[Dict[str, Any]] = []
+            node_rows: List[Dict[str, Any]] = []
+            last_ts = None
+
+            async def flush() -> None:
+                nonlocal record_rows, node_rows, committed
+                await DuckDBMirrorService._with_writer(
+                    DuckDBMirrorService._write_batch, path, collection_name, record_rows, node_rows, committed, last_ts
+                )
+                committed = last_ts
+                counts["batches"] += 1
+                record_rows, node_rows = [], []
+
+            try:
+                async for record in cursor:
+                    timestamp = record.get("timestamp")
+                    # 只在timestamp变化处提交，保证同一时间戳的记录在同一批中，高水位不会跳过记录
+                    if len(record_rows) >= batch_rows and timestamp != last_ts:
+                        await flush()
+                    record_id = str(record["_id"])
+                    explain = await ParquetExportService._load_plan(db, record)
+                    nodes = ParquetExportService.flatten_plan(explain) if explain else []
+                    if explain is None:
+                        counts["unparsed"] += 1
+                    row = {field: record.get(field) for field in COPIED_FIELDS}
+                    row.update({
+                        "collection": collection_name,
+                        "record_id": record_id,
+                        "node_count": len(nodes) if explain else None,
+                        "planning_time": explain.get("Planning Time") if explain else None,
+                        "plan_execution_time": explain.get("Execution Time") if explain else None,
+                    })
+                    record_rows.append(row)
+                    for node in nodes:
+                        node.update(collection=collection_name, record_id=record_id, timestamp=timestamp)
+                        node_rows.append(node)
+                    counts["records"] += 1
+                    counts["nodes"] += len(nodes)
+                    last_ts = timestamp
+                if record_rows:
+                    await flush()
+            finally:
+                await cursor.close()
+
+        result = {
+            "collection": collection_name,
+            "path": path,
+            "full": full,
+            "previous_high_water_mark": high_water,
+            "high_water_mark": last_ts if counts["records"] else high_water,
+            **counts,
+            "elapsed_seconds": round(time.perf_counter() - started, 1),
+        }
+        logger.info("DuckDB镜像同步完成", extra=result)
+        return result
+
+    # ---- 查询 ----
+
+    @staticmethod
+    def _connect_reader(path: str):
+        if not os.path.exists(path):
+            raise MirrorUnavailable("镜像尚未同步，请先执行 manage.py mirror-sync")
+        config = {
+            "enable_external_access": False,
+            "memory_limit": DuckDBMirrorService.memory_limit,
+            "threads": DuckDBMirrorService.threads,
+        }
+        try:
+            con = duckdb.connect(path, read_only=True, config=config)
+        except (duckdb.IOException, duckdb.ConnectionException) as e:
+            raise MirrorLocked(f"镜像正在同步，请稍后重试: {e}")
+        # 禁止查询中用SET重新打开外部访问
+        con.execute("SET lock_configuration = true")
+        return con
+
+    @staticmethod
+    async def _open_reader(path: str, wait: float):
+        """打开只读连接；同步正在写入一批时等待，最多wait秒"""
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                return DuckDBMirrorService._connect_reader(path)
+            except MirrorLocked:
+                if time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    @staticmethod
+    def validate_query(sql: str) -> None:
+        """只接受单条只读语句（只读连接会再拒绝写操作）"""
+        if SqlAnalysisService.analyze(sql)["statement_count"] != 1:
+            raise ValueError("只能提交一条查询语句")
+        first = next((text.upper() for kind, text in tokenize(sql) if text != "("), None)
+        if first not in READ_STATEMENTS:
+            raise ValueError(f"只允许查询语句（{'/'.join(sorted(READ_STATEMENTS))}）")
+
+    @staticmethod
+    async def query(
+        sql: str,
+        params: Optional[Union[Sequence[Any], Dict[str, Any]]] = None,
+        max_rows: Optional[int] = None,
+        timeout: Optional[float] = None,
+        target: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """在只读连接上执行查询，超时或请求取消时中断执行
+
+        超时抛出asyncio.TimeoutError，SQL错误（含写操作被只读连接拒绝）抛出ValueError。
+        """
+        _require_duckdb()
+        max_rows = min(max_rows or DuckDBMirrorService.max_rows, DuckDBMirrorService.max_rows)
+        timeout = timeout or DuckDBMirrorService.query_timeout
+        started = time.perf_counter()
+        con = await DuckDBMirrorService._open_reader(DuckDBMirrorService.mirror_path(target), min(timeout, 10))
+
+        def execute():
+            cursor = con.execute(sql, params) if params else con.execute(sql)
+            columns = [d[0] for d in cursor.description or []]
+            return columns, cursor.fetchmany(max_rows + 1)
+
+        future = asyncio.get_running_loop().run_in_executor(None, execute)
+        try:
+            columns, rows = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except duckdb.Error as e:
+            raise ValueError(f"查询执行失败: {e}")
+        except BaseException:
+            if not future.done():
+                con.interrupt()
+                try:
+                    await future
+                except Exception:
+                    pass
+            raise
+        finally:
+            if future.done():
+                con.close()
+        truncated = len(rows) > max_rows
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows[:max_rows]],
+            "row_count": min(len(rows), max_rows),
+            "truncated": truncated,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    @staticmethod
+    def list_reports() -> List[Dict[str, Any]]:
+        return [
+            {"name": name, "description": spec["description"], "params": list(spec["params"])}
+            for name, spec in REPORTS.items()
+        ]
+
+    @staticmethod
+    async def run_report(
+        name: str,
+        collection_name: str,
+        days: float = 30,
+        path_prefix: Optional[str] = None,
+        node_type: Optional[str] = None,
+        limit: int = 50,
+        target: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        spec = REPORTS.get(name)
+        if spec is None:
+            raise KeyError(name)
+        now = time.time()
+        values = {
+            "collection": collection_name,
+            "since": now - days * 86400,
+            "previous_since": now - 2 * days * 86400,
+            "path_prefix": path_prefix,
+            "node_type": node_type,
+            "limit": limit,
+        }
+        result = await DuckDBMirrorService.query(
+            spec["sql"], {key: values[key] for key in spec["params"]}, max_rows=limit if "limit" in spec["params"] else None,
+            target=target,
+        )
+        result["report"] = name
+        return result
+
+    @staticmethod
+    async def status(target: Optional[str] = None) -> Dict[str, Any]:
+        """各集合的同步状态和行数"""
+        result = await DuckDBMirrorService.query(
+            "SELECT s.collection, s.high_water_mark, s.records, s.updated_at, "
+            "(SELECT count(*) FROM nodes n WHERE n.collection = s.collection) AS nodes "
+            "FROM sync_state s ORDER BY s.collection",
+            target=target,
+        )
+        path = DuckDBMirrorService.mirror_path(target)
+        return {
+            "path": path,
+            "size_bytes": os.path.getsize(path),
+            "collections": [dict(zip(result["columns"], row)) for row in result["rows"]],
+        }
+
+
+class MirrorSyncScheduler:
+    """后台定期增量同步（多worker部署时抢不到文件写锁的进程跳过本轮）"""
+
+    def __init__(self):
+        self.interval = float(os.getenv("DUCKDB_SYNC_INTERVAL", "0"))
+        self.collections = [c.strip() for c in os.getenv("DUCKDB_SYNC_COLLECTIONS", "").split(",") if c.strip()]
+        self.last_results: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def sync_all(self, db, target: Optional[str] = None) -> List[Dict[str, Any]]:
+        names = self.collections or [n for n in await db.list_collection_names() if not is_internal_collection(n)]
+        results = []
+        for name in names:
+            try:
+                results.append(await DuckDBMirrorService.sync_collection(db, name, target=target))
+            except MirrorUnavailable as e:
+                logger.info("跳过本轮镜像同步: %s", e)
+                break
+            except Exception as e:
+                logger.warning("镜像同步失败: %s", e, extra={"collection": name})
+                results.append({"collection": name, "error": str(e)})
+        return results
+
+    async def _loop(self, db, target: Optional[str]) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_results = await self.sync_all(db, target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("镜像定期同步失败: %s", e)
+
+    def start(self, db, target: Optional[str] = None) -> None:
+        if self.interval > 0 and duckdb is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop(db, target))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+mirror_scheduler = MirrorSyncScheduler()
@@ -0,0 +1,137 @@
+"""记录导出服务
+
+按SearchFilters相同的条件流式导出记录，格式为NDJSON或CSV。数据由异步游标逐批读取，
+每批编码后交给StreamingResponse发送；客户端读取慢时发送会阻塞，生成器随之暂停，
+不会继续从MongoDB取数据，内存占用只与批大小有关。
+"""
+import csv
+import io
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from app.core.execution import find_options
+
+logger = logging.getLogger(__name__)
+
+# 允许导出的字段，默认全部导出；大字段（data、sql_plan）不在其中
+EXPORT_FIELDS = (
+    "_id",
+    "file_name",
+    "file_path",
+    "status",
+    "execution_time_ms",
+    "row_count",
+    "table_count",
+    "timestamp",
+    "save_time",
+    "execution_time",
+    "error",
+    "sql_content",
+    "complexity_level",
+    "complexity_score",
+    "actual_processing_complexity",
+    "sql_fingerprint",
+    "plan_hash",
+)
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+DEFAULT_BATCH_SIZE = 1000
+
+
+class ExportService:
+    """流式导出"""
+
+    @staticmethod
+    def resolve_fields(fields: Optional[str]) -> List[str]:
+        """解析逗号分隔的字段列表，未知字段抛出ValueError"""
+        if not fields:
+            return list(EXPORT_FIELDS)
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in EXPORT_FIELDS]
+        if unknown:
+            raise ValueError(f"不支持导出的字段: {', '.join(unknown)}")
+        return selected
+
+    @staticmethod
+    async def iter_batches(
+        db,
+        collection_name: str,
+        query: Dict[str, Any],
+        fields: Sequence[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        limit: int = 0,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """按timestamp降序逐批读取记录"""
+        projection = {field: 1 for field in fields}
+        if "_id" not in fields:
+            projection["_id"] = 0
+        cursor = db[collection_name].find(
+            query, projection, batch_size=batch_size, limit=limit, **find_options("export")
+        ).sort("timestamp", -1)
+        batch: List[Dict[str, Any]] = []
+        try:
+            async for record in cursor:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            # 客户端中途断开时生成器被关闭，这里释放服务端游标
+            await cursor.close()
+
+    @staticmethod
+    async def ndjson_stream(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+        try:
+            async for batch in batches:
+                lines = [json.dumps(record, ensure_ascii=False, default=str) for record in batch]
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+        finally:
+            await batches.aclose()
+
+    @staticmethod
+    async def csv_stream(batches: AsyncIterator[List[Dict[str, Any]]], fields: Sequence[str]) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # 带BOM，Excel打开时能正确识别UTF-8
+        writer.writerow(fields)
+        yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+        try:
+            async for batch in batches:
+                buffer.seek(0)
+                buffer.truncate()
+                for record in batch:
+                    writer.writerow([ExportService._csv_value(record.get(field)) for field in fields])
+                yield buffer.getvalue().encode("utf-8")
+        finally:
+            await batches.aclose()
+
+    @staticmethod
+    def _csv_value(value: Any) -> Any:
+        if value is None:
+            return ""
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        if isinstance(value, (int, float, str)):
+            return value
+        return str(value)
+
+    @staticmethod
+    def stream(
+        db,
+        collection_name: str,
+        query: Dict[str, Any],
+        fields: Sequence[str],
+        export_format: str = "ndjson",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        limit: int = 0,
+    ) -> AsyncIterator[bytes]:
+        """返回编码后的字节流"""
+        batches = ExportService.iter_batches(db, collection_name, query, fields, batch_size, limit)
+        if export_format == "csv":
+            return ExportService.csv_stream(batches, fields)
+        return ExportService.ndjson_stream(batches)
@@ -0,0 +1,152 @@
+"""单脚本执行历史服务
+
+按(file_name, timestamp)索引顺序流式读取某个脚本的全部执行记录，在服务端用
+Largest-Triangle-Three-Buckets算法降采样到指定点数。以下点无论LTTB是否选中都会保留：
+首尾点、全局最大/最小值、错误执行、超过P99的离群点、执行计划变化点。
+
+读取路径不创建索引：(file_name, timestamp)索引由 manage.py refresh-trend --collection <name>
+（TrendService.ensure_indexes）创建，缺失时集合目录的missing_indexes会列出。
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.execution import query_options
+
+# 强制保留的点最多占点数预算的比例
+MAX_PINNED_RATIO = 0.25
+
+
+class HistoryService:
+    """执行历史与降采样"""
+
+    @staticmethod
+    def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+        """Largest-Triangle-Three-Buckets降采样，返回选中点的下标
+
+        每个桶内三角形面积的计算是向量化的，外层按桶顺序迭代
+        （每个桶的选择依赖上一个桶选中的点）。
+        """
+        n = len(x)
+        if threshold >= n or threshold < 3:
+            return np.arange(n)
+
+        selected = np.empty(threshold, dtype=np.int64)
+        selected[0] = 0
+        selected[-1] = n - 1
+        # 中间n-2个点分成threshold-2个桶
+        edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+        previous = 0
+        for i in range(threshold - 2):
+            start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+            # 下一个桶的平均点（最后一个桶使用末点）
+            if i + 2 < len(edges):
+                next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+                avg_x = x[next_start:next_end].mean()
+                avg_y = y[next_start:next_end].mean()
+            else:
+                avg_x, avg_y = x[n - 1], y[n - 1]
+            px, py = x[previous], y[previous]
+            areas = np.abs((px - avg_x) * (y[start:end] - py) - (px - x[start:end]) * (avg_y - py))
+            previous = start + int(np.argmax(areas))
+            selected[i + 1] = previous
+        return selected
+
+    @staticmethod
+    def pinned_indices(values: np.ndarray, errors: np.ndarray, plans: List[Any], budget: int) -> Dict[str, np.ndarray]:
+        """必须保留的点：计划变化、错误、极值和离群点，按优先级截断到预算内"""
+        n = len(values)
+        if n == 0:
+            empty = np.array([], dtype=np.int64)
+            return {"plan_changes": empty, "outliers": empty, "all": empty}
+
+        plan_array = np.array([str(p) for p in plans], dtype=object)
+        plan_changes = np.nonzero(plan_array[1:] != plan_array[:-1])[0] + 1
+        extremes = np.array([int(np.argmax(values)), int(np.argmin(values))], dtype=np.int64)
+        p99 = np.percentile(values, 99) if n >= 100 else np.inf
+        outlier_mask = values > p99
+        error_indices = np.nonzero(errors)[0]
+        outlier_indices = np.nonzero(outlier_mask)[0]
+        # 离群点按数值降序，预算不足时优先保留最大的
+        outlier_indices = outlier_indices[np.argsort(-values[outlier_indices])]
+
+        remaining = budget
+        kept = []
+        for group in (extremes, plan_changes, error_indices, outlier_indices):
+            take = group[:max(remaining, 0)]
+            kept.append(take)
+            remaining -= len(take)
+        return {
+            "plan_changes": kept[1],
+            "outliers": np.unique(np.concatenate([kept[0], kept[2], kept[3]])),
+            "all": np.unique(np.concatenate(kept)),
+        }
+
+    @staticmethod
+    async def get_history(
+        db,
+        collection_name: str,
+        file_name: str,
+        points: int = 1000,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        batch_size: int = 5000,
+    ) -> Dict[str, Any]:
+        """获取脚本执行历史，降采样到points个点以内"""
+        match: Dict[str, Any] = {"file_name": file_name}
+        if start is not None or end is not None:
+            match["timestamp"] = {}
+            if start is not None:
+                match["timestamp"]["$gte"] = start
+            if end is not None:
+                match["timestamp"]["$lt"] = end
+        else:
+            match["timestamp"] = {"$ne": None}
+
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"timestamp": 1}},
+            {"$project": {
+                "_id": 0,
+                "t": "$timestamp",
+                "v": {"$ifNull": ["$execution_time_ms", 0]},
+                "e": {"$eq": ["$status", "error"]},
+                # 优先使用计划哈希，没有时用节点数近似判断计划变化
+                "p": {"$ifNull": ["$plan_hash", {"$size": {"$ifNull": ["$sql_plan_metrics.nodes", []]}}]},
+            }},
+        ]
+        timestamps: List[float] = []
+        values: List[float] = []
+        errors: List[bool] = []
+        plans: List[Any] = []
+        cursor = db[collection_name].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True, **query_options("stats"))
+        async for doc in cursor:
+            timestamps.append(doc["t"])
+            values.append(doc["v"])
+            errors.append(doc["e"])
+            plans.append(doc["p"])
+
+        total = len(timestamps)
+        if total == 0:
+            return {"file_name": file_name, "total": 0, "returned": 0, "points": [], "markers": {"plan_changes": [], "outliers": []}}
+
+        x = np.asarray(timestamps, dtype=np.float64)
+        y = np.asarray(values, dtype=np.float64)
+        e = np.asarray(errors, dtype=bool)
+        points = max(points, 3)
+
+        pinned = HistoryService.pinned_indices(y, e, plans, int(points * MAX_PINNED_RATIO))
+        selected = HistoryService.lttb(x, y, max(points - len(pinned["all"]), 3))
+        indices = np.union1d(selected, pinned["all"]).astype(np.int64)
+
+        return {
+            "file_name": file_name,
+            "total": total,
+            "returned": len(indices),
+            # [timestamp, execution_time_ms, 是否错误(0/1)]
+            "points": [[float(x[i]), float(y[i]), int(e[i])] for i in indices],
+            "markers": {
+                "plan_changes": [float(x[i]) for i in pinned["plan_changes"]],
+                "outliers": [float(x[i]) for i in pinned["outliers"]],
+            },
+        }
@@ -0,0 +1,270 @@
+"""基于Change Stream的实时推送
+
+每个被订阅的集合只有一个服务端watch（需要副本集，单节点副本集即可），代替多个客户端轮询：
+
+- 插入: 增量更新内存中的计数器和基础统计缓存（总数、成功/失败数、平均耗时、总行数可精确累加），
+  清理该集合其余依赖全量数据的统计缓存和ETag高水位
+- 删除: 清理该集合全部统计缓存
+- 推送: 按LIVE_PUSH_INTERVAL合并事件，向订阅者推送紧凑的增量
+  {"type": "delta", "records": [新记录摘要], "deleted": 删除数, "counters": {...}}
+
+订阅者队列满时丢弃最旧的消息，并在下一条消息中带上resync=true，提示客户端重新拉取全量数据。
+最后一个订阅者离开后watch在LIVE_IDLE_SECONDS后停止；中断后按resume token恢复。
+
+环境变量:
+    LIVE_PUSH_INTERVAL   合并推送间隔秒数，默认0.5
+    LIVE_QUEUE_SIZE      每个订阅者的队列长度，默认100
+    LIVE_IDLE_SECONDS    无订阅者后保持watch的秒数，默认30
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.core.database import db_config
+from app.core.http_cache import high_water_marks
+from app.services.analysis import AnalysisService
+
+logger = logging.getLogger(__name__)
+
+# 推送给客户端的记录摘要字段
+SUMMARY_FIELDS = ("file_name", "status", "execution_time_ms", "row_count", "table_count", "timestamp")
+# SSE心跳间隔，避免代理断开空闲连接
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    def __init__(self, max_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = False
+        # 所属watcher的键（带连接目标的集合名）
+        self.watcher_key: Optional[str] = None
+
+    def offer(self, message: Dict[str, Any]) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped = True
+        if self.dropped:
+            message = dict(message, resync=True)
+            self.dropped = False
+        self.queue.put_nowait(message)
+
+
+class CollectionWatcher:
+    """单个集合的change stream与增量聚合"""
+
+    def __init__(self, db, collection_name: str, hub: "LiveUpdateHub"):
+        self.db = db
+        self.collection_name = collection_name
+        self.hub = hub
+        self.subscribers: Set[Subscriber] = set()
+        self.counters = {"inserted": 0, "deleted": 0, "success": 0, "error": 0, "total_time_ms": 0.0, "max_time_ms": 0.0}
+        self.started_at = time.time()
+        self.resume_token = None
+        self.error: Optional[str] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_deleted = 0
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._idle_since: Optional[float] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    async def _watch(self) -> None:
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "delete"]}}},
+            {"$project": {
+                "operationType": 1,
+                **{f"fullDocument.{field}": 1 for field in SUMMARY_FIELDS},
+                "documentKey": 1,
+            }},
+        ]
+        retry_delay = 1.0
+        while True:
+            try:
+                async with self.db[self.collection_name].watch(pipeline, resume_after=self.resume_token) as stream:
+                    self.error = None
+                    retry_delay = 1.0
+                    logger.info("开始监听集合变更", extra={"collection": self.collection_name})
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        self._apply(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # 非副本集部署不支持change stream，停止重试
+                if e.code in (40573, 40324):
+                    self.error = "当前MongoDB部署不支持change stream（需要副本集）"
+                    logger.warning(self.error, extra={"collection": self.collection_name})
+                    self.hub.broadcast(self, {"type": "error", "message": self.error})
+                    return
+                # resume token失效时从当前位置重新开始
+                if e.code == 286:
+                    self.resume_token = None
+                self.error = str(e)
+            except PyMongoError as e:
+                self.error = str(e)
+            logger.warning("集合变更监听中断，%.0f秒后重试: %s", retry_delay, self.error,
+                           extra={"collection": self.collection_name})
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 30.0)
+
+    def _apply(self, change: Dict[str, Any]) -> None:
+        if change.get("operationType") == "delete":
+            self.counters["deleted"] += 1
+            self._pending_deleted += 1
+            AnalysisService.invalidate_collection(self.collection_name)
+            high_water_marks.invalidate(self.collection_name)
+            return
+
+        document = change.get("fullDocument") or {}
+        summary = {field: document.get(field) for field in SUMMARY_FIELDS}
+        summary["_id"] = str(change.get("documentKey", {}).get("_id"))
+        elapsed = float(summary.get("execution_time_ms") or 0)
+        self.counters["inserted"] += 1
+        self.counters["total_time_ms"] += elapsed
+        self.counters["max_time_ms"] = max(self.counters["max_time_ms"], elapsed)
+        if summary.get("status") in ("success", "error"):
+            self.counters[summary["status"]] += 1
+        self._pending.append(summary)
+
+        basic_key = AnalysisService._get_cache_key(self.collection_name, is_basic=True)
+        self._update_basic_stats(basic_key, summary)
+        AnalysisService.invalidate_collection(self.collection_name, keep=(basic_key,))
+        high_water_marks.invalidate(self.collection_name)
+
+    @staticmethod
+    def _update_basic_stats(cache_key: str, summary: Dict[str, Any]) -> None:
+        """基础统计的各项指标都可以按新记录精确累加"""
+        cached = AnalysisService.get_cached(cache_key)
+        if cached is None:
+            return
+        total = cached.total_plans + 1
+        elapsed = float(summary.get("execution_time_ms") or 0)
+        updated = cached.model_copy(update={
+            "total_plans": total,
+            "success_count": cached.success_count + (summary.get("status") == "success"),
+            "error_count": cached.error_count + (summary.get("status") == "error"),
+            "avg_execution_time": cached.avg_execution_time + (elapsed - cached.avg_execution_time) / total,
+            "total_rows": cached.total_rows + int(summary.get("row_count") or 0),
+        })
+        AnalysisService.set_cached(cache_key, updated)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.hub.push_interval)
+            if not self._pending and not self._pending_deleted:
+                continue
+            records, self._pending = self._pending, []
+            deleted, self._pending_deleted = self._pending_deleted, 0
+            self.hub.broadcast(self, {
+                "type": "delta",
+                "collection": self.collection_name,
+                "records": records,
+                "deleted": deleted,
+                "counters": self.snapshot_counters(),
+            })
+
+    def snapshot_counters(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        inserted = counters["inserted"]
+        counters["avg_time_ms"] = counters["total_time_ms"] / inserted if inserted else 0.0
+        counters["since"] = self.started_at
+        return counters
+
+
+class LiveUpdateHub:
+    """按集合管理watcher和订阅者（按db_config.qualify(集合名)区分连接目标）"""
+
+    def __init__(self):
+        self.push_interval = float(os.getenv("LIVE_PUSH_INTERVAL", "0.5"))
+        self.queue_size = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+        self.idle_seconds = float(os.getenv("LIVE_IDLE_SECONDS", "30"))
+        self._watchers: Dict[str, CollectionWatcher] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def subscribe(self, db, collection_name: str) -> Subscriber:
+        key = db_config.qualify(collection_name)
+        watcher = self._watchers.get(key)
+        if watcher is None:
+            watcher = CollectionWatcher(db, collection_name, self)
+            self._watchers[key] = watcher
+        watcher._idle_since = None
+        watcher.start()
+        subscriber = Subscriber(self.queue_size)
+        subscriber.watcher_key = key
+        watcher.subscribers.add(subscriber)
+        subscriber.offer({"type": "hello", "collection": collection_name, "counters": watcher.snapshot_counters(),
+                          "error": watcher.error})
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        watcher = self._watchers.get(subscriber.watcher_key)
+        if watcher is None:
+            return
+        watcher.subscribers.discard(subscriber)
+        if not watcher.subscribers:
+            watcher._idle_since = time.monotonic()
+
+    def broadcast(self, watcher: CollectionWatcher, message: Dict[str, Any]) -> None:
+        for subscriber in list(watcher.subscribers):
+            subscriber.offer(message)
+
+    async def sse_stream(self, collection_name: str, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """把订阅者队列转换为Server-Sent Events，连接关闭时取消订阅"""
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                data = json.dumps(message, ensure_ascii=False, default=str)
+                yield f"event: {message['type']}\ndata: {data}\n\n".encode("utf-8")
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def _reap_idle(self) -> None:
+        """停止长时间无订阅者的watch"""
+        while self._watchers:
+            await asyncio.sleep(max(self.idle_seconds / 2, 1.0))
+            now = time.monotonic()
+            for name, watcher in list(self._watchers.items()):
+                if watcher._idle_since is not None and now - watcher._idle_since >= self.idle_seconds:
+                    await watcher.stop()
+                    del self._watchers[name]
+                    logger.info("停止监听集合变更", extra={"collection": name})
+
+    async def shutdown(self) -> None:
+        for watcher in list(self._watchers.values()):
+            await watcher.stop()
+        self._watchers.clear()
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            name: {"subscribers": len(w.subscribers), "error": w.error, "counters": w.snapshot_counters()}
+            for name, w in self._watchers.items()
+        }
+
+
+live_updates = LiveUpdateHub()
@@ -0,0 +1,375 @@
+"""Parquet / Arrow快照导出
+
+把集合的标量指标和按节点展开的计划指标写成列式文件，供分析人员直接用
+pandas / polars / DuckDB读取，无需再解析计划JSON：
+
+    {output_dir}/{collection}/records/part-<起始时间戳>-<结束时间戳>.parquet
+    {output_dir}/{collection}/nodes/part-<起始时间戳>-<结束时间戳>.parquet
+    {output_dir}/{collection}/_state.json          已导出的timestamp高水位
+
+数据由流式游标逐批读取，每积累batch_rows行构建一个Arrow RecordBatch；Parquet中的批次
+在内存中凑满row_group_size行后写成一个row group（每次write_table至少产生一个row group），
+内存占用与集合大小无关。节点类型、关系名等低基数字符串使用字典编码。
+
+增量导出只读取timestamp大于高水位的记录，写为新的part文件，已有文件不变，
+整个目录可作为一个数据集读取。高水位按timestamp而不是写入顺序：导出之后才写入、
+timestamp却不晚于高水位的记录（补录、时钟偏差的客户端）不会被增量导出，需要 --full 重新导出。format=arrow时写Arrow IPC文件（不压缩），
+可通过pyarrow.memory_map零拷贝读取。
+
+pyarrow为可选依赖，未安装时调用会抛出RuntimeError。
+
+环境变量:
+    PARQUET_EXPORT_DIR   默认输出目录，默认exports
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.execution import find_options
+from app.services.blob_store import BlobStoreService
+from app.services.plan_parser import PlanParserService
+from app.services.plan_store import PlanStoreService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# 记录级标量字段
+RECORD_FIELDS = ("file_name", "status", "execution_time_ms", "row_count", "table_count", "timestamp", "plan_hash", "sql_fingerprint")
+# 节点级数值指标: (列名, 计划中的键, 类型)
+NODE_METRICS = (
+    ("startup_cost", "Startup Cost", "float"),
+    ("total_cost", "Total Cost", "float"),
+    ("plan_rows", "Plan Rows", "float"),
+    ("actual_startup_time", "Actual Startup Time", "float"),
+    ("actual_total_time", "Actual Total Time", "float"),
+    ("actual_rows", "Actual Rows", "float"),
+    ("actual_loops", "Actual Loops", "float"),
+    ("shared_hit_blocks", "Shared Hit Blocks", "int"),
+    ("shared_read_blocks", "Shared Read Blocks", "int"),
+    ("shared_dirtied_blocks", "Shared Dirtied Blocks", "int"),
+    ("shared_written_blocks", "Shared Written Blocks", "int"),
+    ("temp_read_blocks", "Temp Read Blocks", "int"),
+    ("temp_written_blocks", "Temp Written Blocks", "int"),
+)
+# 节点级低基数字符串，字典编码
+NODE_LABELS = (
+    ("node_type", "Node Type"),
+    ("relation_name", "Relation Name"),
+    ("index_name", "Index Name"),
+    ("join_type", "Join Type"),
+)
+FORMATS = ("parquet", "arrow")
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Parquet导出需要安装pyarrow")
+
+
+class ParquetExportService:
+    """列式快照导出"""
+
+    default_dir = os.getenv("PARQUET_EXPORT_DIR", "exports")
+
+    @staticmethod
+    def record_schema() -> "pa.Schema":
+        _require_pyarrow()
+        label = pa.dictionary(pa.int32(), pa.string())
+        return pa.schema([
+            ("record_id", pa.string()),
+            ("file_name", label),
+            ("status", label),
+            ("execution_time_ms", pa.float64()),
+            ("row_count", pa.int64()),
+            ("table_count", pa.int32()),
+            ("node_count", pa.int32()),
+            ("timestamp", pa.float64()),
+            ("planning_time", pa.float64()),
+            ("plan_execution_time", pa.float64()),
+            ("plan_hash", pa.string()),
+            ("sql_fingerprint", pa.string()),
+        ])
+
+    @staticmethod
+    def node_schema() -> "pa.Schema":
+        _require_pyarrow()
+        label = pa.dictionary(pa.int32(), pa.string())
+        fields = [
+            ("record_id", pa.string()),
+            ("timestamp", pa.float64()),
+            ("node_index", pa.int32()),
+            ("parent_index", pa.int32()),
+            ("depth", pa.int16()),
+        ]
+        fields += [(name, label) for name, _ in NODE_LABELS]
+        fields += [(name, pa.float64() if kind == "float" else pa.int64()) for name, _, kind in NODE_METRICS]
+        fields.append(("exclusive_time", pa.float64()))
+        return pa.schema(fields)
+
+    @staticmethod
+    def flatten_plan(explain: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """按前序遍历展开节点，exclusive_time为节点自身耗时（总耗时减去子节点耗时）"""
+        rows: List[Dict[str, Any]] = []
+
+        def total_time(node: Dict[str, Any]) -> Optional[float]:
+            value = node.get("Actual Total Time")
+            if value is None:
+                return None
+            return float(value) * float(node.get("Actual Loops") or 1)
+
+        def walk(node: Dict[str, Any], parent: int, depth: int) -> None:
+            index = len(rows)
+            row: Dict[str, Any] = {"node_index": index, "parent_index": parent, "depth": depth}
+            for name, key in NODE_LABELS:
+                value = node.get(key)
+                row[name] = str(value) if value is not None else None
+            for name, key, kind in NODE_METRICS:
+                value = node.get(key)
+                if isinstance(value, (int, float)):
+                    row[name] = float(value) if kind == "float" else int(value)
+                else:
+                    row[name] = None
+            rows.append(row)
+            children = []
+            if isinstance(node.get("Plan"), dict):
+                children.append(node["Plan"])
+            if isinstance(node.get("Plans"), list):
+                children.extend(child for child in node["Plans"] if isinstance(child, dict))
+            own = total_time(node)
+            if own is not None:
+                child_times = [total_time(child) or 0.0 for child in children]
+                row["exclusive_time"] = max(own - sum(child_times), 0.0)
+            else:
+                row["exclusive_time"] = None
+            for child in children:
+                walk(child, index, depth + 1)
+
+        root = explain.get("Plan") if isinstance(explain.get("Plan"), dict) else explain
+        if isinstance(root, dict):
+            walk(root, -1, 0)
+        return rows
+
+    @staticmethod
+    async def _load_plan(db, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """读取记录的计划，兼容内联、GridFS外置和去重存储三种形式"""
+        record = await BlobStoreService.hydrate(db, record, ("sql_plan",))
+        record = await PlanStoreService.hydrate(db, record)
+        raw_plan = PlanParserService.extract_query_plan_json(record)
+        if raw_plan is None:
+            return None
+        return PlanParserService.parse_json_string(raw_plan)
+
+    @staticmethod
+    def _columns(rows: List[Dict[str, Any]], schema: "pa.Schema", dictionaries: Dict[str, Dict[str, int]]) -> "pa.RecordBatch":
+        """构建RecordBatch；字典列在整个文件内共用一份只增不减的字典，
+        后续批次只追加新值（Arrow IPC文件据此写入字典增量）"""
+        arrays = []
+        for field in schema:
+            values = [row.get(field.name) for row in rows]
+            if pa.types.is_dictionary(field.type):
+                mapping = dictionaries.setdefault(field.name, {})
+                indices = [None if v is None else mapping.setdefault(v, len(mapping)) for v in values]
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(indices, type=pa.int32()), pa.array(list(mapping), type=pa.string())
+                ))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    @staticmethod
+    def _state_path(base: str) -> str:
+        return os.path.join(base, "_state.json")
+
+    @staticmethod
+    def read_state(base: str) -> Dict[str, Any]:
+        try:
+            with open(ParquetExportService._state_path(base), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _write_state(base: str, state: Dict[str, Any]) -> None:
+        tmp = ParquetExportService._state_path(base) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, ParquetExportService._state_path(base))
+
+    @staticmethod
+    def _open_writer(path: str, schema: "pa.Schema", file_format: str):
+        if file_format == "arrow":
+            return pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        dictionary_columns = [f.name for f in schema if pa.types.is_dictionary(f.type)]
+        return pq.ParquetWriter(path, schema, compression="zstd", use_dictionary=dictionary_columns)
+
+    @staticmethod
+    def _write(writer, pending: List["pa.RecordBatch"], file_format: str, row_group_size: int, final: bool) -> List["pa.RecordBatch"]:
+        """写出缓冲的批次，返回尚未写出的部分；Parquet只写出整row_group_size行（final时写出全部）"""
+        if not pending:
+            return []
+        if file_format == "arrow":
+            for batch in pending:
+                writer.write_batch(batch)
+            return []
+        table = pa.Table.from_batches(pending)
+        rows = table.num_rows if final else table.num_rows - table.num_rows % row_group_size
+        if rows:
+            writer.write_table(table.slice(0, rows), row_group_size=row_group_size)
+        return table.slice(rows).to_batches() if rows < table.num_rows else []
+
+    @staticmethod
+    async def export_collection(
+        db,
+        collection_name: str,
+        output_dir: Optional[str] = None,
+        file_format: str = "parquet",
+        full: bool = False,
+        batch_rows: int = 50000,
+        row_group_size: int = 100000,
+        cursor_batch_size: int = 500,
+    ) -> Dict[str, Any]:
+        """导出timestamp高水位之后的记录；full=True时忽略高水位重新导出全部记录"""
+        _require_pyarrow()
+        if file_format not in FORMATS:
+            raise ValueError(f"不支持的格式: {file_format}")
+        started = time.perf_counter()
+        base = os.path.join(output_dir or ParquetExportService.default_dir, collection_name)
+        os.makedirs(os.path.join(base, "records"), exist_ok=True)
+        os.makedirs(os.path.join(base, "nodes"), exist_ok=True)
+
+        if full:
+            # 全量导出替换已有的part文件
+            for kind in ("records", "nodes"):
+                for name in os.listdir(os.path.join(base, kind)):
+                    if name.startswith("part-"):
+                        os.remove(os.path.join(base, kind, name))
+        state = {} if full else ParquetExportService.read_state(base)
+        high_water = state.get("high_water_mark")
+        query: Dict[str, Any] = {"timestamp": {"$gt": high_water}} if high_water is not None else {"timestamp": {"$ne": None}}
+        projection = {"data": 0, "data_ref": 0}
+        cursor = db[collection_name].find(
+            query, projection, batch_size=cursor_batch_size, no_cursor_timeout=True, **find_options("export")
+        ).sort("timestamp", 1)
+
+        record_schema = ParquetExportService.record_schema()
+        node_schema = ParquetExportService.node_schema()
+        extension = "parquet" if file_format == "parquet" else "arrow"
+        tmp_paths = {
+            "records": os.path.join(base, "records", f".part-{os.getpid()}.{extension}.tmp"),
+            "nodes": os.path.join(base, "nodes", f".part-{os.getpid()}.{extension}.tmp"),
+        }
+        writers = {
+            "records": ParquetExportService._open_writer(tmp_paths["records"], record_schema, file_format),
+            "nodes": ParquetExportService._open_writer(tmp_paths["nodes"], node_schema, file_format),
+        }
+        dictionaries: Dict[str, Dict[str, Dict[str, int]]] = {"records": {}, "nodes": {}}
+        record_rows: List[Dict[str, Any]] = []
+        node_rows: List[Dict[str, Any]] = []
+        # 已构建、尚未写出的RecordBatch（Parquet凑满一个row group后写出）
+        pending: Dict[str, List["pa.RecordBatch"]] = {"records": [], "nodes": []}
+        counts = {"records": 0, "nodes": 0, "unparsed": 0}
+        first_ts = last_ts = None
+
+        def flush(final: bool = False) -> None:
+            nonlocal record_rows, node_rows
+            if record_rows and (final or len(record_rows) >= batch_rows):
+                pending["records"].append(
+                    ParquetExportService._columns(record_rows, record_schema, dictionaries["records"])
+                )
+                record_rows = []
+            if node_rows and (final or len(node_rows) >= batch_rows):
+                pending["nodes"].append(ParquetExportService._columns(node_rows, node_schema, dictionaries["nodes"]))
+                node_rows = []
+            for kind in ("records", "nodes"):
+                if file_format == "arrow" or final or sum(b.num_rows for b in pending[kind]) >= row_group_size:
+                    pending[kind] = ParquetExportService._write(
+                        writers[kind], pending[kind], file_format, row_group_size, final
+                    )
+
+        try:
+            async for record in cursor:
+                record_id = str(record["_id"])
+                timestamp = record.get("timestamp")
+                first_ts = timestamp if first_ts is None else first_ts
+                last_ts = timestamp
+                explain = await ParquetExportService._load_plan(db, record)
+                nodes = ParquetExportService.flatten_plan(explain) if explain else []
+                if explain is None:
+                    counts["unparsed"] += 1
+                row = {"record_id": record_id, "node_count": len(nodes) if explain else None}
+                row.update({field: record.get(field) for field in RECORD_FIELDS})
+                row["planning_time"] = explain.get("Planning Time") if explain else None
+                row["plan_execution_time"] = explain.get("Execution Time") if explain else None
+                record_rows.append(row)
+                for node in nodes:
+                    node["record_id"] = record_id
+                    node["timestamp"] = timestamp
+                    node_rows.append(node)
+                counts["records"] += 1
+                counts["nodes"] += len(nodes)
+                flush()
+            flush(final=True)
+        except BaseException:
+            for writer in writers.values():
+                writer.close()
+            for path in tmp_paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        finally:
+            await cursor.close()
+
+        for writer in writers.values():
+            writer.close()
+        files = []
+        if counts["records"]:
+            name = f"part-{first_ts:.3f}-{last_ts:.3f}.{extension}"
+            for kind, tmp in tmp_paths.items():
+                target = os.path.join(base, kind, name)
+                os.replace(tmp, target)
+                files.append(target)
+            state = {"high_water_mark": last_ts, "format": file_format, "updated_at": time.time()}
+            ParquetExportService._write_state(base, state)
+        else:
+            for tmp in tmp_paths.values():
+                os.remove(tmp)
+
+        result = {
+            "collection": collection_name,
+            "format": file_format,
+            "incremental": high_water is not None,
+            "previous_high_water_mark": high_water,
+            "high_water_mark": last_ts if counts["records"] else high_water,
+            "records": counts["records"],
+            "nodes": counts["nodes"],
+            "unparsed_plans": counts["unparsed"],
+            "files": files,
+            "elapsed_seconds": round(time.perf_counter() - started, 1),
+        }
+        logger.info("列式快照导出完成", extra={k: v for k, v in result.items() if k != "files"})
+        return result
+
+    @staticmethod
+    def open_dataset(path: str, memory_map: bool = True) -> "pa.Table":
+        """读取导出的records或nodes目录；Arrow IPC文件通过内存映射零拷贝读取"""
+        _require_pyarrow()
+        files = sorted(f for f in os.listdir(path) if f.startswith("part-"))
+        tables = []
+        for name in files:
+            full_path = os.path.join(path, name)
+            if name.endswith(".arrow"):
+                source = pa.memory_map(full_path) if memory_map else pa.OSFile(full_path)
+                tables.append(pa.ipc.open_file(source).read_all())
+            else:
+                tables.append(pq.read_table(full_path, memory_map=memory_map))
+        if not tables:
+            raise FileNotFoundError(f"{path} 下没有导出文件")
+        return pa.concat_tables(tables)
@@ -72,7 +72,8 @@ class PlanParserService:
         if "Plans" in node_data:
             children_plans.extend(node_data["Plans"])
         
-        plan_node = PlanNode(
+        # 节点来自已解析的计划JSON，不逐字段校验
+        plan_node = PlanNode.model_construct(
             node_type=node_type,
             actual_total_time=actual_total_time,
             actual_rows=actual_rows,
@@ -138,4 +139,20 @@ class PlanParserService:
                 return f"node_{id(node.raw_data)}"
         
         # 如果所有节点都有父节点，选择第一个作为根节点
-        return f"node_{id(nodes[0].raw_data)}" if nodes else None
\ No newline at end of file
+        return f"node_{id(nodes[0].raw_data)}" if nodes else None
+
+    @staticmethod
+    def build_plan_detail(plan_id: str, record: Dict[str, Any], parsed_plan: Dict[str, Any]) -> PlanDetail:
+        """由记录和已解析的计划构造PlanDetail（数据来自自己的数据库，用model_construct跳过校验）"""
+        nodes = PlanParserService.parse_execution_plan(parsed_plan)
+        return PlanDetail.model_construct(
+            plan_id=plan_id,
+            sql_content=record["sql_content"],
+            execution_time_ms=record["execution_time_ms"],
+            status=record["status"],
+            row_count=record["row_count"],
+            nodes=nodes,
+            root_node=PlanParserService.find_root_node(nodes),
+            # 将计划转换为JSON字符串以便存储到PlanContent
+            plan_content=json.dumps(parsed_plan, ensure_ascii=False),
+        )
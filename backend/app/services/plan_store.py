@@ -0,0 +1,286 @@
+"""按内容寻址的执行计划去重存储
+
+同一脚本的多次执行，计划结构（节点类型、关系、条件、索引等）通常完全相同，
+只有实际耗时、行数、缓冲区和代价估计不同。这里把计划拆成两部分：
+
+- 结构：去掉逐次执行的数值后，按规范化JSON的哈希作为_id存入plan_shapes集合，只存一份
+- 实际值：按前序遍历的节点顺序保存为列式数组，写在记录上
+
+    plan_hash:    结构哈希
+    plan_actuals: {"k": [键名...], "v": [[节点0, 节点1, ...] 每个键一列]}
+    plan_top:     顶层的Planning Time / Execution Time / Triggers等
+
+读取时按哈希取结构（进程内LRU缓存，同一计划的多次执行共享一份已解析的结构），
+与实际值合并还原出完整计划，以字典形式放回sql_plan[0]，详情页无需再次解析JSON。
+
+转换前校验拆分后能否原样还原，不能还原的记录保持原样；plan_shapes.executions为引用计数，
+保留策略删除记录时递减，降到0的结构随之删除。
+
+环境变量:
+    PLAN_SHAPE_CACHE_SIZE   结构缓存条数，默认1024
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.services.blob_store import BlobStoreService
+from app.services.plan_parser import PlanParserService
+
+logger = logging.getLogger(__name__)
+
+# 每次执行都可能不同的节点字段
+ACTUAL_NODE_KEYS = (
+    "Startup Cost", "Total Cost", "Plan Rows", "Plan Width",
+    "Actual Startup Time", "Actual Total Time", "Actual Rows", "Actual Loops",
+    "Rows Removed by Filter", "Rows Removed by Join Filter", "Rows Removed by Index Recheck",
+    "Heap Fetches", "Exact Heap Blocks", "Lossy Heap Blocks",
+    "Shared Hit Blocks", "Shared Read Blocks", "Shared Dirtied Blocks", "Shared Written Blocks",
+    "Local Hit Blocks", "Local Read Blocks", "Local Dirtied Blocks", "Local Written Blocks",
+    "Temp Read Blocks", "Temp Written Blocks", "I/O Read Time", "I/O Write Time",
+    "Sort Method", "Sort Space Used", "Sort Space Type", "Peak Memory Usage",
+    "Hash Buckets", "Original Hash Buckets", "Hash Batches", "Original Hash Batches",
+    "HashAgg Batches", "Disk Usage", "Planned Partitions", "Workers Launched", "Workers",
+)
+_ACTUAL_KEY_SET = frozenset(ACTUAL_NODE_KEYS)
+
+
+class PlanStoreService:
+    """计划结构去重存储"""
+
+    shapes_collection = "plan_shapes"
+    _cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    _cache_size = int(os.getenv("PLAN_SHAPE_CACHE_SIZE", "1024"))
+
+    @staticmethod
+    def split_plan(explain: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        """拆分为 (结构, 列式实际值, 顶层数据)"""
+        columns: Dict[str, List[Any]] = {}
+        node_count = 0
+
+        def strip(node: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal node_count
+            index = node_count
+            node_count += 1
+            # 先取本节点的实际值再递归子节点：键按字母序排列时Plans排在Total Cost等键之前，
+            # 边遍历边递归会让子节点先占用列中的位置
+            for key, value in node.items():
+                if key in _ACTUAL_KEY_SET:
+                    column = columns.setdefault(key, [])
+                    # 补齐前面没有该键的节点
+                    column.extend([None] * (index - len(column)))
+                    column.append(value)
+            shape = {}
+            for key, value in node.items():
+                if key in _ACTUAL_KEY_SET:
+                    continue
+                elif key == "Plan" and isinstance(value, dict):
+                    shape[key] = strip(value)
+                elif key == "Plans" and isinstance(value, list):
+                    shape[key] = [strip(child) if isinstance(child, dict) else child for child in value]
+                else:
+                    shape[key] = value
+            return shape
+
+        top = {}
+        if "Plan" in explain:
+            structure = {"Plan": strip(explain["Plan"])}
+            top = {k: v for k, v in explain.items() if k != "Plan"}
+        else:
+            structure = strip(explain)
+        for column in columns.values():
+            column.extend([None] * (node_count - len(column)))
+        actuals = {"k": list(columns.keys()), "v": list(columns.values())}
+        return structure, actuals, top
+
+    @staticmethod
+    def merge_plan(structure: Dict[str, Any], actuals: Dict[str, Any], top: Dict[str, Any]) -> Dict[str, Any]:
+        """结构与实际值合并，还原完整计划"""
+        keys = actuals.get("k", [])
+        values = actuals.get("v", [])
+        counter = 0
+
+        def fill(shape: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal counter
+            index = counter
+            counter += 1
+            node = {}
+            for key, value in shape.items():
+                if key == "Plan" and isinstance(value, dict):
+                    continue
+                if key == "Plans" and isinstance(value, list):
+                    continue
+                node[key] = value
+            for key, column in zip(keys, values):
+                if index < len(column) and column[index] is not None:
+                    node[key] = column[index]
+            if isinstance(shape.get("Plan"), dict):
+                node["Plan"] = fill(shape["Plan"])
+            if isinstance(shape.get("Plans"), list):
+                node["Plans"] = [fill(child) if isinstance(child, dict) else child for child in shape["Plans"]]
+            return node
+
+        if "Plan" in structure and len(structure) == 1:
+            result = {"Plan": fill(structure["Plan"])}
+            result.update(top)
+            return result
+        return fill(structure)
+
+    @staticmethod
+    def shape_hash(structure: Dict[str, Any]) -> str:
+        canonical = json.dumps(structure, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _cache_put(plan_hash: str, structure: Dict[str, Any]) -> None:
+        cache = PlanStoreService._cache
+        cache[plan_hash] = structure
+        cache.move_to_end(plan_hash)
+        while len(cache) > PlanStoreService._cache_size:
+            cache.popitem(last=False)
+
+    @staticmethod
+    async def get_shape(db, plan_hash: str) -> Optional[Dict[str, Any]]:
+        """按哈希读取计划结构，进程内缓存"""
+        cache = PlanStoreService._cache
+        if plan_hash in cache:
+            cache.move_to_end(plan_hash)
+            return cache[plan_hash]
+        doc = await db[PlanStoreService.shapes_collection].find_one({"_id": plan_hash}, {"plan": 1})
+        if not doc:
+            return None
+        PlanStoreService._cache_put(plan_hash, doc["plan"])
+        return doc["plan"]
+
+    @staticmethod
+    async def hydrate(db, record: Dict[str, Any]) -> Dict[str, Any]:
+        """为去重存储的记录还原sql_plan"""
+        if "sql_plan" in record or not record.get("plan_hash"):
+            return record
+        structure = await PlanStoreService.get_shape(db, record["plan_hash"])
+        if structure is None:
+            logger.warning("计划结构不存在", extra={"plan_hash": record["plan_hash"]})
+            return record
+        # 缓存中的结构是共享的，合并时只读不改
+        explain = PlanStoreService.merge_plan(structure, record.get("plan_actuals", {}), record.get("plan_top", {}))
+        record["sql_plan"] = [explain]
+        return record
+
+    @staticmethod
+    async def dedupe_record(db, collection_name: str, record: Dict[str, Any], dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """把记录的sql_plan转为结构引用+实际值，返回大小信息；无法解析时返回None"""
+        raw_plan = PlanParserService.extract_query_plan_json(record)
+        if raw_plan is None:
+            return None
+        explain = PlanParserService.parse_json_string(raw_plan)
+        if not explain:
+            return None
+        structure, actuals, top = PlanStoreService.split_plan(explain)
+        # 转换会删除原计划，无法原样还原的（例如实际值字段为null）保持不变
+        if PlanStoreService.merge_plan(structure, actuals, top) != explain:
+            logger.warning("计划拆分后无法还原，跳过", extra={"collection": collection_name, "record_id": str(record["_id"])})
+            return {"mismatch": True}
+        plan_hash = PlanStoreService.shape_hash(structure)
+        before = BlobStoreService.field_size(record["sql_plan"])
+        after = BlobStoreService.field_size({"a": actuals, "t": top})
+        result = {"plan_hash": plan_hash, "before": before, "after": after, "shape": BlobStoreService.field_size(structure)}
+        if dry_run:
+            return result
+
+        upsert = await db[PlanStoreService.shapes_collection].update_one(
+            {"_id": plan_hash},
+            {
+                "$setOnInsert": {"plan": structure, "node_count": len(actuals["v"][0]) if actuals["v"] else 0, "created_at": time.time()},
+                "$inc": {"executions": 1},
+            },
+            upsert=True,
+        )
+        result["new_shape"] = upsert.upserted_id is not None
+        await db[collection_name].update_one(
+            {"_id": record["_id"]},
+            {
+                "$set": {
+                    "plan_hash": plan_hash,
+                    "plan_actuals": actuals,
+                    "plan_top": top,
+                    "sql_plan_preview": BlobStoreService.plan_preview(record["sql_plan"]),
+                },
+                "$unset": {"sql_plan": "", "sql_plan_ref": ""},
+            },
+        )
+        # 已外置到GridFS的计划不再需要
+        ref = record.get("sql_plan_ref")
+        if ref:
+            await BlobStoreService._bucket(db).delete(ref["id"])
+        return result
+
+    @staticmethod
+    async def release(db, plan_hashes: List[str]) -> int:
+        """记录被删除后递减结构的引用计数，删除不再被引用的结构，返回删除的结构数"""
+        counts = Counter(h for h in plan_hashes if h)
+        if not counts:
+            return 0
+        shapes = db[PlanStoreService.shapes_collection]
+        await shapes.bulk_write(
+            [UpdateOne({"_id": plan_hash}, {"$inc": {"executions": -count}}) for plan_hash, count in counts.items()],
+            ordered=False,
+        )
+        result = await shapes.delete_many({"_id": {"$in": list(counts)}, "executions": {"$lte": 0}})
+        for plan_hash in counts:
+            PlanStoreService._cache.pop(plan_hash, None)
+        return result.deleted_count
+
+    @staticmethod
+    async def migrate_collection(db, collection_name: str, batch_size: int = 200, dry_run: bool = False) -> Dict[str, Any]:
+        """对已有集合进行计划去重"""
+        started = time.perf_counter()
+        await db[collection_name].create_index([("plan_hash", 1)], sparse=True)
+        cursor = db[collection_name].find(
+            {"plan_hash": {"$exists": False}, "$or": [{"sql_plan": {"$exists": True}}, {"sql_plan_ref": {"$exists": True}}]},
+            {"sql_plan": 1, "sql_plan_ref": 1},
+            batch_size=batch_size,
+            no_cursor_timeout=True,
+        )
+        scanned = converted = new_shapes = mismatched = 0
+        before = after = shape_bytes = 0
+        seen = set()
+        try:
+            async for record in cursor:
+                scanned += 1
+                record = await BlobStoreService.hydrate(db, record, ("sql_plan",))
+                result = await PlanStoreService.dedupe_record(db, collection_name, record, dry_run)
+                if not result:
+                    continue
+                if result.get("mismatch"):
+                    mismatched += 1
+                    continue
+                converted += 1
+                before += result["before"]
+                after += result["after"]
+                if result["plan_hash"] not in seen:
+                    seen.add(result["plan_hash"])
+                    shape_bytes += result["shape"]
+                if result.get("new_shape"):
+                    new_shapes += 1
+                if scanned % 1000 == 0:
+                    logger.info("计划去重进度", extra={"collection": collection_name, "scanned": scanned, "converted": converted})
+        finally:
+            await cursor.close()
+        return {
+            "collection": collection_name,
+            "dry_run": dry_run,
+            "scanned": scanned,
+            "converted": converted,
+            "mismatched": mismatched,
+            "distinct_shapes": len(seen),
+            "new_shapes": new_shapes,
+            "plan_bytes_before": before,
+            "plan_bytes_after": after + shape_bytes,
+            "saved_bytes": before - after - shape_bytes,
+            "elapsed_seconds": round(time.perf_counter() - started, 1),
+        }
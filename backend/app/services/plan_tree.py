@@ -0,0 +1,161 @@
+"""大计划的按需展开
+
+节点数上千的计划（深层Append/Subquery）一次性返回全部节点既慢又用不上，界面只展示前几层。
+这里把计划解析一次为扁平的前序数组（节点属性、父节点、子节点、深度、子树大小和子树耗时），
+按(集合, 记录ID)缓存在进程内：
+
+- 首次请求返回计划概要和前depth层节点，被折叠的节点带子节点数和子树耗时
+- 展开时按节点ID（前序序号，与去重存储的实际值数组顺序一致）从缓存的数组中截取子树，无需重新解析
+
+环境变量:
+    PLAN_TREE_CACHE_SIZE   缓存的已解析计划数，默认64
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.database import db_config
+from app.schemas import LazyPlanNode, LazyPlanTree
+
+
+def node_id(index: int) -> str:
+    return f"n{index}"
+
+
+def parse_node_id(value: str) -> int:
+    if not value.startswith("n") or not value[1:].isdigit():
+        raise ValueError(f"无效的节点ID: {value}")
+    return int(value[1:])
+
+
+class IndexedPlan:
+    """前序扁平化的计划"""
+
+    def __init__(self, explain: Dict[str, Any], record_summary: Optional[Dict[str, Any]] = None):
+        self.attributes: List[Dict[str, Any]] = []
+        self.parents: List[int] = []
+        self.children: List[List[int]] = []
+        self.depths: List[int] = []
+        # 记录字段与计划顶层信息（Planning Time、Execution Time等）
+        self.summary = dict(record_summary or {})
+        if isinstance(explain.get("Plan"), dict):
+            self.summary.update({k: v for k, v in explain.items() if k != "Plan"})
+        root = explain["Plan"] if isinstance(explain.get("Plan"), dict) else explain
+
+        # 深层计划可能超过递归深度限制，使用显式栈
+        stack: List[Tuple[Dict[str, Any], int, int]] = [(root, -1, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            index = len(self.attributes)
+            self.attributes.append({k: v for k, v in node.items() if k not in ("Plan", "Plans")})
+            self.parents.append(parent)
+            self.children.append([])
+            self.depths.append(depth)
+            if parent >= 0:
+                self.children[parent].append(index)
+            nested = []
+            if isinstance(node.get("Plan"), dict):
+                nested.append(node["Plan"])
+            if isinstance(node.get("Plans"), list):
+                nested.extend(child for child in node["Plans"] if isinstance(child, dict))
+            for child in reversed(nested):
+                stack.append((child, index, depth + 1))
+
+        count = len(self.attributes)
+        self.subtree_sizes = [1] * count
+        self.subtree_times: List[Optional[float]] = [None] * count
+        self.self_times: List[Optional[float]] = [None] * count
+        # 前序的逆序保证子节点先于父节点处理
+        for index in range(count - 1, -1, -1):
+            attrs = self.attributes[index]
+            children = self.children[index]
+            self.subtree_sizes[index] += sum(self.subtree_sizes[c] for c in children)
+            child_time = sum(self.subtree_times[c] or 0.0 for c in children)
+            total = attrs.get("Actual Total Time")
+            if isinstance(total, (int, float)):
+                inclusive = float(total) * float(attrs.get("Actual Loops") or 1)
+                self.subtree_times[index] = inclusive
+                self.self_times[index] = max(inclusive - child_time, 0.0)
+            elif children:
+                self.subtree_times[index] = child_time
+        self.max_depth = max(self.depths) if self.depths else 0
+
+    def __len__(self) -> int:
+        return len(self.attributes)
+
+    def node(self, index: int, collapsed: bool) -> LazyPlanNode:
+        attrs = self.attributes[index]
+        parent = self.parents[index]
+        return LazyPlanNode(
+            id=node_id(index),
+            parent=node_id(parent) if parent >= 0 else None,
+            depth=self.depths[index],
+            node_type=attrs.get("Node Type", "Unknown"),
+            actual_total_time=attrs.get("Actual Total Time"),
+            actual_rows=attrs.get("Actual Rows"),
+            loops=attrs.get("Actual Loops"),
+            child_count=len(self.children[index]),
+            subtree_size=self.subtree_sizes[index],
+            subtree_time=self.subtree_times[index],
+            self_time=self.self_times[index],
+            collapsed=collapsed,
+            attributes=attrs,
+        )
+
+    def subtree(self, root: int, depth: int) -> List[LazyPlanNode]:
+        """root下depth层以内的节点（前序），root自身为第0层"""
+        if root < 0 or root >= len(self):
+            raise KeyError(node_id(root))
+        limit = self.depths[root] + depth
+        # 子树在前序数组中是连续区间
+        end = root + self.subtree_sizes[root]
+        nodes = []
+        index = root
+        while index < end:
+            collapsed = self.depths[index] == limit and bool(self.children[index])
+            nodes.append(self.node(index, collapsed))
+            # 折叠节点的后代整体跳过
+            index += self.subtree_sizes[index] if collapsed else 1
+        return nodes
+
+
+class PlanTreeService:
+    """计划按需展开"""
+
+    _cache: "OrderedDict[Tuple[str, str], IndexedPlan]" = OrderedDict()
+    _cache_size = int(os.getenv("PLAN_TREE_CACHE_SIZE", "64"))
+
+    @staticmethod
+    def get_cached(collection_name: str, plan_id: str) -> Optional[IndexedPlan]:
+        key = (db_config.qualify(collection_name), plan_id)
+        plan = PlanTreeService._cache.get(key)
+        if plan is not None:
+            PlanTreeService._cache.move_to_end(key)
+        return plan
+
+    @staticmethod
+    def put(collection_name: str, plan_id: str, explain: Dict[str, Any], record_summary: Optional[Dict[str, Any]] = None) -> IndexedPlan:
+        plan = IndexedPlan(explain, record_summary)
+        key = (db_config.qualify(collection_name), plan_id)
+        PlanTreeService._cache[key] = plan
+        PlanTreeService._cache.move_to_end(key)
+        while len(PlanTreeService._cache) > PlanTreeService._cache_size:
+            PlanTreeService._cache.popitem(last=False)
+        return plan
+
+    @staticmethod
+    def clear_cache() -> None:
+        PlanTreeService._cache.clear()
+
+    @staticmethod
+    def build_tree(plan_id: str, plan: IndexedPlan, root: str = "n0", depth: int = 3) -> LazyPlanTree:
+        """root为展开的节点ID，首次请求为根节点n0"""
+        index = parse_node_id(root)
+        return LazyPlanTree(
+            plan_id=plan_id,
+            root_node=node_id(index),
+            total_nodes=len(plan),
+            max_depth=plan.max_depth,
+            nodes=plan.subtree(index, max(depth, 0)),
+            summary=plan.summary if index == 0 else {},
+        )
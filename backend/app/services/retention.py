@@ -0,0 +1,604 @@
+"""历史数据保留、降采样与归档
+
+集合不断增长，每条全量统计路径都随之变慢，旧记录的data/sql_plan也一直占用工作集。
+按集合配置保留策略（保存在 _retention_policies）：原始记录保留raw_days天，更早的记录：
+
+1. 先刷新小时级趋势rollup（见trend.py），截止时间不超过rollup高水位，趋势不受影响
+2. 按天汇总到 <集合>__daily：每个(脚本, 指纹, 天)的次数、错误数、耗时总和/最小/最大和
+   对数直方图（与趋势rollup相同，可估计分位数）
+3. 每个(脚本, 指纹, 天)保留一条代表执行（耗时中位数那条），标记retention_representative，
+   详情页、历史曲线仍可查看
+4. 其余记录读出外置字段和去重计划后压缩归档（archive=collection写入 <集合>__archive，
+   archive=parquet写入RETENTION_ARCHIVE_DIR下的Parquet文件，archive=none直接删除），
+   按批删除原始记录和GridFS中的外置字段，批之间暂停以限制对线上查询的影响
+
+按天处理，汇总进度（summarized_until）记录在 _retention_state，中断后重新执行不会重复汇总。
+每条被汇总的记录标记retention_summarized，只有带该标记的记录才会被归档删除；汇总进度之前
+迟到或回填的记录在下次执行时补充汇总，合并到已有的按天汇总后再删除。
+注意: 执行后不能再用 full=True 从原始记录重建趋势rollup。
+
+多个进程（多worker的定期执行、manage.py）同时执行同一集合时，只有取得租约的进程执行：
+租约保存在该集合的 _retention_state 文档中（lease_owner/lease_expires），执行中每天、每批续期，
+进程异常退出后租约到期即可被其他进程取得。
+
+dry_run只统计：待处理记录数、可释放的文档/GridFS字节数、保留的代表执行数、
+全量扫描减少的比例和预计执行时间。
+
+环境变量:
+    RETENTION_BATCH_SIZE          每批归档/删除的记录数，默认500
+    RETENTION_BATCH_PAUSE         批之间暂停秒数，默认0.2
+    RETENTION_MAX_DELETES         单次执行最多删除的记录数，默认0即不限制
+    RETENTION_ARCHIVE_DIR         Parquet归档目录，默认archive
+    RETENTION_INTERVAL_SECONDS    后台定期执行间隔，默认0即不在服务内执行
+    RETENTION_LEASE_SECONDS       执行租约的有效期（秒），默认600，执行中定期续期
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import bson
+from gridfs.errors import NoFile
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from app.core.http_cache import high_water_marks
+from app.services.analysis import AnalysisService
+from app.services.blob_store import BLOB_FIELDS, BlobStoreService
+from app.services.plan_store import PlanStoreService
+from app.services.similarity import SimilarityService
+from app.services.trend import TrendService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖，只有archive=parquet需要
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+ARCHIVE_MODES = ("collection", "parquet", "none")
+REPRESENTATIVE_FIELD = "retention_representative"
+SUMMARIZED_FIELD = "retention_summarized"
+# 正在汇总的批次，汇总完成后移除
+BATCH_FIELD = "retention_batch"
+# 预计执行时间中每条记录的读取、归档和删除耗时（秒），用于dry_run估算
+ESTIMATED_SECONDS_PER_RECORD = 0.0005
+
+
+class RetentionService:
+    """按策略汇总、归档并删除旧记录"""
+
+    batch_size = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+    batch_pause = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))
+    max_deletes = int(os.getenv("RETENTION_MAX_DELETES", "0"))
+    archive_dir = os.getenv("RETENTION_ARCHIVE_DIR", "archive")
+    lease_seconds = float(os.getenv("RETENTION_LEASE_SECONDS", "600"))
+
+    @staticmethod
+    def _policies(db):
+        return db["_retention_policies"]
+
+    @staticmethod
+    def _state(db):
+        return db["_retention_state"]
+
+    @staticmethod
+    def daily_name(collection_name: str) -> str:
+        return f"{collection_name}__daily"
+
+    @staticmethod
+    def archive_name(collection_name: str) -> str:
+        return f"{collection_name}__archive"
+
+    @staticmethod
+    async def get_policies(db) -> List[Dict[str, Any]]:
+        policies = await RetentionService._policies(db).find({}).to_list(None)
+        for policy in policies:
+            policy["collection"] = policy.pop("_id")
+        return policies
+
+    @staticmethod
+    async def get_policy(db, collection_name: str) -> Optional[Dict[str, Any]]:
+        policy = await RetentionService._policies(db).find_one({"_id": collection_name})
+        if policy:
+            policy["collection"] = policy.pop("_id")
+        return policy
+
+    @staticmethod
+    async def set_policy(db, collection_name: str, raw_days: int, archive: str = "collection", enabled: bool = True) -> Dict[str, Any]:
+        if raw_days < 1:
+            raise ValueError("raw_days至少为1")
+        if archive not in ARCHIVE_MODES:
+            raise ValueError(f"不支持的归档方式: {archive}")
+        if archive == "parquet" and pa is None:
+            raise ValueError("archive=parquet需要安装pyarrow")
+        policy = {"raw_days": raw_days, "archive": archive, "enabled": enabled, "updated_at": time.time()}
+        await RetentionService._policies(db).update_one({"_id": collection_name}, {"$set": policy}, upsert=True)
+        return dict(policy, collection=collection_name)
+
+    @staticmethod
+    async def delete_policy(db, collection_name: str) -> bool:
+        result = await RetentionService._policies(db).delete_one({"_id": collection_name})
+        return result.deleted_count > 0
+
+    @staticmethod
+    def _pending_query(before: float) -> Dict[str, Any]:
+        """待归档的记录：早于截止时间且不是代表执行"""
+        return {"timestamp": {"$lt": before}, REPRESENTATIVE_FIELD: {"$ne": True}}
+
+    @staticmethod
+    def _purgeable_query(before: float) -> Dict[str, Any]:
+        """可以删除的记录：待归档且已计入按天汇总"""
+        return dict(RetentionService._pending_query(before), **{SUMMARIZED_FIELD: True})
+
+    # ---- 租约 ----
+
+    @staticmethod
+    def _lease_owner() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    async def _acquire_lease(db, collection_name: str, owner: str) -> bool:
+        """取得集合的执行租约；其他进程持有未到期的租约时返回False"""
+        now = time.time()
+        try:
+            await RetentionService._state(db).find_one_and_update(
+                {"_id": collection_name, "$or": [{"lease_expires": {"$exists": False}}, {"lease_expires": {"$lt": now}}]},
+                {"$set": {"lease_owner": owner, "lease_expires": now + RetentionService.lease_seconds}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # 文档存在但租约被其他进程持有，upsert插入同一_id失败
+            return False
+        return True
+
+    @staticmethod
+    async def _renew_lease(db, collection_name: str, owner: str) -> None:
+        """续期租约；租约已过期并被其他进程取得时中止执行"""
+        result = await RetentionService._state(db).update_one(
+            {"_id": collection_name, "lease_owner": owner},
+            {"$set": {"lease_expires": time.time() + RetentionService.lease_seconds}},
+        )
+        if result.matched_count == 0:
+            raise RuntimeError("保留策略租约已被其他进程取得，中止执行")
+
+    @staticmethod
+    async def _release_lease(db, collection_name: str, owner: str) -> None:
+        await RetentionService._state(db).update_one(
+            {"_id": collection_name, "lease_owner": owner}, {"$unset": {"lease_owner": "", "lease_expires": ""}}
+        )
+
+    @staticmethod
+    async def _cutoff(db, collection_name: str, raw_days: int, dry_run: bool) -> float:
+        """截止时间按天对齐，且不超过趋势rollup的高水位"""
+        cutoff = time.time() - raw_days * DAY_SECONDS
+        cutoff -= cutoff % DAY_SECONDS
+        if dry_run:
+            state = await TrendService._state_collection(db).find_one({"_id": collection_name})
+            high_water_mark = (state or {}).get("high_water_mark")
+            if high_water_mark is None:
+                # 尚未生成rollup，执行时会先生成，按当前完整小时估算
+                now = time.time()
+                high_water_mark = now - now % 3600
+        else:
+            high_water_mark = (await TrendService.refresh_rollups(db, collection_name))["high_water_mark"]
+        if high_water_mark is None:
+            return cutoff
+        return min(cutoff, high_water_mark - high_water_mark % DAY_SECONDS)
+
+    @staticmethod
+    def _daily_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """单日的(脚本, 指纹)汇总；不收集记录ID，输出大小与组内执行次数无关"""
+        group_key = {"f": "$f", "fp": "$fp"}
+        return [
+            {"$match": match},
+            {"$project": {
+                "f": {"$ifNull": ["$file_name", None]},
+                "fp": {"$ifNull": ["$sql_fingerprint", None]},
+                "t": {"$ifNull": ["$execution_time_ms", 0]},
+                "err": {"$cond": [{"$eq": ["$status", "error"]}, 1, 0]},
+                "h": TrendService._hist_index_expr(),
+            }},
+            {"$group": {
+                "_id": dict(group_key, h="$h"),
+                "n": {"$sum": 1},
+                "sum": {"$sum": "$t"},
+                "err": {"$sum": "$err"},
+                "min": {"$min": "$t"},
+                "max": {"$max": "$t"},
+            }},
+            {"$sort": {"_id.h": 1}},
+            {"$group": {
+                "_id": {"f": "$_id.f", "fp": "$_id.fp"},
+                "n": {"$sum": "$n"},
+                "sum": {"$sum": "$sum"},
+                "err": {"$sum": "$err"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"},
+                "hist": {"$push": ["$_id.h", "$n"]},
+            }},
+        ]
+
+    @staticmethod
+    def _median_pipeline(match: Dict[str, Any], file_name: Optional[str], fingerprint: Optional[str], n: int) -> List[Dict[str, Any]]:
+        """组内耗时中位数那条记录（$sort + $skip/$limit，只保留前n/2+1条的排序键）"""
+        return [
+            {"$match": dict(match, file_name=file_name, sql_fingerprint=fingerprint)},
+            {"$project": {"t": {"$ifNull": ["$execution_time_ms", 0]}}},
+            {"$sort": {"t": 1, "_id": 1}},
+            {"$skip": n // 2},
+            {"$limit": 1},
+        ]
+
+    @staticmethod
+    def _merge_summary(existing: Dict[str, Any], summary: Dict[str, Any]) -> Dict[str, Any]:
+        """迟到记录的汇总合并到已有的按天汇总，保留原来的代表执行"""
+        hist: Dict[int, int] = {}
+        for index, count in list(existing.get("hist") or []) + list(summary["hist"]):
+            hist[index] = hist.get(index, 0) + count
+        return dict(
+            existing,
+            n=existing["n"] + summary["n"],
+            sum=existing["sum"] + summary["sum"],
+            err=existing["err"] + summary["err"],
+            min=min(existing["min"], summary["min"]),
+            max=max(existing["max"], summary["max"]),
+            hist=[[index, hist[index]] for index in sorted(hist)],
+        )
+
+    @staticmethod
+    async def _summarize_day(db, collection_name: str, day: float) -> int:
+        """汇总一天中尚未汇总的记录并标记；已有汇总的组合并计数，没有的组标记新的代表执行
+
+        先给当天待汇总的记录打上本次的批次标记，汇总和最后的范围标记都只针对带该批次的记录，
+        汇总过程中写入的迟到记录留给下次执行；中途退出时下次执行重新打标记。
+        """
+        collection = db[collection_name]
+        daily = db[RetentionService.daily_name(collection_name)]
+        batch = uuid.uuid4().hex
+        await collection.update_many(
+            {
+                "timestamp": {"$gte": day, "$lt": day + DAY_SECONDS},
+                REPRESENTATIVE_FIELD: {"$ne": True},
+                SUMMARIZED_FIELD: {"$ne": True},
+            },
+            {"$set": {BATCH_FIELD: batch}},
+        )
+        match = {"timestamp": {"$gte": day, "$lt": day + DAY_SECONDS}, BATCH_FIELD: batch}
+        summaries = await collection.aggregate(RetentionService._daily_pipeline(match), allowDiskUse=True).to_list(None)
+        if not summaries:
+            return 0
+        existing = {
+            (doc["_id"]["f"], doc["_id"]["fp"]): doc
+            for doc in await daily.find(
+                {"_id": {"$in": [dict(s["_id"], d=day) for s in summaries]}}
+            ).to_list(None)
+        }
+        documents = []
+        representatives = []
+        for summary in summaries:
+            file_name, fingerprint = summary["_id"]["f"], summary["_id"]["fp"]
+            summary["_id"] = {"f": file_name, "fp": fingerprint, "d": day}
+            previous = existing.get((file_name, fingerprint))
+            if previous is None:
+                median = await collection.aggregate(
+                    RetentionService._median_pipeline(match, file_name, fingerprint, summary["n"]), allowDiskUse=True
+                ).to_list(1)
+                representatives.extend(doc["_id"] for doc in median)
+                documents.append(summary)
+            else:
+                documents.append(RetentionService._merge_summary(previous, summary))
+        await daily.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in documents], ordered=False)
+        if representatives:
+            await collection.update_many({"_id": {"$in": representatives}}, {"$set": {REPRESENTATIVE_FIELD: True}})
+        await collection.update_many(match, {"$set": {SUMMARIZED_FIELD: True}, "$unset": {BATCH_FIELD: ""}})
+        return len(summaries)
+
+    @staticmethod
+    async def _late_days(db, collection_name: str, summarized_until: float) -> List[float]:
+        """汇总进度之前仍有未汇总记录的天（迟到或回填的记录）"""
+        rows = await db[collection_name].aggregate([
+            {"$match": {
+                "timestamp": {"$lt": summarized_until},
+                REPRESENTATIVE_FIELD: {"$ne": True},
+                SUMMARIZED_FIELD: {"$ne": True},
+            }},
+            {"$group": {"_id": {"$subtract": ["$timestamp", {"$mod": ["$timestamp", DAY_SECONDS]}]}}},
+            {"$sort": {"_id": 1}},
+        ], allowDiskUse=True).to_list(None)
+        return [row["_id"] for row in rows]
+
+    @staticmethod
+    async def _summarize(db, collection_name: str, cutoff: float, state: Dict[str, Any], owner: str) -> Dict[str, int]:
+        """按天汇总截止时间之前尚未汇总的记录，并标记代表执行"""
+        collection = db[collection_name]
+        daily = db[RetentionService.daily_name(collection_name)]
+        summarized_until = state.get("summarized_until")
+        days = groups = late_days = 0
+        if summarized_until is not None and not state.get("record_flags"):
+            # 按记录标记之前的版本只记录了进度，进度之前未删除的记录都已汇总过
+            await collection.update_many(
+                RetentionService._pending_query(summarized_until), {"$set": {SUMMARIZED_FIELD: True}}
+            )
+            await RetentionService._state(db).update_one({"_id": collection_name}, {"$set": {"record_flags": True}})
+        if summarized_until is not None:
+            for day in await RetentionService._late_days(db, collection_name, summarized_until):
+                groups += await RetentionService._summarize_day(db, collection_name, day)
+                late_days += 1
+                await RetentionService._renew_lease(db, collection_name, owner)
+        else:
+            first = await collection.find_one(
+                RetentionService._pending_query(cutoff), {"timestamp": 1}, sort=[("timestamp", 1)]
+            )
+            if not first:
+                return {"days": 0, "late_days": 0, "groups": 0}
+            summarized_until = first["timestamp"] - first["timestamp"] % DAY_SECONDS
+            await daily.create_index([("_id.d", 1)])
+            await daily.create_index([("_id.f", 1), ("_id.d", 1)])
+            await RetentionService._state(db).update_one({"_id": collection_name}, {"$set": {"record_flags": True}})
+
+        day = summarized_until
+        while day < cutoff:
+            groups += await RetentionService._summarize_day(db, collection_name, day)
+            day += DAY_SECONDS
+            days += 1
+            # 每天完成后保存进度，中断后不会重复汇总（已汇总的记录带有标记）
+            await RetentionService._state(db).update_one(
+                {"_id": collection_name}, {"$set": {"summarized_until": day}}, upsert=True
+            )
+            state["summarized_until"] = day
+            await RetentionService._renew_lease(db, collection_name, owner)
+        return {"days": days, "late_days": late_days, "groups": groups}
+
+    @staticmethod
+    async def _archive_record(db, record: Dict[str, Any]) -> Dict[str, Any]:
+        """读出外置字段和去重计划，得到完整记录"""
+        record = await BlobStoreService.hydrate(db, record, BLOB_FIELDS)
+        if record.get("plan_hash") and "sql_plan" not in record:
+            record = await PlanStoreService.hydrate(db, record)
+        for key in ("data_ref", "sql_plan_ref", "plan_actuals", "plan_top"):
+            record.pop(key, None)
+        return record
+
+    @staticmethod
+    def _write_parquet(collection_name: str, records: List[Dict[str, Any]]) -> str:
+        """一批记录写入一个Parquet文件（先写临时文件再改名，删除原始记录前已完整落盘）"""
+        directory = os.path.join(RetentionService.archive_dir, collection_name)
+        os.makedirs(directory, exist_ok=True)
+        encoded = [BlobStoreService.encode(record) for record in records]
+        table = pa.table({
+            "id": pa.array([str(r["_id"]) for r in records], pa.string()),
+            "timestamp": pa.array([r.get("timestamp") for r in records], pa.float64()),
+            "file_name": pa.array([r.get("file_name") for r in records], pa.string()),
+            "sql_fingerprint": pa.array([r.get("sql_fingerprint") for r in records], pa.string()),
+            "status": pa.array([r.get("status") for r in records], pa.string()),
+            "execution_time_ms": pa.array([r.get("execution_time_ms") for r in records], pa.float64()),
+            "codec": pa.array([e["codec"] for e in encoded], pa.dictionary(pa.int8(), pa.string())),
+            "record": pa.array([e["payload"] for e in encoded], pa.binary()),
+        })
+        name = f"archive-{int(records[0].get('timestamp') or 0)}-{records[0]['_id']}.parquet"
+        path = os.path.join(directory, name)
+        pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+        return path
+
+    @staticmethod
+    async def _archive_batch(db, collection_name: str, archive: str, records: List[Dict[str, Any]]) -> int:
+        """归档一批记录，返回压缩后字节数"""
+        if archive == "none":
+            return 0
+        full_records = [await RetentionService._archive_record(db, dict(record)) for record in records]
+        if archive == "parquet":
+            path = await asyncio.to_thread(RetentionService._write_parquet, collection_name, full_records)
+            return os.path.getsize(path)
+        stored = 0
+        documents = []
+        for record in full_records:
+            encoded = BlobStoreService.encode(record)
+            stored += encoded["stored"]
+            documents.append({
+                "_id": record["_id"],
+                "timestamp": record.get("timestamp"),
+                "file_name": record.get("file_name"),
+                "sql_fingerprint": record.get("sql_fingerprint"),
+                "codec": encoded["codec"],
+                "size": encoded["size"],
+                "payload": bson.Binary(encoded["payload"]),
+            })
+        # 按_id覆盖写入，重试时不会重复
+        await db[RetentionService.archive_name(collection_name)].bulk_write(
+            [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in documents], ordered=False
+        )
+        return stored
+
+    @staticmethod
+    async def _purge(db, collection_name: str, archive: str, before: float, owner: str) -> Dict[str, int]:
+        """按批归档并删除已汇总的记录"""
+        collection = db[collection_name]
+        bucket = BlobStoreService._bucket(db)
+        deleted = archived_bytes = blob_files = shapes_deleted = 0
+        while True:
+            limit = RetentionService.batch_size
+            if RetentionService.max_deletes:
+                limit = min(limit, RetentionService.max_deletes - deleted)
+                if limit <= 0:
+                    break
+            records = await collection.find(RetentionService._purgeable_query(before), limit=limit).to_list(limit)
+            if not records:
+                break
+            archived_bytes += await RetentionService._archive_batch(db, collection_name, archive, records)
+            ids = [record["_id"] for record in records]
+            result = await collection.delete_many({"_id": {"$in": ids}})
+            deleted += result.deleted_count
+            await SimilarityService.remove(db, collection_name, ids)
+            # 归档中保存的是还原后的完整计划，不再引用plan_shapes
+            shapes_deleted += await PlanStoreService.release(db, [record.get("plan_hash") for record in records])
+            for record in records:
+                for field in BLOB_FIELDS:
+                    ref = record.get(f"{field}_ref")
+                    if ref:
+                        try:
+                            await bucket.delete(ref["id"])
+                            blob_files += 1
+                        except NoFile:
+                            # 上次执行在删除记录后、删除外置字段前中断
+                            pass
+            await RetentionService._renew_lease(db, collection_name, owner)
+            await asyncio.sleep(RetentionService.batch_pause)
+        return {
+            "deleted": deleted,
+            "archived_bytes": archived_bytes,
+            "blob_files_deleted": blob_files,
+            "plan_shapes_deleted": shapes_deleted,
+        }
+
+    @staticmethod
+    async def report(db, collection_name: str, raw_days: int) -> Dict[str, Any]:
+        """dry run: 估算可释放的空间和执行时间"""
+        collection = db[collection_name]
+        cutoff = await RetentionService._cutoff(db, collection_name, raw_days, dry_run=True)
+        pending = RetentionService._pending_query(cutoff)
+        pipeline = [
+            {"$match": pending},
+            {"$group": {
+                "_id": {
+                    "f": "$file_name",
+                    "fp": "$sql_fingerprint",
+                    "d": {"$subtract": ["$timestamp", {"$mod": ["$timestamp", DAY_SECONDS]}]},
+                },
+                "n": {"$sum": 1},
+                "blob_bytes": {"$sum": {"$add": [
+                    {"$ifNull": ["$data_ref.stored", 0]}, {"$ifNull": ["$sql_plan_ref.stored", 0]}
+                ]}},
+                "blob_files": {"$sum": {"$add": [
+                    {"$cond": [{"$ifNull": ["$data_ref", False]}, 1, 0]},
+                    {"$cond": [{"$ifNull": ["$sql_plan_ref", False]}, 1, 0]},
+                ]}},
+            }},
+            {"$group": {
+                "_id": None,
+                "records": {"$sum": "$n"},
+                "groups": {"$sum": 1},
+                "blob_bytes": {"$sum": "$blob_bytes"},
+                "blob_files": {"$sum": "$blob_files"},
+            }},
+        ]
+        totals, stats, total_count = await asyncio.gather(
+            collection.aggregate(pipeline, allowDiskUse=True).to_list(None),
+            db.command("collStats", collection_name),
+            collection.estimated_document_count(),
+        )
+        totals = totals[0] if totals else {"records": 0, "groups": 0, "blob_bytes": 0, "blob_files": 0}
+        # 每组保留一条代表执行
+        removable = max(totals["records"] - totals["groups"], 0)
+        avg_size = stats.get("avgObjSize", 0)
+        batches = -(-removable // RetentionService.batch_size) if removable else 0
+        return {
+            "collection": collection_name,
+            "raw_days": raw_days,
+            "cutoff": cutoff,
+            "records_before_cutoff": totals["records"],
+            "representatives_kept": totals["groups"],
+            "records_removed": removable,
+            "document_bytes_freed": int(removable * avg_size),
+            "blob_bytes_freed": totals["blob_bytes"],
+            "blob_files_freed": totals["blob_files"],
+            "full_scan_reduction": round(removable / total_count, 4) if total_count else 0.0,
+            "estimated_run_seconds": round(batches * RetentionService.batch_pause + removable * ESTIMATED_SECONDS_PER_RECORD, 1),
+            "dry_run": True,
+        }
+
+    @staticmethod
+    async def apply(db, collection_name: str, raw_days: int, archive: str = "collection", dry_run: bool = False) -> Dict[str, Any]:
+        """对单个集合执行保留策略"""
+        if dry_run:
+            return await RetentionService.report(db, collection_name, raw_days)
+        if archive == "parquet" and pa is None:
+            raise RuntimeError("archive=parquet需要安装pyarrow")
+        owner = RetentionService._lease_owner()
+        if not await RetentionService._acquire_lease(db, collection_name, owner):
+            logger.info("保留策略正在其他进程执行，跳过", extra={"collection": collection_name})
+            return {"collection": collection_name, "skipped": "正在其他进程执行"}
+        try:
+            return await RetentionService._apply_locked(db, collection_name, archive, raw_days, owner)
+        finally:
+            await RetentionService._release_lease(db, collection_name, owner)
+
+    @staticmethod
+    async def _apply_locked(db, collection_name: str, archive: str, raw_days: int, owner: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        cutoff = await RetentionService._cutoff(db, collection_name, raw_days, dry_run=False)
+        state = await RetentionService._state(db).find_one({"_id": collection_name}) or {}
+        summary = await RetentionService._summarize(db, collection_name, cutoff, state, owner)
+        # 只删除已完成汇总的天中带汇总标记的记录
+        purged = {"deleted": 0, "archived_bytes": 0, "blob_files_deleted": 0, "plan_shapes_deleted": 0}
+        if state.get("summarized_until"):
+            purged = await RetentionService._purge(
+                db, collection_name, archive, min(state["summarized_until"], cutoff), owner
+            )
+        if purged["deleted"]:
+            AnalysisService.invalidate_collection(collection_name)
+            high_water_marks.invalidate(collection_name)
+        await RetentionService._state(db).update_one(
+            {"_id": collection_name}, {"$set": {"last_run": time.time(), "cutoff": cutoff}}, upsert=True
+        )
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("保留策略执行完成", extra={"collection": collection_name, "deleted": purged["deleted"], "elapsed_ms": elapsed})
+        return dict(summary, **purged, collection=collection_name, cutoff=cutoff, archive=archive, elapsed_ms=elapsed)
+
+    @staticmethod
+    async def apply_all(db, dry_run: bool = False) -> List[Dict[str, Any]]:
+        """按已配置的策略依次执行（集合之间串行，限制对线上查询的影响）"""
+        results = []
+        for policy in await RetentionService.get_policies(db):
+            if not policy.get("enabled", True):
+                continue
+            try:
+                results.append(await RetentionService.apply(
+                    db, policy["collection"], policy["raw_days"], policy.get("archive", "collection"), dry_run
+                ))
+            except Exception as e:
+                logger.warning("保留策略执行失败: %s", e, extra={"collection": policy["collection"]})
+                results.append({"collection": policy["collection"], "error": str(e)})
+        return results
+
+
+class RetentionScheduler:
+    """服务内按RETENTION_INTERVAL_SECONDS定期执行全部策略"""
+
+    def __init__(self):
+        self.interval = float(os.getenv("RETENTION_INTERVAL_SECONDS", "0"))
+        self.last_results: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_results = await RetentionService.apply_all(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("保留策略定期执行失败: %s", e)
+
+    def start(self, db) -> None:
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+retention_scheduler = RetentionScheduler()
@@ -0,0 +1,238 @@
+"""近似统计服务
+
+对大集合用抽样代替全量扫描，返回外推后的统计值和置信区间。
+
+抽样方式:
+    random  使用$sample随机抽样（$sample位于管道第一阶段时使用随机游标，不扫描全表）
+    hash    按_id（ObjectId末4位十六进制，即自增计数器的低16位）分桶的确定性子样本，
+            多次计算结果稳定，但需要扫描匹配的文档
+
+慢SQL的数量用 execution_time_ms > 阈值 的计数精确得到（有execution_time_ms索引时只扫描索引），
+只在慢SQL内部抽样；慢SQL不多于样本量时直接精确统计。慢SQL通常很少，全集合抽样时样本中
+往往一条都没有，会把统计全部估计为0。
+
+环境变量:
+    APPROX_STATS_THRESHOLD   mode=auto时，文档数超过该值自动使用近似统计，默认1000000
+    APPROX_DEFAULT_SAMPLE    默认样本量，默认10000
+"""
+import math
+import os
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.execution import query_options
+from app.schemas import StatisticsSummary
+
+# 95%置信水平
+Z_95 = 1.96
+# hash抽样的桶数（_id末4位十六进制）
+HASH_BUCKETS = 16 ** 4
+_HEX_DIGITS = "0123456789abcdef"
+
+
+class ApproxStatsService:
+    """基于抽样的近似统计"""
+
+    auto_threshold = int(os.getenv("APPROX_STATS_THRESHOLD", "1000000"))
+    default_sample = int(os.getenv("APPROX_DEFAULT_SAMPLE", "10000"))
+
+    # 抽样时只取统计需要的字段
+    SAMPLE_PROJECTION = {
+        "_id": 0,
+        "execution_time_ms": 1,
+        "status": 1,
+        "row_count": 1,
+        "table_count": 1,
+        "node_count": {"$size": {"$ifNull": ["$sql_plan_metrics.nodes", []]}},
+    }
+
+    @staticmethod
+    async def should_approximate(collection, mode: str) -> bool:
+        """根据mode和集合规模决定是否使用近似统计"""
+        if mode == "approx":
+            return True
+        if mode != "auto":
+            return False
+        return await collection.estimated_document_count() > ApproxStatsService.auto_threshold
+
+    @staticmethod
+    async def approximate_population(collection, mode: str) -> Optional[int]:
+        """需要近似统计时返回文档数估计，否则返回None（与should_approximate相同的判断，只取一次文档数）"""
+        if mode not in ("approx", "auto"):
+            return None
+        total = await collection.estimated_document_count()
+        if mode == "approx" or total > ApproxStatsService.auto_threshold:
+            return total
+        return None
+
+    @staticmethod
+    def _id_bucket_expr() -> Dict[str, Any]:
+        """_id的确定性桶号：ObjectId字符串末4位十六进制转为0~65535"""
+        text = {"$toString": "$_id"}
+        digits = [
+            {"$multiply": [
+                {"$indexOfBytes": [_HEX_DIGITS, {"$substrBytes": [text, 20 + i, 1]}]},
+                16 ** (3 - i),
+            ]}
+            for i in range(4)
+        ]
+        return {"$add": digits}
+
+    @staticmethod
+    async def sample_documents(
+        collection, query: Dict[str, Any], sample_size: int, total: int, method: str = "random"
+    ) -> List[Dict[str, Any]]:
+        """抽取样本文档"""
+        if method == "hash":
+            # 取桶号小于阈值的全部文档，样本量约为sample_size
+            rate = min(sample_size / total, 1.0) if total else 1.0
+            buckets = max(int(math.ceil(rate * HASH_BUCKETS)), 1)
+            hash_match = {"$expr": {"$lt": [ApproxStatsService._id_bucket_expr(), buckets]}}
+            match = {"$and": [query, hash_match]} if query else hash_match
+            pipeline = [{"$match": match}]
+        elif query:
+            pipeline = [{"$match": query}, {"$sample": {"size": sample_size}}]
+        else:
+            pipeline = [{"$sample": {"size": sample_size}}]
+        pipeline.append({"$project": ApproxStatsService.SAMPLE_PROJECTION})
+        return await collection.aggregate(pipeline, allowDiskUse=True, **query_options("stats")).to_list(None)
+
+    @staticmethod
+    def mean_interval(values: List[float], population: int, z: float = Z_95) -> Tuple[float, float, float]:
+        """样本均值及置信区间（含有限总体修正）"""
+        n = len(values)
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        mean = statistics.fmean(values)
+        if n < 2:
+            return mean, mean, mean
+        fpc = math.sqrt(max(population - n, 0) / (population - 1)) if population > 1 else 0.0
+        margin = z * statistics.stdev(values) / math.sqrt(n) * fpc
+        return mean, mean - margin, mean + margin
+
+    @staticmethod
+    def percentile_interval(sorted_values: List[float], q: float, z: float = Z_95) -> Tuple[float, float, float]:
+        """分位数点估计及基于次序统计量的置信区间"""
+        n = len(sorted_values)
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        index = min(max(int(n * q) - 1, 0), n - 1)
+        margin = z * math.sqrt(n * q * (1 - q))
+        lower = min(max(int(math.floor(n * q - margin)) - 1, 0), n - 1)
+        upper = min(max(int(math.ceil(n * q + margin)) - 1, 0), n - 1)
+        return sorted_values[index], sorted_values[lower], sorted_values[upper]
+
+    @staticmethod
+    def count_interval(hits: int, n: int, population: int, z: float = Z_95) -> Tuple[float, float, float]:
+        """按样本比例外推总数，Wilson区间"""
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        p = hits / n
+        denominator = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denominator
+        margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+        return p * population, max(center - margin, 0.0) * population, min(center + margin, 1.0) * population
+
+    @staticmethod
+    def _scaled_distribution(counts: List[int], scale: float) -> Tuple[List[Dict[str, Any]], float, int]:
+        """整数值字段的外推分布，返回(分布, 均值, 最大值)"""
+        if not counts:
+            return [], 0.0, 0
+        max_value = max(counts)
+        distribution = []
+        for i in range(1, min(max_value + 1, 21)):
+            distribution.append({"range": str(i), "count": int(round(counts.count(i) * scale))})
+        return distribution, sum(counts) / len(counts), max_value
+
+    @staticmethod
+    async def compute_stats(
+        collection,
+        query: Dict[str, Any],
+        population: int,
+        slow_sql_threshold: float,
+        sample_size: Optional[int] = None,
+        method: str = "random",
+        include_shape_stats: bool = False,
+    ) -> StatisticsSummary:
+        """对匹配query的文档（总数约为population）进行抽样统计"""
+        from app.services.analysis import AnalysisService
+
+        sample_size = sample_size or ApproxStatsService.default_sample
+        docs = await ApproxStatsService.sample_documents(collection, query, sample_size, population, method)
+        n = len(docs)
+        if n == 0 or population == 0:
+            return StatisticsSummary(
+                total_plans=0, success_count=0, error_count=0,
+                avg_execution_time=0.0, max_execution_time=0.0, min_execution_time=0.0,
+                p95_execution_time=0.0, p99_execution_time=0.0, total_rows=0,
+                slow_sql_count=0, execution_time_distribution=[],
+                approximate=True, sample_size=0, confidence_level=0.95,
+            )
+        # 样本覆盖全部文档时即为精确值
+        population = max(population, n)
+        scale = population / n
+
+        times = sorted(float(d.get("execution_time_ms") or 0) for d in docs)
+        rows = [float(d.get("row_count") or 0) for d in docs]
+        success_hits = sum(1 for d in docs if d.get("status") == "success")
+        error_hits = sum(1 for d in docs if d.get("status") == "error")
+        slow_hits = sum(1 for t in times if t > slow_sql_threshold)
+
+        avg_time, avg_low, avg_high = ApproxStatsService.mean_interval(times, population)
+        p95, p95_low, p95_high = ApproxStatsService.percentile_interval(times, 0.95)
+        p99, p99_low, p99_high = ApproxStatsService.percentile_interval(times, 0.99)
+        success, success_low, success_high = ApproxStatsService.count_interval(success_hits, n, population)
+        errors, errors_low, errors_high = ApproxStatsService.count_interval(error_hits, n, population)
+        slow, slow_low, slow_high = ApproxStatsService.count_interval(slow_hits, n, population)
+        avg_rows, rows_low, rows_high = ApproxStatsService.mean_interval(rows, population)
+
+        distribution = AnalysisService._get_time_distribution(times)
+        for bucket in distribution:
+            bucket["count"] = int(round(bucket["count"] * scale))
+
+        result = dict(
+            total_plans=population,
+            success_count=int(round(success)),
+            error_count=int(round(errors)),
+            avg_execution_time=avg_time,
+            max_execution_time=times[-1],
+            min_execution_time=times[0],
+            p95_execution_time=p95,
+            p99_execution_time=p99,
+            total_rows=int(round(avg_rows * population)),
+            slow_sql_count=int(round(slow)),
+            execution_time_distribution=distribution,
+            approximate=True,
+            sample_size=n,
+            confidence_level=0.95,
+            confidence_intervals={
+                "avg_execution_time": [avg_low, avg_high],
+                "p95_execution_time": [p95_low, p95_high],
+                "p99_execution_time": [p99_low, p99_high],
+                "success_count": [success_low, success_high],
+                "error_count": [errors_low, errors_high],
+                "slow_sql_count": [slow_low, slow_high],
+                "total_rows": [rows_low * population, rows_high * population],
+            },
+        )
+        if include_shape_stats:
+            table_counts = [int(d.get("table_count") or 0) for d in docs]
+            node_counts = [int(d.get("node_count") or 0) for d in docs]
+            table_dist, table_avg, table_max = ApproxStatsService._scaled_distribution(table_counts, scale)
+            node_dist, node_avg, node_max = ApproxStatsService._scaled_distribution(node_counts, scale)
+            result.update(
+                from_table_distribution=table_dist,
+                plan_node_distribution=node_dist,
+                avg_from_tables=table_avg,
+                avg_plan_nodes=node_avg,
+                max_from_tables=table_max,
+                max_plan_nodes=node_max,
+            )
+        return StatisticsSummary(**result)
+
+    @staticmethod
+    async def count_slow(collection, slow_sql_threshold: float) -> int:
+        """慢SQL数量（精确计数）"""
+        return await collection.count_documents(
+            {"execution_time_ms": {"$gt": slow_sql_threshold}}, **query_options("stats")
+        )
@@ -0,0 +1,411 @@
+"""执行计划相似度检索（MinHash + LSH）
+
+每条记录提取两个特征集合：
+
+- 计划特征：算子、表名、索引名、连接类型，以及父子边和三层路径（边的n-gram）；
+  重复出现的特征按出现次数编号（"op:Seq Scan#2"），集合的Jaccard近似按次数加权
+- SQL特征：词法单元（常量替换为?）的3-gram shingle，复用sql_analysis.tokenize
+
+特征经稳定哈希后用NumPy一次计算全部置换下的最小哈希，得到MinHash签名；签名按band切分，
+每个band哈希为一个桶号。band数b、每band行数r决定召回阈值约(1/b)^(1/r)，默认32x4约为0.42。
+
+同一脚本的大量执行通常特征完全相同，签名也相同，因此按签名分组存储：
+
+    <name>__similarity          每个不同签名一个组：kind、签名、桶号（多键索引）、执行次数
+    <name>__similarity_members  每条记录一条：所属的plan组和sql组，以及展示用的字段
+
+查询时只取与目标共享至少一个桶的组（按共享桶数排序截断，组数与不同计划数相关而与执行次数无关），
+用签名估计Jaccard相似度排序后，再按组展开为最近的执行记录，不需要两两比较。
+
+新记录由 manage.py index-similarity 增量建立，进度（timestamp高水位）保存在 _similarity_state，
+只由建立索引推进；查询尚未建索引的记录时即时计算签名但不写入。回填的timestamp早于高水位的记录
+不会被增量处理，需要 --rebuild。
+保留策略删除记录时同步删除成员并递减组的执行次数，不再有执行的组随之删除。
+
+环境变量:
+    SIMILARITY_NUM_PERM        签名长度（置换数），默认128，修改后需要 --rebuild
+    SIMILARITY_BANDS           LSH band数，需整除签名长度，默认32
+    SIMILARITY_MAX_CANDIDATES  每次查询最多比较的候选数，默认2000
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from bson import Binary
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from app.core.database import db_config
+from app.core.execution import find_options, query_options
+from app.services.parquet_export import ParquetExportService
+from app.services.sql_analysis import LITERAL_KINDS, tokenize
+
+logger = logging.getLogger(__name__)
+
+# 梅森素数2^31-1：哈希值和置换系数都小于它，乘积不会溢出uint64
+_PRIME = np.uint64((1 << 31) - 1)
+_SEED = 20240611
+SHINGLE_SIZE = 3
+SIMILARITY_KINDS = ("plan", "sql")
+# 成员条目中保存、用于展示结果的记录字段
+ENTRY_FIELDS = ("file_name", "timestamp", "execution_time_ms", "status", "plan_hash", "sql_fingerprint")
+
+
+def _stable_hash(value: str, digest_size: int = 4) -> int:
+    """跨进程稳定的哈希（内置hash按进程随机化）"""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=digest_size).digest(), "little")
+
+
+class SimilarityService:
+    """MinHash签名、LSH分桶和相似记录查询"""
+
+    num_perm = int(os.getenv("SIMILARITY_NUM_PERM", "128"))
+    bands = int(os.getenv("SIMILARITY_BANDS", "32"))
+    max_candidates = int(os.getenv("SIMILARITY_MAX_CANDIDATES", "2000"))
+
+    _rng = np.random.default_rng(_SEED)
+    _a = _rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+    _b = _rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+    # 已建立LSH索引的集合，键为db_config.scope(集合名)
+    _indexed_collections: Set[Tuple[str, str, str]] = set()
+
+    @staticmethod
+    def index_name(collection_name: str) -> str:
+        return f"{collection_name}__similarity"
+
+    @staticmethod
+    def members_name(collection_name: str) -> str:
+        return f"{collection_name}__similarity_members"
+
+    @staticmethod
+    def _state(db):
+        return db["_similarity_state"]
+
+    # ---- 特征 ----
+
+    @staticmethod
+    def _counted(features: Iterable[str]) -> Set[str]:
+        """重复特征按出现次数编号"""
+        seen: Counter = Counter()
+        result = set()
+        for feature in features:
+            seen[feature] += 1
+            result.add(f"{feature}#{seen[feature]}")
+        return result
+
+    @staticmethod
+    def plan_features(explain: Optional[Dict[str, Any]]) -> Set[str]:
+        if not explain:
+            return set()
+        rows = ParquetExportService.flatten_plan(explain)
+        types = [row["node_type"] or "?" for row in rows]
+        features: List[str] = []
+        for row, node_type in zip(rows, types):
+            features.append(f"op:{node_type}")
+            if row["relation_name"]:
+                features.append(f"rel:{row['relation_name']}")
+                features.append(f"scan:{node_type}:{row['relation_name']}")
+            if row["index_name"]:
+                features.append(f"idx:{row['index_name']}")
+            if row["join_type"]:
+                features.append(f"join:{row['join_type']}:{node_type}")
+            parent = row["parent_index"]
+            if parent >= 0:
+                features.append(f"edge:{types[parent]}>{node_type}")
+                grandparent = rows[parent]["parent_index"]
+                if grandparent >= 0:
+                    features.append(f"path:{types[grandparent]}>{types[parent]}>{node_type}")
+        return SimilarityService._counted(features)
+
+    @staticmethod
+    def sql_features(sql: Optional[str]) -> Set[str]:
+        if not sql:
+            return set()
+        tokens = [
+            "?" if kind in LITERAL_KINDS else text.lower() if kind == "ident" else text
+            for kind, text in tokenize(sql)
+        ]
+        if len(tokens) <= SHINGLE_SIZE:
+            return {"sql:" + " ".join(tokens)} if tokens else set()
+        return SimilarityService._counted(
+            "sql:" + " ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)
+        )
+
+    # ---- 签名与分桶 ----
+
+    @staticmethod
+    def signature(features: Set[str]) -> Optional[np.ndarray]:
+        """MinHash签名（uint32数组），空集合返回None"""
+        if not features:
+            return None
+        hashes = np.fromiter((_stable_hash(f) for f in features), dtype=np.uint64, count=len(features)) % _PRIME
+        permuted = (SimilarityService._a[:, None] * hashes[None, :] + SimilarityService._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def band_keys(signature: Optional[np.ndarray]) -> List[int]:
+        """每个band的桶号（带band序号，不同band的相同取值不会落入同一桶）"""
+        if signature is None:
+            return []
+        rows = len(signature) // SimilarityService.bands
+        keys = []
+        for band in range(SimilarityService.bands):
+            chunk = band.to_bytes(2, "little") + signature[band * rows:(band + 1) * rows].tobytes()
+            keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "little", signed=True))
+        return keys
+
+    @staticmethod
+    def group_id(kind: str, signature: np.ndarray) -> str:
+        """签名组ID：特征集合相同的记录签名相同，落入同一组"""
+        return f"{kind}:{hashlib.blake2b(signature.tobytes(), digest_size=12).hexdigest()}"
+
+    @staticmethod
+    def _signatures(record: Dict[str, Any], explain: Optional[Dict[str, Any]]) -> Dict[str, Optional[np.ndarray]]:
+        return {
+            "plan": SimilarityService.signature(SimilarityService.plan_features(explain)),
+            "sql": SimilarityService.signature(SimilarityService.sql_features(record.get("sql_content"))),
+        }
+
+    @staticmethod
+    def build_entry(record: Dict[str, Any], explain: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """记录的成员条目及其所属的签名组（没有特征的类别不属于任何组）"""
+        member: Dict[str, Any] = {"_id": record["_id"]}
+        member.update({field: record.get(field) for field in ENTRY_FIELDS})
+        groups = []
+        for kind, signature in SimilarityService._signatures(record, explain).items():
+            if signature is None:
+                member[kind] = None
+                continue
+            group = {
+                "_id": SimilarityService.group_id(kind, signature),
+                "kind": kind,
+                "sig": Binary(signature.tobytes()),
+                "bands": SimilarityService.band_keys(signature),
+                "file_name": record.get("file_name"),
+            }
+            member[kind] = group["_id"]
+            groups.append(group)
+        return member, groups
+
+    # ---- 建立索引 ----
+
+    @staticmethod
+    async def ensure_indexes(db, collection_name: str) -> None:
+        scope = db_config.scope(collection_name)
+        if scope in SimilarityService._indexed_collections:
+            return
+        await db[SimilarityService.index_name(collection_name)].create_index([("bands", 1)])
+        members = db[SimilarityService.members_name(collection_name)]
+        for kind in SIMILARITY_KINDS:
+            await members.create_index([(kind, 1), ("timestamp", -1)])
+        SimilarityService._indexed_collections.add(scope)
+
+    @staticmethod
+    async def _write_batch(db, collection_name: str, batch: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> int:
+        """写入一批成员，只为新插入的成员累加组的执行次数（重复处理同一记录不会重复计数），返回新成员数"""
+        result = await db[SimilarityService.members_name(collection_name)].bulk_write(
+            [UpdateOne({"_id": member["_id"]}, {"$setOnInsert": member}, upsert=True) for member, _ in batch],
+            ordered=False,
+        )
+        increments: Counter = Counter()
+        groups: Dict[str, Dict[str, Any]] = {}
+        latest: Dict[str, Any] = {}
+        for position in result.upserted_ids:
+            member, member_groups = batch[position]
+            for group in member_groups:
+                increments[group["_id"]] += 1
+                groups[group["_id"]] = group
+                if member.get("timestamp") is not None:
+                    latest[group["_id"]] = max(latest.get(group["_id"], member["timestamp"]), member["timestamp"])
+        if increments:
+            operations = []
+            for group_id, count in increments.items():
+                update: Dict[str, Any] = {
+                    "$setOnInsert": {key: value for key, value in groups[group_id].items() if key != "_id"},
+                    "$inc": {"executions": count},
+                }
+                if group_id in latest:
+                    update["$max"] = {"last_timestamp": latest[group_id]}
+                operations.append(UpdateOne({"_id": group_id}, update, upsert=True))
+            await db[SimilarityService.index_name(collection_name)].bulk_write(operations, ordered=False)
+        return len(result.upserted_ids)
+
+    @staticmethod
+    async def index_collection(db, collection_name: str, rebuild: bool = False, batch_size: int = 500) -> Dict[str, Any]:
+        """为高水位之后的记录计算签名并归入签名组；rebuild=True时删除已有索引后重建"""
+        started = time.perf_counter()
+        state = SimilarityService._state(db)
+        if rebuild:
+            await db[SimilarityService.index_name(collection_name)].drop()
+            await db[SimilarityService.members_name(collection_name)].drop()
+            await state.delete_one({"_id": collection_name})
+            SimilarityService._indexed_collections.discard(db_config.scope(collection_name))
+        await SimilarityService.ensure_indexes(db, collection_name)
+        progress = await state.find_one({"_id": collection_name})
+        high_water = (progress or {}).get("high_water_mark")
+        # 同一时间戳可能有多条记录，从高水位本身开始（已有成员不会重复计数）
+        query = {"timestamp": {"$gte": high_water}} if high_water is not None else {}
+        cursor = db[collection_name].find(
+            query, {"data": 0, "data_ref": 0}, batch_size=batch_size, no_cursor_timeout=True, **find_options("export")
+        ).sort("timestamp", 1)
+        scanned = inserted = without_plan = 0
+        batch: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = []
+        last_ts = high_water
+
+        async def flush() -> None:
+            nonlocal batch, inserted
+            inserted += await SimilarityService._write_batch(db, collection_name, batch)
+            batch = []
+            if last_ts is not None:
+                await state.update_one(
+                    {"_id": collection_name}, {"$set": {"high_water_mark": last_ts, "updated_at": time.time()}}, upsert=True
+                )
+
+        try:
+            async for record in cursor:
+                scanned += 1
+                explain = await ParquetExportService._load_plan(db, record)
+                if explain is None:
+                    without_plan += 1
+                batch.append(SimilarityService.build_entry(record, explain))
+                if record.get("timestamp") is not None:
+                    last_ts = record["timestamp"]
+                if len(batch) >= batch_size:
+                    await flush()
+            if batch:
+                await flush()
+        finally:
+            await cursor.close()
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("相似度索引建立完成", extra={"collection": collection_name, "scanned": scanned, "elapsed_ms": elapsed})
+        return {
+            "collection": collection_name,
+            "rebuild": rebuild,
+            "previous_high_water_mark": high_water,
+            "high_water_mark": last_ts,
+            "scanned": scanned,
+            "inserted": inserted,
+            "without_plan": without_plan,
+            "groups": await db[SimilarityService.index_name(collection_name)].estimated_document_count(),
+            "elapsed_ms": elapsed,
+        }
+
+    @staticmethod
+    async def remove(db, collection_name: str, record_ids: List[Any]) -> None:
+        """记录被删除时删除成员，递减组的执行次数并删除不再有执行的组"""
+        if not record_ids:
+            return
+        members = db[SimilarityService.members_name(collection_name)]
+        removed = await members.find({"_id": {"$in": record_ids}}, {kind: 1 for kind in SIMILARITY_KINDS}).to_list(None)
+        if not removed:
+            return
+        await members.delete_many({"_id": {"$in": [member["_id"] for member in removed]}})
+        counts = Counter(member[kind] for member in removed for kind in SIMILARITY_KINDS if member.get(kind))
+        if counts:
+            groups = db[SimilarityService.index_name(collection_name)]
+            await groups.bulk_write(
+                [UpdateOne({"_id": group_id}, {"$inc": {"executions": -count}}) for group_id, count in counts.items()],
+                ordered=False,
+            )
+            await groups.delete_many({"_id": {"$in": list(counts)}, "executions": {"$lte": 0}})
+
+    # ---- 查询 ----
+
+    @staticmethod
+    async def _target_signature(db, collection_name: str, record_id: ObjectId, by: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """目标记录的 (是否存在, 签名组)；尚未建索引时即时计算，不写入"""
+        from app.services.analysis import AnalysisService
+
+        member = await db[SimilarityService.members_name(collection_name)].find_one(
+            {"_id": record_id}, {by: 1}, **find_options("detail")
+        )
+        if member is not None:
+            if not member.get(by):
+                return True, None
+            group = await db[SimilarityService.index_name(collection_name)].find_one({"_id": member[by]}, **find_options("detail"))
+            if group is not None:
+                return True, group
+        record = await AnalysisService.get_record_detail(db, collection_name, str(record_id))
+        if not record:
+            return False, None
+        record["_id"] = record_id
+        explain = await ParquetExportService._load_plan(db, record) if by == "plan" else None
+        _, groups = SimilarityService.build_entry(record, explain)
+        return True, next((group for group in groups if group["kind"] == by), None)
+
+    @staticmethod
+    async def find_similar(
+        db,
+        collection_name: str,
+        record_id: str,
+        k: int = 10,
+        by: str = "plan",
+        min_similarity: float = 0.0,
+    ) -> Optional[Dict[str, Any]]:
+        """按计划（by=plan）或SQL（by=sql）查找估计Jaccard相似度最高的k条记录，目标不存在时返回None
+
+        groups为相似度最高的签名组（含执行次数），results为按组展开的执行记录（组内按时间倒序）。
+        """
+        if by not in SIMILARITY_KINDS:
+            raise ValueError(f"不支持的相似度类型: {by}")
+        if not ObjectId.is_valid(record_id):
+            return None
+        started = time.perf_counter()
+        target_id = ObjectId(record_id)
+        exists, target_group = await SimilarityService._target_signature(db, collection_name, target_id, by)
+        if not exists:
+            return None
+        result: Dict[str, Any] = {"plan_id": record_id, "by": by, "candidates": 0, "groups": [], "results": []}
+        if target_group is None:
+            return result
+        target = np.frombuffer(target_group["sig"], dtype=np.uint32)
+        bands = target_group["bands"]
+        candidates = await db[SimilarityService.index_name(collection_name)].aggregate([
+            {"$match": {"bands": {"$in": bands}, "kind": by}},
+            {"$project": {
+                "sig": 1, "executions": 1, "file_name": 1, "last_timestamp": 1,
+                "shared_bands": {"$size": {"$setIntersection": ["$bands", bands]}},
+            }},
+            {"$sort": {"shared_bands": -1}},
+            {"$limit": SimilarityService.max_candidates},
+        ], **query_options("detail")).to_list(None)
+        candidates = [c for c in candidates if c.get("sig") and len(c["sig"]) == len(target) * 4]
+        result["candidates"] = len(candidates)
+        if candidates:
+            matrix = np.frombuffer(b"".join(c["sig"] for c in candidates), dtype=np.uint32).reshape(len(candidates), -1)
+            scores = (matrix == target).mean(axis=1)
+            members = db[SimilarityService.members_name(collection_name)]
+            for i in np.argsort(-scores, kind="stable"):
+                if scores[i] < min_similarity or (len(result["groups"]) >= k and len(result["results"]) >= k):
+                    break
+                candidate = candidates[i]
+                similarity = round(float(scores[i]), 4)
+                if len(result["groups"]) < k:
+                    result["groups"].append({
+                        "group": candidate["_id"],
+                        "similarity": similarity,
+                        "shared_bands": candidate["shared_bands"],
+                        "executions": candidate.get("executions", 0),
+                        "file_name": candidate.get("file_name"),
+                        "last_timestamp": candidate.get("last_timestamp"),
+                    })
+                remaining = k - len(result["results"])
+                if remaining <= 0:
+                    continue
+                executions = await members.find(
+                    {by: candidate["_id"], "_id": {"$ne": target_id}}, {field: 1 for field in ENTRY_FIELDS},
+                    **find_options("detail")
+                ).sort("timestamp", -1).limit(remaining).to_list(remaining)
+                for execution in executions:
+                    result["results"].append({
+                        "id": str(execution["_id"]),
+                        "similarity": similarity,
+                        "group": candidate["_id"],
+                        **{field: execution.get(field) for field in ENTRY_FIELDS},
+                    })
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
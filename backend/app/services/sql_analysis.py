@@ -0,0 +1,401 @@
+"""SQL文本分析
+
+原来的_count_from_tables对每个FROM再对剩余文本逐个关键词做re.search，长SQL下是平方复杂度，
+且JOIN、CTE计数不准确。这里用一个预编译的正则一次扫描切分词法单元（注释、字符串、
+美元引号、带引号的标识符都作为整体跳过），再在单元序列上单次遍历得到：
+
+- relations: 引用的基础表（去重，不含CTE名；带模式名时保留 schema.table）
+- table_count: 基础表数量，写入记录的table_count
+- relation_refs: 表引用次数（自连接计两次）
+- join_count: 显式JOIN数 + FROM中逗号分隔的隐式连接数
+- cte_count / subquery_count: WITH定义的CTE数、子查询数（不含CTE本体）
+- fingerprint: 常量替换为?、IN列表折叠后的归一化文本哈希，写入sql_fingerprint，
+  同一脚本不同参数的执行归为一组（趋势按指纹筛选、保留策略按指纹汇总）
+
+结果按SQL文本哈希缓存在LRU中，同一脚本反复执行时只分析一次；批量回填见backfill_collection。
+
+环境变量:
+    SQL_ANALYSIS_CACHE_SIZE   缓存的分析结果数，默认4096
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# 词法单元，按顺序匹配；空白和注释不产生单元
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<line_comment>--[^\n]*)
+    | (?P<block_comment>/\*.*?(?:\*/|\Z))
+    | (?P<dollar>\$(?P<tag>[A-Za-z_][A-Za-z0-9_]*|)\$.*?(?:\$(?P=tag)\$|\Z))
+    | (?P<string>[EeBbXxNn]?'(?:[^']|'')*(?:'|\Z))
+    | (?P<qident>"(?:[^"]|"")*(?:"|\Z)|`[^`]*(?:`|\Z)|\[[^\]]*(?:\]|\Z))
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<param>\$\d+|%s|%\([A-Za-z_][A-Za-z0-9_]*\)s|\?|(?<!:):[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<ident>[A-Za-z_\u0080-￿][A-Za-z0-9_$\u0080-￿]*)
+    | (?P<punct>::|[(),.;])
+    | (?P<op>[^\sA-Za-z0-9_(),.;'"`]+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+SKIP_KINDS = ("ws", "line_comment", "block_comment")
+LITERAL_KINDS = ("string", "dollar", "number", "param")
+
+# FROM子句在这些关键词处结束
+CLAUSE_END = frozenset({
+    "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "INTERSECT", "EXCEPT", "WINDOW",
+    "OFFSET", "FETCH", "RETURNING", "FOR", "SET", "ON", "USING", "SELECT", "VALUES", "INTO",
+})
+# 连接类型修饰词，后面跟JOIN
+JOIN_MODIFIERS = frozenset({"LEFT", "RIGHT", "FULL", "INNER", "OUTER", "CROSS", "NATURAL", "LATERAL"})
+# 紧跟在表名后但不是别名的关键词
+NOT_ALIAS = CLAUSE_END | JOIN_MODIFIERS | frozenset({
+    "JOIN", "AS", "TABLESAMPLE", "WITH", "AND", "OR", "NOT", "IS", "IN", "CASE", "WHEN", "THEN", "ELSE", "END",
+})
+# 括号前的这些关键词不表示函数调用
+NON_FUNCTION_KEYWORDS = frozenset({
+    "IN", "EXISTS", "ANY", "ALL", "SOME", "AS", "FROM", "JOIN", "ON", "AND", "OR", "NOT", "WHERE", "SELECT",
+    "UNION", "INTERSECT", "EXCEPT", "LATERAL", "VALUES", "USING", "WITH", "RECURSIVE", "MATERIALIZED",
+    "INTO", "TABLE", "SET", "RETURNING", "WHEN", "THEN", "ELSE", "BY", "HAVING", "IS",
+})
+STATEMENT_KEYWORDS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE", "MERGE", "VALUES", "TABLE"})
+_LITERAL_LIST_RE = re.compile(r"\?(?: , \?)+")
+
+
+def tokenize(sql: str) -> Iterator[Tuple[str, str]]:
+    """单次扫描产生 (类别, 文本)，跳过空白和注释"""
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind == "tag":
+            kind = "dollar"
+        if kind in SKIP_KINDS:
+            continue
+        yield kind, match.group()
+
+
+def _identifier(kind: str, text: str) -> str:
+    """标识符归一化：带引号的保留大小写，其余转小写"""
+    if kind == "qident":
+        return text[1:-1].replace('""', '"') if len(text) >= 2 else text
+    return text.lower()
+
+
+class _Scope:
+    """一层括号（或顶层）内的分析状态"""
+
+    __slots__ = ("kind", "expect_relation", "in_from", "in_with", "cte_stage")
+
+    def __init__(self, kind: str):
+        self.kind = kind              # top / subquery / cte / function / group
+        self.expect_relation = False  # 下一个标识符是表名
+        self.in_from = False          # 处于FROM列表中（逗号表示隐式连接）
+        self.in_with = False          # 处于WITH定义列表中
+        self.cte_stage = 0            # WITH列表: 0等待名称 1已读名称 2已读AS
+
+
+class SqlAnalysisService:
+    """SQL文本分析与缓存"""
+
+    _cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+    _cache_size = int(os.getenv("SQL_ANALYSIS_CACHE_SIZE", "4096"))
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def sql_hash(sql: str) -> bytes:
+        return hashlib.blake2b(sql.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    @staticmethod
+    def analyze(sql: Optional[str]) -> Dict[str, Any]:
+        """分析SQL（按文本哈希缓存，返回的字典为共享对象，不要修改）"""
+        if not sql:
+            return SqlAnalysisService._analyze_tokens("")
+        key = SqlAnalysisService.sql_hash(sql)
+        cache = SqlAnalysisService._cache
+        result = cache.get(key)
+        if result is not None:
+            cache.move_to_end(key)
+            SqlAnalysisService.hits += 1
+            return result
+        SqlAnalysisService.misses += 1
+        try:
+            result = SqlAnalysisService._analyze_tokens(sql)
+        except Exception as e:
+            logger.warning("SQL分析失败: %s", e)
+            result = SqlAnalysisService._analyze_tokens("")
+        cache[key] = result
+        while len(cache) > SqlAnalysisService._cache_size:
+            cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _analyze_tokens(sql: str) -> Dict[str, Any]:
+        relations: "OrderedDict[str, None]" = OrderedDict()
+        cte_names = set()
+        cte_refs = 0
+        relation_refs = 0
+        join_count = 0
+        subquery_count = 0
+        statements = 0
+        normalized: List[str] = []
+
+        scopes = [_Scope("top")]
+        prev = ""               # 上一个有效单元（关键词为大写）
+        prev2 = ""
+        verb: Optional[str] = None  # 当前语句的类型（SELECT/INSERT/UPDATE/DELETE/MERGE）
+        pending_paren = False   # 刚读到"("，等待第一个单元判断括号类型
+        pending_parent: Optional[_Scope] = None
+        pending_rel: Optional[str] = None  # 已读到的表名，可能还有 .table 后缀
+        pending_rel_target = False         # 来自INTO/UPDATE等，后跟括号是列名列表而不是表函数
+        pending_dot = False
+
+        def commit_relation(name: str) -> None:
+            nonlocal relation_refs, cte_refs
+            if name in cte_names:
+                cte_refs += 1
+            else:
+                relations[name] = None
+                relation_refs += 1
+
+        for kind, text in tokenize(sql):
+            is_word = kind == "ident"
+            upper = text.upper() if is_word else text
+
+            # 归一化文本：常量替换为?，关键词和未加引号的标识符统一小写
+            if kind in LITERAL_KINDS:
+                normalized.append("?")
+            elif is_word:
+                normalized.append(text.lower())
+            elif text != ";":
+                normalized.append(text)
+
+            # 限定名 schema.table 在读完后一起提交
+            if pending_rel is not None:
+                if text == "." and not pending_dot:
+                    pending_dot = True
+                    prev2, prev = prev, text
+                    continue
+                if pending_dot and kind in ("ident", "qident"):
+                    pending_rel = f"{pending_rel}.{_identifier(kind, text)}"
+                    pending_dot = False
+                    prev2, prev = prev, upper
+                    continue
+                if not (text == "(" and not pending_rel_target):
+                    commit_relation(pending_rel)
+                # 否则是表函数 FROM func(...)，不计入表
+                pending_rel = None
+                pending_dot = False
+
+            scope = scopes[-1]
+            if pending_paren:
+                # 括号类型由第一个单元决定
+                pending_paren = False
+                if is_word and upper in ("SELECT", "WITH", "VALUES"):
+                    if scope.kind != "cte":
+                        scope.kind = "subquery"
+                        subquery_count += 1
+                elif scope.kind == "group" and pending_parent is not None and pending_parent.expect_relation:
+                    # FROM (a JOIN b)：括号内继续按FROM列表处理
+                    scope.expect_relation = True
+                    scope.in_from = True
+                if pending_parent is not None:
+                    pending_parent.expect_relation = False
+
+            if kind == "punct":
+                if text == "(":
+                    if scope.in_with and scope.cte_stage == 2:
+                        paren_kind = "cte"
+                        scope.cte_stage = 0
+                    elif scope.in_with and scope.cte_stage == 1:
+                        paren_kind = "group"  # CTE列名列表
+                    elif prev and prev not in NON_FUNCTION_KEYWORDS and (prev[0].isalpha() or prev[0] in '_"'):
+                        paren_kind = "function"
+                    else:
+                        paren_kind = "group"
+                    if prev == "USING":
+                        scope.expect_relation = False  # JOIN ... USING (col)
+                    scopes.append(_Scope(paren_kind))
+                    pending_paren = True
+                    pending_parent = scope
+                elif text == ")":
+                    if len(scopes) > 1:
+                        scopes.pop()
+                        scopes[-1].expect_relation = False
+                elif text == ",":
+                    if scope.in_from and not scope.in_with:
+                        scope.expect_relation = True
+                        join_count += 1
+                elif text == ";":
+                    if prev and prev != ";":
+                        statements += 1
+                    scopes = [_Scope("top")]
+                    verb = None
+                    pending_paren = False
+                prev2, prev = prev, text
+                continue
+
+            if kind == "qident":
+                if scope.in_with and scope.cte_stage == 0:
+                    cte_names.add(_identifier(kind, text))
+                    scope.cte_stage = 1
+                elif scope.expect_relation:
+                    pending_rel, pending_rel_target = _identifier(kind, text), not scope.in_from
+                    scope.expect_relation = False
+                prev2, prev = prev, '"'
+                continue
+            if not is_word:
+                prev2, prev = prev, text
+                continue
+
+            if verb is None and upper in STATEMENT_KEYWORDS | {"DELETE"}:
+                verb = upper
+            if upper == "WITH" and prev in ("", ";", "("):
+                scope.in_with = True
+                scope.cte_stage = 0
+            elif scope.in_with and scope.cte_stage == 0:
+                if upper in STATEMENT_KEYWORDS or upper == "DELETE":
+                    scope.in_with = False
+                elif upper != "RECURSIVE":
+                    cte_names.add(text.lower())
+                    scope.cte_stage = 1
+            elif scope.in_with and scope.cte_stage == 1 and upper == "AS":
+                scope.cte_stage = 2
+            elif upper == "FROM":
+                # IS DISTINCT FROM 与函数参数中的FROM（EXTRACT/SUBSTRING等）不是FROM子句
+                if not (prev == "DISTINCT" and prev2 == "IS") and scope.kind != "function":
+                    scope.expect_relation = True
+                    scope.in_from = True
+            elif upper == "JOIN":
+                join_count += 1
+                scope.expect_relation = True
+                scope.in_from = True
+            elif upper in ("UPDATE", "INTO") and scope.kind != "function" and prev not in ("FOR", "DO"):
+                scope.expect_relation = True
+                scope.in_from = False
+            elif upper == "TABLE" and prev in ("", ";", "(", "TRUNCATE", "LOCK"):
+                scope.expect_relation = True
+            elif upper == "USING" and verb in ("DELETE", "MERGE") and scope.kind != "function" and prev != "JOIN":
+                scope.expect_relation = True
+                scope.in_from = True
+            elif scope.expect_relation:
+                if upper in ("ONLY", "LATERAL"):
+                    pass
+                elif upper in CLAUSE_END:
+                    scope.expect_relation = False
+                    scope.in_from = False
+                else:
+                    pending_rel, pending_rel_target = text.lower(), not scope.in_from
+                    scope.expect_relation = False
+            elif scope.in_from and upper in CLAUSE_END and upper not in ("ON", "USING"):
+                scope.in_from = False
+            prev2, prev = prev, upper
+
+        if pending_rel is not None:
+            commit_relation(pending_rel)
+        if prev and prev != ";":
+            statements += 1
+
+        # IN列表等连续常量折叠为一个?
+        fingerprint_source = _LITERAL_LIST_RE.sub("?", " ".join(normalized))
+        return {
+            "relations": list(relations),
+            "table_count": len(relations),
+            "relation_refs": relation_refs,
+            "join_count": join_count,
+            "cte_count": len(cte_names),
+            "cte_refs": cte_refs,
+            "subquery_count": subquery_count,
+            "statement_count": statements,
+            "fingerprint": hashlib.sha256(fingerprint_source.encode("utf-8", "surrogatepass")).hexdigest()[:16] if normalized else None,
+        }
+
+    @staticmethod
+    def cache_info() -> Dict[str, Any]:
+        return {
+            "size": len(SqlAnalysisService._cache),
+            "max_size": SqlAnalysisService._cache_size,
+            "hits": SqlAnalysisService.hits,
+            "misses": SqlAnalysisService.misses,
+        }
+
+    @staticmethod
+    def annotate_record(record: Dict[str, Any]) -> Dict[str, Any]:
+        """录入时调用：按sql_content写入table_count、sql_fingerprint和sql_analysis"""
+        record.update(SqlAnalysisService.record_fields(record.get("sql_content")))
+        return record
+
+    @staticmethod
+    def record_fields(sql: Optional[str]) -> Dict[str, Any]:
+        analysis = SqlAnalysisService.analyze(sql)
+        return {
+            "table_count": analysis["table_count"],
+            "sql_fingerprint": analysis["fingerprint"],
+            "sql_analysis": {
+                "relations": analysis["relations"][:100],
+                "join_count": analysis["join_count"],
+                "cte_count": analysis["cte_count"],
+                "subquery_count": analysis["subquery_count"],
+                "statement_count": analysis["statement_count"],
+            },
+        }
+
+    @staticmethod
+    async def backfill_collection(
+        db,
+        collection_name: str,
+        batch_size: int = 1000,
+        rescan: bool = False,
+        dry_run: bool = False,
+    ) -> Dict[str, Any]:
+        """批量回填table_count / sql_fingerprint / sql_analysis，默认只处理没有指纹的记录"""
+        from app.services.analysis import AnalysisService
+        from app.services.trend import TrendService
+
+        started = time.perf_counter()
+        collection = db[collection_name]
+        if not dry_run:
+            await TrendService.ensure_indexes(db, collection_name)
+        query = {} if rescan else {"sql_fingerprint": {"$exists": False}}
+        cursor = collection.find(query, {"sql_content": 1, "table_count": 1}, batch_size=batch_size, no_cursor_timeout=True)
+        scanned = updated = changed_table_count = 0
+        hits_before = SqlAnalysisService.hits
+        operations: List[UpdateOne] = []
+        try:
+            async for record in cursor:
+                scanned += 1
+                fields = SqlAnalysisService.record_fields(record.get("sql_content"))
+                if record.get("table_count") != fields["table_count"]:
+                    changed_table_count += 1
+                if dry_run:
+                    continue
+                operations.append(UpdateOne({"_id": record["_id"]}, {"$set": fields}))
+                if len(operations) >= batch_size:
+                    updated += (await collection.bulk_write(operations, ordered=False)).modified_count
+                    operations = []
+            if operations:
+                updated += (await collection.bulk_write(operations, ordered=False)).modified_count
+        finally:
+            await cursor.close()
+        if updated:
+            AnalysisService.invalidate_collection(collection_name)
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("SQL分析回填完成", extra={"collection": collection_name, "scanned": scanned, "updated": updated, "elapsed_ms": elapsed})
+        return {
+            "collection": collection_name,
+            "scanned": scanned,
+            "updated": updated,
+            "table_count_changed": changed_table_count,
+            "cache_hits": SqlAnalysisService.hits - hits_before,
+            "dry_run": dry_run,
+            "elapsed_ms": elapsed,
+        }
+
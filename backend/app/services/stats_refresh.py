@@ -0,0 +1,217 @@
+"""统计缓存的后台刷新（stale-while-revalidate）
+
+原来的TTL缓存到期后，第一个到达的请求要同步承担整次聚合的耗时。这里记录实际被请求过的
+统计键（集合、阈值、统计模式），由后台任务在到期前刷新：
+
+- 缓存未过期: 直接返回
+- 已过期但未超过STATS_MAX_STALE_SECONDS: 立即返回旧值（响应头 X-Stale: revalidating），
+  同时在后台刷新
+- 没有缓存或过期太久: 同步计算，同一个键的并发请求共用一次计算
+- 后台按 到期时间 - STATS_REFRESH_LEAD - 随机抖动 提前刷新，避免多个键同时到期；
+  同时刷新的键数受STATS_REFRESH_CONCURRENCY限制
+- 超过STATS_REFRESH_IDLE_SECONDS没有被请求的键不再刷新，其缓存值一并删除（缓存总量另受
+  STATS_CACHE_SIZE限制，见AnalysisService.set_cached）
+- 记录键时同时记录请求的连接目标（X-Mongo-Target），后台刷新在该目标下执行loader，
+  缓存只由这里按记录的键写入，不会写到其他目标的键上
+
+环境变量:
+    STATS_REFRESH_LEAD            提前刷新的秒数，默认60
+    STATS_REFRESH_JITTER          提前刷新的随机抖动上限秒数，默认30
+    STATS_REFRESH_CONCURRENCY     同时进行的后台刷新数，默认2
+    STATS_REFRESH_IDLE_SECONDS    多久未被请求后停止刷新，默认900
+    STATS_MAX_STALE_SECONDS       过期后仍可直接返回旧值的秒数，默认600
+    STATS_CACHE_SIZE              统计缓存最多保存的键数，默认1000
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import Response
+
+from app.core.database import db_config
+from app.core.execution import detach_operation
+from app.services.analysis import AnalysisService
+
+logger = logging.getLogger(__name__)
+
+# 后台检查到期键的间隔秒数
+TICK_SECONDS = 5.0
+# 缓存被清理（如实时推送收到删除）后，同一个键两次后台重算的最小间隔秒数
+MIN_REFRESH_INTERVAL = 30.0
+
+
+class StatsRefreshScheduler:
+    """按请求记录统计键，在后台提前刷新"""
+
+    def __init__(self):
+        self.lead_seconds = float(os.getenv("STATS_REFRESH_LEAD", "60"))
+        self.jitter_seconds = float(os.getenv("STATS_REFRESH_JITTER", "30"))
+        self.concurrency = int(os.getenv("STATS_REFRESH_CONCURRENCY", "2"))
+        self.idle_seconds = float(os.getenv("STATS_REFRESH_IDLE_SECONDS", "900"))
+        self.max_stale_seconds = float(os.getenv("STATS_MAX_STALE_SECONDS", "600"))
+        # 缓存键 -> {"loader", "target", "collection", "last_requested", "refreshed_at", "jitter"}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        # reset后递增，之前启动的刷新不再写入缓存
+        self._generation = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.stale_served = 0
+
+    def _track(self, cache_key: str, loader: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            entry = {"refreshed_at": 0.0, "jitter": random.uniform(0, self.jitter_seconds)}
+            self._entries[cache_key] = entry
+        # 使用最近一次请求的loader（其中的数据库句柄与请求一致）和连接目标
+        entry["loader"] = loader
+        entry["target"] = db_config.current_target()
+        entry["collection"] = AnalysisService._key_collections.get(cache_key)
+        entry["last_requested"] = time.monotonic()
+        return entry
+
+    async def _run(self, cache_key: str, entry: Dict[str, Any]) -> Any:
+        detach_operation()
+        # 刷新任务可能由后台循环创建，其上下文不是请求的上下文，按记录的目标重新设置
+        db_config.use_target(entry["target"])
+        loader = entry["loader"]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(self.concurrency, 1))
+        generation = self._generation
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                result = await loader()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning("统计缓存刷新失败: %s", e, extra={"cache_key": cache_key})
+                raise
+            # reset之后或键已因空闲被移除时不再写入
+            if generation != self._generation or self._entries.get(cache_key) is not entry:
+                return result
+            AnalysisService.set_cached(cache_key, result, entry["collection"])
+            self.refreshes += 1
+            entry["refreshed_at"] = time.monotonic()
+            entry["jitter"] = random.uniform(0, self.jitter_seconds)
+            logger.debug("统计缓存已刷新", extra={
+                "cache_key": cache_key, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+            return result
+
+    def _refresh(self, cache_key: str, entry: Dict[str, Any]) -> asyncio.Task:
+        """启动刷新；同一个键已有刷新在进行时复用"""
+        task = self._inflight.get(cache_key)
+        if task is None or task.done():
+            task = asyncio.create_task(self._run(cache_key, entry))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda t, key=cache_key: self._finish(key, t))
+        return task
+
+    def _finish(self, cache_key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(cache_key) is task:
+            del self._inflight[cache_key]
+        # 后台刷新没有等待者，取出异常避免"Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def serve(
+        self,
+        cache_key: str,
+        loader: Callable[[], Awaitable[Any]],
+        response: Optional[Response] = None,
+    ) -> Any:
+        """按stale-while-revalidate返回统计结果，loader必须跳过缓存直接计算"""
+        entry = self._track(cache_key, loader)
+        self.start()
+        age = AnalysisService.get_cache_age(cache_key)
+        if age is not None and age < AnalysisService._cache_ttl:
+            return AnalysisService.get_cached(cache_key, allow_stale=True)
+        if age is not None and age < AnalysisService._cache_ttl + self.max_stale_seconds:
+            self._refresh(cache_key, entry)
+            self.stale_served += 1
+            if response is not None:
+                response.headers["X-Stale"] = "revalidating"
+                # 旧值与当前高水位不对应，不能用于缓存校验
+                if "etag" in response.headers:
+                    del response.headers["etag"]
+            return AnalysisService.get_cached(cache_key, allow_stale=True)
+        # 请求被取消（客户端断开）时不影响共用的计算
+        return await asyncio.shield(self._refresh(cache_key, entry))
+
+    def _due(self, cache_key: str, entry: Dict[str, Any], now: float) -> bool:
+        age = AnalysisService.get_cache_age(cache_key)
+        if age is None:
+            # 缓存被清理：仍在被使用的键在后台重算，但限制频率
+            return now - entry["refreshed_at"] >= MIN_REFRESH_INTERVAL
+        return age >= AnalysisService._cache_ttl - self.lead_seconds - entry["jitter"]
+
+    def tick(self) -> int:
+        """清理空闲键并启动到期键的刷新，返回启动的刷新数"""
+        now = time.monotonic()
+        started = 0
+        for cache_key, entry in list(self._entries.items()):
+            if now - entry["last_requested"] >= self.idle_seconds:
+                del self._entries[cache_key]
+                AnalysisService.drop_cached(cache_key)
+                logger.debug("统计键长时间未被请求，停止刷新并删除缓存", extra={"cache_key": cache_key})
+                continue
+            if cache_key in self._inflight or not self._due(cache_key, entry, now):
+                continue
+            self._refresh(cache_key, entry)
+            started += 1
+        return started
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning("统计缓存刷新调度失败: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._task, *self._inflight.values()] if t is not None and not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._inflight.clear()
+
+    def reset(self) -> None:
+        """清空跟踪的键（活动连接目标切换后，loader中的数据库句柄已失效）
+
+        进行中的刷新继续为等待的请求返回结果，但不再写入缓存。
+        """
+        self._generation += 1
+        self._entries.clear()
+        self._inflight.clear()
+
+    def info(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "tracked_keys": {
+                key: {
+                    "idle_seconds": round(now - entry["last_requested"], 1),
+                    "cache_age": AnalysisService.get_cache_age(key),
+                    "refreshing": key in self._inflight,
+                }
+                for key, entry in self._entries.items()
+            },
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "stale_served": self.stale_served,
+        }
+
+
+stats_refresher = StatsRefreshScheduler()
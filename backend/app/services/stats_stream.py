@@ -0,0 +1,143 @@
+"""统计结果的渐进式推送
+
+/stats/slow-sql 要等最慢的内部查询（通常是耗时分布或节点数扫描）完成才返回。这里把慢SQL统计
+拆成相互独立的部分（见AnalysisService.slow_sql_sections）并发执行，每部分完成后立即推送，
+仪表板可以先显示关键数字，分布图随后补齐：
+
+    {"type": "section", "section": "counts", "data": {...}, "elapsed_ms": 12.3}
+    {"type": "error", "section": "plan_nodes", "error": "timeout"}
+    {"type": "complete", "cached": false, "partial": false, "stats": {...完整StatisticsSummary}}
+
+全部部分成功（或近似统计完成）时写入与 /stats/slow-sql 相同的缓存；缓存未过期或使用近似统计时
+只推送一条complete。
+客户端断开时取消尚未完成的查询，并按操作标记终止MongoDB中仍在运行的聚合（见execution）。
+整个推送期间占用与 /stats/slow-sql 相同的并发名额（stats_slow_sql）。
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from pymongo.errors import ExecutionTimeout
+
+from app.core.execution import kill_tagged_operations_later, new_operation_tag, start_tagged
+from app.schemas import StatisticsSummary
+from app.services.analysis import AnalysisService
+from app.services.sampling import ApproxStatsService
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def encode_event(message: Dict[str, Any], stream_format: str) -> bytes:
+    data = json.dumps(message, ensure_ascii=False, default=str)
+    if stream_format == "ndjson":
+        return f"{data}\n".encode("utf-8")
+    return f"event: {message['type']}\ndata: {data}\n\n".encode("utf-8")
+
+
+class ProgressiveStatsService:
+    """按部分推送的统计"""
+
+    @staticmethod
+    async def slow_sql_events(
+        db,
+        collection_name: str,
+        slow_sql_threshold: float,
+        mode: str = "auto",
+        sample: Optional[int] = None,
+        sample_method: str = "random",
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """慢SQL统计的事件序列"""
+        variant = AnalysisService._stats_variant(mode, sample, sample_method)
+        cache_key = AnalysisService._get_cache_key(collection_name, slow_sql_threshold, variant=variant)
+        cached = AnalysisService.get_cached(cache_key)
+        if cached is not None:
+            yield {"type": "complete", "cached": True, "partial": False, "stats": cached.model_dump()}
+            return
+
+        collection = db[collection_name]
+        tag = new_operation_tag()
+        tasks: Dict[asyncio.Future, str] = {}
+        fields: Dict[str, Any] = {}
+        failed = []
+        try:
+            if await ApproxStatsService.should_approximate(collection, mode):
+                # 近似统计基于一次抽样，不再拆分
+                task = start_tagged(tag, lambda: AnalysisService.get_slow_sql_stats(
+                    db, collection_name, slow_sql_threshold, mode, sample, sample_method, use_cache=False
+                ))
+                tasks[task] = "approx"
+                result = await task
+                AnalysisService.set_cached(cache_key, result)
+                yield {"type": "complete", "cached": False, "partial": False, "stats": result.model_dump()}
+                return
+
+            started = time.perf_counter()
+            sections = AnalysisService.slow_sql_sections(collection, slow_sql_threshold)
+            order = list(sections)
+            for name, section in sections.items():
+                tasks[start_tagged(tag, section)] = name
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成的部分按预定顺序推送
+                for task in sorted(done, key=lambda t: order.index(tasks[t])):
+                    name = tasks[task]
+                    try:
+                        data = task.result()
+                    except ExecutionTimeout:
+                        failed.append(name)
+                        yield {"type": "error", "section": name, "error": "timeout"}
+                        continue
+                    except Exception as e:
+                        failed.append(name)
+                        logger.warning("统计部分计算失败: %s", e, extra={"section": name, "collection": collection_name})
+                        yield {"type": "error", "section": name, "error": str(e)}
+                        continue
+                    fields.update(data)
+                    yield {
+                        "type": "section",
+                        "section": name,
+                        "data": data,
+                        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                    }
+        finally:
+            # 提前结束（客户端断开）时取消任务，MongoDB中的操作另外终止
+            unfinished = [task for task in tasks if not task.done() or task.cancelled()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                kill_tagged_operations_later(db, tag)
+
+        if failed:
+            yield {"type": "complete", "cached": False, "partial": True, "failed": failed}
+            return
+        result = StatisticsSummary(total_plans=fields["slow_sql_count"], **fields)
+        AnalysisService.set_cached(cache_key, result)
+        yield {"type": "complete", "cached": False, "partial": False, "stats": result.model_dump()}
+
+    @staticmethod
+    async def stream(
+        events: AsyncIterator[Dict[str, Any]],
+        stream_format: str,
+        release: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[bytes]:
+        """事件序列编码为SSE或NDJSON，结束时调用release释放并发名额"""
+        try:
+            async for message in events:
+                yield encode_event(message, stream_format)
+        except Exception as e:
+            logger.warning("渐进式统计失败: %s", e)
+            yield encode_event({"type": "error", "section": None, "error": str(e)}, stream_format)
+        finally:
+            try:
+                await events.aclose()
+            finally:
+                if release is not None:
+                    release()
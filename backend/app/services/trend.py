@@ -0,0 +1,372 @@
+"""执行延迟趋势服务
+
+按时间桶（分钟/小时/天，基于timestamp，UTC对齐）在服务端聚合：次数、错误率、
+平均/P50/P95延迟、慢SQL数量。
+
+分位数由对数直方图估计（每10倍区间20个桶，相对误差约6%），直方图可以合并，
+因此小时级预聚合（rollup）可以直接合并为天级结果。rollup按(小时, 文件名)保存，
+另外保存一份不分文件名的全局汇总；按指纹筛选时直接查询原始集合。
+
+按指纹筛选依赖sql_fingerprint字段：新写入的记录由分析任务写入，已有记录需要先执行
+python manage.py analyze-sql 回填，未回填的记录不会出现在按指纹筛选的结果中。
+
+rollup由 POST /stats/trend/rollups/refresh、manage.py refresh-trend、保留策略执行前，
+以及设置了TREND_ROLLUP_INTERVAL时的后台任务刷新；趋势依赖的原始集合索引也在刷新时创建，
+查询接口不创建索引。每次刷新从高水位之前TREND_ROLLUP_LOOKBACK_SECONDS开始重算整小时，
+迟到（timestamp早于高水位）的记录在回看窗口内会被补进rollup，更早的需要 full=True 重建
+（保留策略已汇总删除的天不重算）。
+
+环境变量:
+    TREND_ROLLUP_INTERVAL           后台刷新已有rollup的间隔（秒），默认0即不在服务内刷新
+    TREND_ROLLUP_LOOKBACK_SECONDS   每次刷新在高水位之前重算的秒数，默认21600（6小时）
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core import lease
+from app.core.database import db_config
+from app.core.execution import query_options
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+# 未指定起始时间时的默认跨度
+DEFAULT_SPANS = {"minute": 6 * 3600, "hour": 7 * 86400, "day": 90 * 86400}
+MAX_BUCKETS = 5000
+
+# 对数直方图参数：0.1ms ~ 10^7ms
+HIST_PER_DECADE = 20
+HIST_OFFSET = 20
+HIST_MAX_INDEX = 8 * HIST_PER_DECADE
+
+# rollup中精确记录慢SQL数量的阈值，其他阈值用直方图估计
+ROLLUP_SLOW_THRESHOLDS = [50, 100, 200, 500, 1000, 5000, 10000]
+ROLLUP_GRANULARITY = 3600
+
+
+class TrendService:
+    """时间桶趋势统计"""
+
+    # 已创建索引的集合，按db_config.scope区分连接目标
+    _indexed_collections: Set[Tuple[str, str, str]] = set()
+    lookback_seconds = float(os.getenv("TREND_ROLLUP_LOOKBACK_SECONDS", "21600"))
+
+    @staticmethod
+    def _rollup_name(collection_name: str) -> str:
+        return f"{collection_name}__trend_hourly"
+
+    @staticmethod
+    def _state_collection(db):
+        return db["_trend_rollup_state"]
+
+    @staticmethod
+    async def ensure_indexes(db, collection_name: str) -> None:
+        """趋势查询依赖的索引，每个集合只创建一次（在刷新rollup时调用）"""
+        scope = db_config.scope(collection_name)
+        if scope in TrendService._indexed_collections:
+            return
+        collection = db[collection_name]
+        await collection.create_index([("timestamp", 1)])
+        await collection.create_index([("file_name", 1), ("timestamp", 1)])
+        await collection.create_index([("sql_fingerprint", 1), ("timestamp", 1)], sparse=True)
+        TrendService._indexed_collections.add(scope)
+
+    @staticmethod
+    def _hist_index_expr() -> Dict[str, Any]:
+        """执行时间对应的直方图下标"""
+        return {"$min": [HIST_MAX_INDEX, {"$max": [0, {"$add": [
+            {"$floor": {"$multiply": [
+                {"$log10": {"$max": [{"$ifNull": ["$execution_time_ms", 0]}, 0.1]}},
+                HIST_PER_DECADE,
+            ]}},
+            HIST_OFFSET,
+        ]}]}]}
+
+    @staticmethod
+    def _hist_value(index: int) -> float:
+        """直方图桶的几何中点"""
+        return 10 ** ((index - HIST_OFFSET + 0.5) / HIST_PER_DECADE)
+
+    @staticmethod
+    def _raw_pipeline(match: Dict[str, Any], bucket_size: int, slow_thresholds: List[float], group_file: bool = False) -> List[Dict[str, Any]]:
+        """从原始记录按时间桶聚合的管道"""
+        first_group_key = {"b": "$b", "h": "$h"}
+        second_group_key: Any = "$_id.b"
+        if group_file:
+            first_group_key["f"] = "$file_name"
+            second_group_key = {"b": "$_id.b", "f": "$_id.f"}
+        return [
+            {"$match": match},
+            {"$project": {
+                "_id": 0,
+                "file_name": 1,
+                "b": {"$subtract": ["$timestamp", {"$mod": ["$timestamp", bucket_size]}]},
+                "t": {"$ifNull": ["$execution_time_ms", 0]},
+                "err": {"$cond": [{"$eq": ["$status", "error"]}, 1, 0]},
+                "h": TrendService._hist_index_expr(),
+            }},
+            {"$group": {
+                "_id": first_group_key,
+                "n": {"$sum": 1},
+                "sum": {"$sum": "$t"},
+                "err": {"$sum": "$err"},
+                "max": {"$max": "$t"},
+                **{
+                    f"slow_{i}": {"$sum": {"$cond": [{"$gt": ["$t", threshold]}, 1, 0]}}
+                    for i, threshold in enumerate(slow_thresholds)
+                },
+            }},
+            {"$group": {
+                "_id": second_group_key,
+                "n": {"$sum": "$n"},
+                "sum": {"$sum": "$sum"},
+                "err": {"$sum": "$err"},
+                "max": {"$max": "$max"},
+                "hist": {"$push": ["$_id.h", "$n"]},
+                **{f"slow_{i}": {"$sum": f"$slow_{i}"} for i in range(len(slow_thresholds))},
+            }},
+        ]
+
+    @staticmethod
+    def _merge(buckets: Dict[float, Dict[str, Any]], bucket: float, doc: Dict[str, Any], slow_keys: List[str]) -> None:
+        """把一个分组结果合并到目标时间桶"""
+        target = buckets.setdefault(bucket, {"n": 0, "sum": 0.0, "err": 0, "max": 0.0, "hist": {}, "slow": [0] * len(slow_keys)})
+        target["n"] += doc["n"]
+        target["sum"] += doc["sum"]
+        target["err"] += doc["err"]
+        target["max"] = max(target["max"], doc.get("max") or 0.0)
+        for index, count in doc["hist"]:
+            target["hist"][int(index)] = target["hist"].get(int(index), 0) + count
+        for i, key in enumerate(slow_keys):
+            target["slow"][i] += doc.get(key, 0)
+
+    @staticmethod
+    def _percentile(hist: Dict[int, int], total: int, q: float, max_value: float) -> float:
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index in sorted(hist):
+            cumulative += hist[index]
+            if cumulative >= rank:
+                return min(TrendService._hist_value(index), max_value)
+        return max_value
+
+    @staticmethod
+    def _slow_from_hist(hist: Dict[int, int], threshold: float) -> int:
+        """直方图估计慢SQL数量（阈值所在桶按对数位置线性分摊）"""
+        position = math.log10(max(threshold, 0.1)) * HIST_PER_DECADE + HIST_OFFSET
+        boundary = int(math.floor(position))
+        fraction = 1 - (position - boundary)
+        count = 0.0
+        for index, n in hist.items():
+            if index > boundary:
+                count += n
+            elif index == boundary:
+                count += n * fraction
+        return int(round(count))
+
+    @staticmethod
+    def _build_match(start: float, end: float, file_name: Optional[str], fingerprint: Optional[str]) -> Dict[str, Any]:
+        match: Dict[str, Any] = {"timestamp": {"$gte": start, "$lt": end}}
+        if file_name:
+            match["file_name"] = file_name
+        if fingerprint:
+            match["sql_fingerprint"] = fingerprint
+        return match
+
+    @staticmethod
+    async def get_trend(
+        db,
+        collection_name: str,
+        granularity: str = "hour",
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        file_name: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        slow_sql_threshold: float = 100.0,
+        use_rollups: bool = True,
+    ) -> Dict[str, Any]:
+        """获取时间桶趋势"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"不支持的时间粒度: {granularity}")
+        bucket_size = GRANULARITIES[granularity]
+        end = end if end is not None else time.time()
+        start = start if start is not None else end - DEFAULT_SPANS[granularity]
+        start = start - start % bucket_size
+        if (end - start) / bucket_size > MAX_BUCKETS:
+            raise ValueError(f"时间桶数量超过{MAX_BUCKETS}，请缩小时间范围或使用更粗的粒度")
+
+        collection = db[collection_name]
+        buckets: Dict[float, Dict[str, Any]] = {}
+        slow_keys = ["slow_0"]
+        source = "raw"
+        raw_start = start
+
+        # 小时/天粒度且不按指纹筛选时，已预聚合的部分读取rollup
+        if use_rollups and bucket_size >= ROLLUP_GRANULARITY and not fingerprint:
+            state = await TrendService._state_collection(db).find_one({"_id": collection_name})
+            if state and state.get("high_water_mark", 0) > start:
+                rollup_end = min(state["high_water_mark"], end)
+                exact_threshold = slow_sql_threshold in ROLLUP_SLOW_THRESHOLDS
+                cursor = db[TrendService._rollup_name(collection_name)].find(
+                    {"_id.b": {"$gte": start, "$lt": rollup_end}, "_id.f": file_name},
+                    {"n": 1, "sum": 1, "err": 1, "max": 1, "hist": 1, "slow": 1},
+                )
+                async for doc in cursor:
+                    bucket = doc["_id"]["b"] - doc["_id"]["b"] % bucket_size
+                    if exact_threshold:
+                        doc["slow_0"] = doc["slow"][ROLLUP_SLOW_THRESHOLDS.index(slow_sql_threshold)]
+                    else:
+                        doc["slow_0"] = TrendService._slow_from_hist(
+                            {int(i): n for i, n in doc["hist"]}, slow_sql_threshold
+                        )
+                    TrendService._merge(buckets, bucket, doc, slow_keys)
+                raw_start = rollup_end
+                source = "rollup" if rollup_end >= end else "rollup+raw"
+
+        if raw_start < end:
+            pipeline = TrendService._raw_pipeline(
+                TrendService._build_match(raw_start, end, file_name, fingerprint),
+                bucket_size, [slow_sql_threshold]
+            )
+            async for doc in collection.aggregate(pipeline, allowDiskUse=True, **query_options("stats")):
+                TrendService._merge(buckets, doc["_id"], doc, slow_keys)
+
+        points = []
+        for bucket in sorted(buckets):
+            data = buckets[bucket]
+            n = data["n"]
+            points.append({
+                "bucket": bucket,
+                "count": n,
+                "error_count": data["err"],
+                "error_rate": data["err"] / n if n else 0.0,
+                "mean_ms": data["sum"] / n if n else 0.0,
+                "p50_ms": TrendService._percentile(data["hist"], n, 0.50, data["max"]),
+                "p95_ms": TrendService._percentile(data["hist"], n, 0.95, data["max"]),
+                "max_ms": data["max"],
+                "slow_count": data["slow"][0],
+            })
+
+        return {
+            "granularity": granularity,
+            "bucket_seconds": bucket_size,
+            "start": start,
+            "end": end,
+            "slow_sql_threshold": slow_sql_threshold,
+            "source": source,
+            "percentile_method": "log_histogram",
+            "points": points,
+        }
+
+    @staticmethod
+    async def refresh_rollups(db, collection_name: str, full: bool = False) -> Dict[str, Any]:
+        """增量刷新小时级rollup
+
+        从上次的高水位之前lookback_seconds开始重新计算整小时（含全局汇总和按文件名的汇总），
+        以$merge覆盖写入，补上迟到的记录；不早于保留策略的汇总进度（之前的原始记录已删除）。
+        当前未结束的小时不写入高水位，下次刷新时重算。
+        """
+        await TrendService.ensure_indexes(db, collection_name)
+        collection = db[collection_name]
+        rollup_name = TrendService._rollup_name(collection_name)
+        state_collection = TrendService._state_collection(db)
+        state = None if full else await state_collection.find_one({"_id": collection_name})
+
+        now = time.time()
+        complete_until = now - now % ROLLUP_GRANULARITY
+        if state:
+            start = state["high_water_mark"] - TrendService.lookback_seconds
+            start -= start % ROLLUP_GRANULARITY
+            retention = await db["_retention_state"].find_one({"_id": collection_name}, {"summarized_until": 1})
+            if retention and retention.get("summarized_until"):
+                start = max(start, retention["summarized_until"])
+        else:
+            first = await collection.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", 1)])
+            if not first:
+                return {"collection": collection_name, "buckets": 0, "high_water_mark": None}
+            start = first["timestamp"] - first["timestamp"] % ROLLUP_GRANULARITY
+            await db[rollup_name].create_index([("_id.f", 1), ("_id.b", 1)])
+
+        started_at = time.perf_counter()
+        match = {"timestamp": {"$gte": start, "$lt": complete_until}}
+        for group_file in (False, True):
+            # 按文件名汇总时排除没有文件名的记录，避免与全局汇总(f=null)冲突
+            stage_match = dict(match, file_name={"$type": "string"}) if group_file else match
+            pipeline = TrendService._raw_pipeline(stage_match, ROLLUP_GRANULARITY, ROLLUP_SLOW_THRESHOLDS, group_file)
+            project = {
+                "n": 1, "sum": 1, "err": 1, "max": 1, "hist": 1,
+                "slow": [f"$slow_{i}" for i in range(len(ROLLUP_SLOW_THRESHOLDS))],
+            }
+            if not group_file:
+                project["_id"] = {"b": "$_id", "f": {"$literal": None}}
+            pipeline += [
+                {"$project": project},
+                {"$merge": {"into": rollup_name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+            ]
+            await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+        await state_collection.update_one(
+            {"_id": collection_name},
+            {"$set": {"high_water_mark": complete_until, "updated_at": now}},
+            upsert=True,
+        )
+        return {
+            "collection": collection_name,
+            "from": start,
+            "high_water_mark": complete_until,
+            "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+        }
+
+
+class TrendRollupScheduler:
+    """服务内按TREND_ROLLUP_INTERVAL定期刷新已有的rollup（_trend_rollup_state中的集合）"""
+
+    def __init__(self):
+        self.interval = float(os.getenv("TREND_ROLLUP_INTERVAL", "0"))
+        self.last_results: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh_all(self, db) -> List[Dict[str, Any]]:
+        results = []
+        for name in await TrendService._state_collection(db).distinct("_id"):
+            try:
+                results.append(await TrendService.refresh_rollups(db, name))
+            except Exception as e:
+                logger.warning("趋势预聚合刷新失败: %s", e, extra={"collection": name})
+                results.append({"collection": name, "error": str(e)})
+        return results
+
+    async def _loop(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # 多worker/多主机时每个间隔只由抢到租约的进程执行
+                if not await lease.acquire(db, "trend_rollup", self.interval * lease.ROUND_FRACTION):
+                    continue
+                self.last_results = await self.refresh_all(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("趋势预聚合定期刷新失败: %s", e)
+
+    def start(self, db) -> None:
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+trend_scheduler = TrendRollupScheduler()
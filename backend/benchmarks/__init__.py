@@ -0,0 +1,9 @@
+"""性能基准测试
+
+- generator: 可复现的合成执行历史数据生成器
+- micro: 计划解析、执行时间分布、统计聚合的微基准
+- load: 针对运行中API的异步HTTP压测
+- results: 结果存储与基线回归对比
+
+用法见 python -m benchmarks --help
+"""
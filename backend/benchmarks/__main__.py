@@ -0,0 +1,120 @@
+"""命令行入口
+
+    python -m benchmarks generate --count 100000 --collection bench_records
+    python -m benchmarks micro --output results/micro.json [--baseline results/micro-base.json]
+    python -m benchmarks load --collection bench_records --duration 60 --output results/load.json
+    python -m benchmarks compare results/base.json results/new.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks import results as result_store
+
+DEFAULT_MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+DEFAULT_DATABASE = os.getenv("BENCH_DATABASE_NAME", "sql_results_bench")
+
+
+def _report(kind: str, results: dict, params: dict, args) -> int:
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        document = result_store.save_results(args.output, kind, results, params)
+    else:
+        document = {"results": results}
+    if args.baseline:
+        rows = result_store.compare_results(result_store.load_results(args.baseline), document, args.tolerance)
+        print(result_store.format_comparison(rows))
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="SQL计划可视化平台性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="生成合成数据并写入MongoDB")
+    gen.add_argument("--count", type=int, default=100000)
+    gen.add_argument("--seed", type=int, default=42)
+    gen.add_argument("--scripts", type=int, default=200)
+    gen.add_argument("--plan-depth", type=int, default=6)
+    gen.add_argument("--plan-width", type=int, default=3)
+    gen.add_argument("--days", type=int, default=90)
+    gen.add_argument("--end-timestamp", type=float, help="数据结束时间戳，默认当天0点(UTC)")
+    gen.add_argument("--mongodb-url", default=DEFAULT_MONGODB_URL)
+    gen.add_argument("--database", default=DEFAULT_DATABASE)
+    gen.add_argument("--collection", default="bench_records")
+    gen.add_argument("--append", action="store_true", help="不清空已有集合")
+
+    for name in ("micro", "load"):
+        p = sub.add_parser(name)
+        p.add_argument("--output", help="结果JSON保存路径")
+        p.add_argument("--baseline", help="基线结果JSON，对比后有回归时返回非零")
+        p.add_argument("--tolerance", type=float, default=0.10, help="允许的变慢比例")
+        p.add_argument("--seed", type=int, default=42)
+        if name == "micro":
+            p.add_argument("--repeat", type=int, default=5)
+            p.add_argument("--plan-depth", type=int, default=8)
+            p.add_argument("--plan-width", type=int, default=4)
+            p.add_argument("--mongodb-url", help="提供时额外运行统计聚合基准")
+            p.add_argument("--database", default=DEFAULT_DATABASE)
+            p.add_argument("--collection", default="bench_records")
+        else:
+            p.add_argument("--base-url", default="http://localhost:8000/api")
+            p.add_argument("--collection", default="bench_records")
+            p.add_argument("--concurrency", type=int, default=16)
+            p.add_argument("--duration", type=float, default=30.0)
+
+    cmp_parser = sub.add_parser("compare", help="对比两份结果")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--tolerance", type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        from benchmarks.generator import load_into_mongo
+        inserted = load_into_mongo(
+            args.mongodb_url, args.database, args.collection, args.count,
+            seed=args.seed, drop=not args.append, scripts=args.scripts,
+            plan_depth=args.plan_depth, plan_width=args.plan_width, days=args.days,
+            end_timestamp=args.end_timestamp,
+        )
+        print(f"已写入 {inserted} 条记录到 {args.database}.{args.collection}")
+        return 0
+
+    if args.command == "micro":
+        from benchmarks.micro import run_micro
+        params = {
+            "seed": args.seed, "repeat": args.repeat,
+            "plan_depth": args.plan_depth, "plan_width": args.plan_width,
+            "mongo": bool(args.mongodb_url), "collection": args.collection,
+        }
+        results = run_micro(
+            seed=args.seed, plan_depth=args.plan_depth, plan_width=args.plan_width, repeat=args.repeat,
+            mongodb_url=args.mongodb_url, database_name=args.database, collection_name=args.collection,
+        )
+        return _report("micro", results, params, args)
+
+    if args.command == "load":
+        from benchmarks.load import run_load
+        params = {
+            "seed": args.seed, "base_url": args.base_url, "collection": args.collection,
+            "concurrency": args.concurrency, "duration": args.duration,
+        }
+        results = run_load(
+            args.base_url, args.collection, concurrency=args.concurrency,
+            duration=args.duration, seed=args.seed,
+        )
+        return _report("load", results, params, args)
+
+    rows = result_store.compare_results(
+        result_store.load_results(args.baseline), result_store.load_results(args.current), args.tolerance
+    )
+    print(result_store.format_comparison(rows))
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
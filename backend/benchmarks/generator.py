@@ -0,0 +1,231 @@
+"""合成执行历史数据生成器
+
+同一个seed生成的数据完全一致。每个脚本有固定的SQL和少量执行计划形态，
+每次执行的计划结构沿用其中一种形态，只重新生成实际耗时和行数，
+与真实的夜间批量执行场景接近。
+"""
+import json
+import math
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+SCAN_TYPES = ["Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Heap Scan"]
+JOIN_TYPES = ["Hash Join", "Nested Loop", "Merge Join"]
+UNARY_TYPES = ["Sort", "Aggregate", "Limit", "Materialize", "Gather", "Subquery Scan", "Unique"]
+TABLES = [
+    "orders", "order_items", "customers", "products", "inventory", "shipments",
+    "payments", "invoices", "suppliers", "warehouses", "regions", "employees",
+    "events", "sessions", "page_views", "accounts", "ledger", "fx_rates",
+]
+
+
+class PlanHistoryGenerator:
+    """生成与PlanParserService期望格式一致的执行记录"""
+
+    def __init__(
+        self,
+        seed: int = 42,
+        scripts: int = 200,
+        plan_depth: int = 6,
+        plan_width: int = 3,
+        days: int = 90,
+        error_rate: float = 0.03,
+        end_timestamp: Optional[float] = None,
+    ):
+        self.rng = random.Random(seed)
+        self.plan_depth = plan_depth
+        self.plan_width = plan_width
+        self.days = days
+        self.error_rate = error_rate
+        # 默认以当天0点(UTC)为结束时间，同一天内多次生成结果一致
+        self.end_timestamp = end_timestamp if end_timestamp is not None else float(int(time.time()) // 86400 * 86400)
+        self.scripts = [self._make_script(i) for i in range(scripts)]
+        # Zipf分布：少数脚本执行次数远多于其他脚本
+        self._script_weights = [1.0 / (i + 1) for i in range(scripts)]
+
+    def _make_script(self, index: int) -> Dict[str, Any]:
+        rng = self.rng
+        tables = rng.sample(TABLES, rng.randint(1, min(6, len(TABLES))))
+        sql = self._make_sql(tables)
+        shapes = [self._make_shape(tables, self.plan_depth) for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+        directory = rng.choice(["etl", "report", "adhoc", "billing"])
+        return {
+            "file_name": f"{directory}_{index:04d}.sql",
+            "file_path": f"/{directory}/{directory}_{index:04d}.sql",
+            "sql_content": sql,
+            "tables": tables,
+            "shapes": shapes,
+            # 每个脚本的延迟基准（毫秒，对数正态参数）
+            "mu": rng.uniform(math.log(5), math.log(3000)),
+            "sigma": rng.uniform(0.2, 0.9),
+        }
+
+    def _make_sql(self, tables: List[str]) -> str:
+        rng = self.rng
+        base = tables[0]
+        lines = [f"SELECT {base}.id, count(*) AS cnt", f"FROM {base}"]
+        for table in tables[1:]:
+            join = rng.choice(["JOIN", "LEFT JOIN", "INNER JOIN"])
+            lines.append(f"{join} {table} ON {table}.{base}_id = {base}.id")
+        lines.append(f"WHERE {base}.created_at > now() - interval '{rng.randint(1, 30)} days'")
+        lines.append(f"GROUP BY {base}.id ORDER BY cnt DESC LIMIT {rng.randint(10, 1000)}")
+        if rng.random() < 0.3:
+            lines.insert(0, f"WITH recent AS (SELECT * FROM {base} WHERE id > {rng.randint(1, 10**6)})")
+        return "\n".join(lines)
+
+    def _make_shape(self, tables: List[str], depth: int) -> Dict[str, Any]:
+        """生成计划结构（不含实际执行数据）"""
+        rng = self.rng
+        if depth <= 1 or (depth < self.plan_depth and rng.random() < 0.25):
+            node_type = rng.choice(SCAN_TYPES)
+            table = rng.choice(tables)
+            node = {"Node Type": node_type, "Relation Name": table, "Alias": table[:3]}
+            if node_type in ("Index Scan", "Index Only Scan"):
+                node["Index Name"] = f"{table}_pkey"
+            if node_type == "Bitmap Heap Scan":
+                node["Plans"] = [{
+                    "Node Type": "Bitmap Index Scan",
+                    "Index Name": f"{table}_created_at_idx",
+                    "Parent Relationship": "Outer",
+                }]
+            return node
+        kind = rng.random()
+        if kind < 0.45:
+            node_type = rng.choice(JOIN_TYPES)
+            outer = self._make_shape(tables, depth - 1)
+            inner = self._make_shape(tables, depth - 1)
+            if node_type == "Hash Join":
+                inner = {"Node Type": "Hash", "Plans": [inner]}
+            outer["Parent Relationship"] = "Outer"
+            inner["Parent Relationship"] = "Inner"
+            return {"Node Type": node_type, "Join Type": rng.choice(["Inner", "Left"]), "Plans": [outer, inner]}
+        if kind < 0.55 and self.plan_width > 2:
+            children = [self._make_shape(tables, depth - 1) for _ in range(rng.randint(2, self.plan_width))]
+            for child in children:
+                child["Parent Relationship"] = "Member"
+            return {"Node Type": "Append", "Plans": children}
+        child = self._make_shape(tables, depth - 1)
+        child["Parent Relationship"] = "Outer"
+        return {"Node Type": rng.choice(UNARY_TYPES), "Plans": [child]}
+
+    def _fill_actuals(self, shape: Dict[str, Any], budget_ms: float) -> Dict[str, Any]:
+        """在计划结构上填充实际耗时，父节点耗时不小于子节点耗时之和"""
+        rng = self.rng
+        node = {k: v for k, v in shape.items() if k != "Plans"}
+        children = shape.get("Plans", [])
+        self_ratio = rng.uniform(0.05, 0.6) if children else 1.0
+        filled = []
+        if children:
+            child_budget = budget_ms * (1 - self_ratio)
+            splits = [rng.random() + 0.1 for _ in children]
+            total = sum(splits)
+            filled = [self._fill_actuals(c, child_budget * s / total) for c, s in zip(children, splits)]
+        rows = int(rng.lognormvariate(6, 2.5))
+        node.update({
+            "Parallel Aware": False,
+            "Startup Cost": round(rng.uniform(0, 100), 2),
+            "Total Cost": round(rng.uniform(100, 10 ** 6), 2),
+            "Plan Rows": max(int(rows * rng.uniform(0.1, 10)), 1),
+            "Plan Width": rng.randint(4, 200),
+            "Actual Startup Time": round(budget_ms * rng.uniform(0, 0.3), 3),
+            "Actual Total Time": round(budget_ms, 3),
+            "Actual Rows": rows,
+            "Actual Loops": 1 if rng.random() < 0.9 else rng.randint(2, 1000),
+            "Shared Hit Blocks": int(rng.lognormvariate(5, 2)),
+            "Shared Read Blocks": int(rng.lognormvariate(2, 2.5)),
+        })
+        if filled:
+            node["Plans"] = filled
+        return node
+
+    def _latency(self, script: Dict[str, Any]) -> float:
+        """重尾延迟：对数正态，叠加少量帕累托尖峰"""
+        value = self.rng.lognormvariate(script["mu"], script["sigma"])
+        if self.rng.random() < 0.01:
+            value *= self.rng.paretovariate(1.5)
+        return round(value, 3)
+
+    @staticmethod
+    def _preorder_types(plan: Dict[str, Any]) -> List[str]:
+        types = []
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            types.append(node.get("Node Type", "Unknown"))
+            stack.extend(reversed(node.get("Plans", [])))
+        return types
+
+    def generate(self, count: int) -> Iterator[Dict[str, Any]]:
+        """按时间顺序生成count条执行记录"""
+        rng = self.rng
+        start = self.end_timestamp - self.days * 86400
+        step = (self.end_timestamp - start) / max(count, 1)
+        for i in range(count):
+            script = rng.choices(self.scripts, weights=self._script_weights)[0]
+            timestamp = round(start + i * step + rng.uniform(0, step), 3)
+            latency = self._latency(script)
+            is_error = rng.random() < self.error_rate
+            shape = rng.choice(script["shapes"])
+            plan = self._fill_actuals(shape, latency * 0.98)
+            explain = {
+                "Plan": plan,
+                "Planning Time": round(rng.uniform(0.05, 5), 3),
+                "Triggers": [],
+                "Execution Time": latency,
+            }
+            row_count = 0 if is_error else int(rng.lognormvariate(3, 2))
+            record = {
+                "file_name": script["file_name"],
+                "file_path": script["file_path"],
+                "execution_time": timestamp - latency / 1000,
+                "status": "error" if is_error else "success",
+                "data": [{"id": j, "cnt": rng.randint(1, 10 ** 4)} for j in range(min(row_count, 20))],
+                "error": "canceling statement due to statement timeout" if is_error else None,
+                "row_count": row_count,
+                "execution_time_ms": latency,
+                "timestamp": timestamp,
+                "save_time": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                "sql_content": script["sql_content"],
+                "table_count": len(script["tables"]),
+                "sql_plan": [json.dumps(explain)],
+                "sql_plan_metrics": {"nodes": self._preorder_types(plan)},
+            }
+            if rng.random() < 0.5:
+                score = round(latency * 0.05 + len(script["tables"]) * 12 + rng.uniform(0, 20), 2)
+                record["enhanced_complexity_analysis"] = {"total_complexity_score": score}
+            yield record
+
+
+def load_into_mongo(
+    mongodb_url: str,
+    database_name: str,
+    collection_name: str,
+    count: int,
+    seed: int = 42,
+    batch_size: int = 1000,
+    drop: bool = True,
+    **generator_options: Any,
+) -> int:
+    """生成数据并批量写入MongoDB，返回写入条数"""
+    from pymongo import MongoClient
+
+    client = MongoClient(mongodb_url)
+    collection = client[database_name][collection_name]
+    if drop:
+        collection.drop()
+    generator = PlanHistoryGenerator(seed=seed, **generator_options)
+    batch = []
+    inserted = 0
+    for record in generator.generate(count):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    client.close()
+    return inserted
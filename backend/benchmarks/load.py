@@ -0,0 +1,138 @@
+"""异步HTTP压测
+
+对运行中的API（默认 http://localhost:8000/api）按权重混合请求各端点，
+固定并发数运行指定时长，统计每个端点的吞吐和延迟分位数。
+"""
+import asyncio
+import random
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# (名称, 权重)
+DEFAULT_MIX = [
+    ("plans", 20),
+    ("search", 15),
+    ("stats_basic", 10),
+    ("stats_slow_sql", 15),
+    ("stats_summary", 5),
+    ("slow_sql_list", 5),
+    ("detail", 20),
+    ("compare", 10),
+]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class LoadDriver:
+    def __init__(
+        self,
+        base_url: str,
+        collection: str,
+        concurrency: int = 16,
+        duration: float = 30.0,
+        seed: int = 42,
+        mix: Optional[List[Tuple[str, int]]] = None,
+        thresholds: Tuple[float, ...] = (50.0, 100.0, 200.0, 500.0, 1000.0),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.collection = collection
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rng = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.thresholds = thresholds
+        self.plan_ids: List[str] = []
+        self.file_names: List[str] = []
+        self.latencies: Dict[str, List[float]] = {name: [] for name, _ in self.mix}
+        self.errors: Dict[str, int] = {name: 0 for name, _ in self.mix}
+
+    async def _prepare(self, client: httpx.AsyncClient) -> None:
+        """预先取一批记录ID和文件名，供详情/对比/搜索请求使用"""
+        response = await client.get("/plans", params={"collection": self.collection, "page": 1, "size": 200})
+        response.raise_for_status()
+        items = response.json().get("items", [])
+        self.plan_ids = [item["_id"] for item in items]
+        self.file_names = sorted({item.get("file_name", "") for item in items if item.get("file_name")})
+        if not self.plan_ids:
+            raise RuntimeError(f"集合 {self.collection} 中没有数据，请先运行 generate")
+
+    def _request(self, name: str) -> Tuple[str, str, Dict[str, Any], Optional[Any]]:
+        """返回 (method, path, params, json_body)"""
+        rng = self.rng
+        params: Dict[str, Any] = {"collection": self.collection}
+        if name == "plans":
+            params.update(page=rng.randint(1, 50), size=20)
+            return "GET", "/plans", params, None
+        if name == "search":
+            params.update(q=rng.choice(self.file_names)[:6], page=1, size=20)
+            return "GET", "/search", params, None
+        if name == "stats_basic":
+            return "GET", "/stats/basic", params, None
+        if name == "stats_slow_sql":
+            params["slow_sql_threshold"] = rng.choice(self.thresholds)
+            return "GET", "/stats/slow-sql", params, None
+        if name == "stats_summary":
+            params["slow_sql_threshold"] = rng.choice(self.thresholds)
+            return "GET", "/stats/summary", params, None
+        if name == "slow_sql_list":
+            params["slow_sql_threshold"] = rng.choice(self.thresholds)
+            return "GET", "/stats/slow-sql-list", params, None
+        if name == "detail":
+            return "GET", f"/plans/{rng.choice(self.plan_ids)}/detail", params, None
+        if name == "compare":
+            return "POST", "/analysis/compare", params, rng.sample(self.plan_ids, min(3, len(self.plan_ids)))
+        raise ValueError(f"未知的请求类型: {name}")
+
+    async def _worker(self, client: httpx.AsyncClient, deadline: float) -> None:
+        names = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weights=weights)[0]
+            method, path, params, body = self._request(name)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            if ok:
+                self.latencies[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60.0, limits=limits) as client:
+            await self._prepare(client)
+            deadline = time.perf_counter() + self.duration
+            await asyncio.gather(*(self._worker(client, deadline) for _ in range(self.concurrency)))
+        return self.summary()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            results[f"http:{name}"] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "rps": len(values) / self.duration if self.duration else 0.0,
+                "mean_ms": statistics.fmean(values) if values else 0.0,
+                "median_ms": _percentile(values, 0.5),
+                "p95_ms": _percentile(values, 0.95),
+                "p99_ms": _percentile(values, 0.99),
+                "max_ms": values[-1] if values else 0.0,
+            }
+        return results
+
+
+def run_load(base_url: str, collection: str, **options: Any) -> Dict[str, Dict[str, Any]]:
+    return asyncio.run(LoadDriver(base_url, collection, **options).run())
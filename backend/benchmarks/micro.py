@@ -0,0 +1,149 @@
+"""微基准
+
+纯Python部分直接调用服务方法；统计聚合需要本地mongod，
+未提供mongodb_url时跳过。
+"""
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core import serialization
+from app.schemas import ComparisonData, PlanDetail, PlanNode
+from app.services.analysis import AnalysisService
+from app.services.plan_parser import PlanParserService
+from app.services.similarity import SimilarityService
+from app.services.sql_analysis import SqlAnalysisService
+from benchmarks.generator import PlanHistoryGenerator
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, number: int = 0, min_time: float = 0.2) -> Dict[str, Any]:
+    """重复执行func，返回每次调用耗时（毫秒）的统计
+
+    number为0时自动选择每轮调用次数，使每轮至少运行min_time秒。
+    """
+    if number <= 0:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            if time.perf_counter() - start >= min_time or number >= 10 ** 6:
+                break
+            number *= 2
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) * 1000 / number)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_ms": min(rounds),
+        "median_ms": statistics.median(rounds),
+        "max_ms": max(rounds),
+    }
+
+
+def _validated_json(model, payload: Dict[str, Any]) -> bytes:
+    """原响应路径：校验构造模型 -> jsonable_encoder -> json.dumps"""
+    return json.dumps(jsonable_encoder(model.model_validate(payload)), ensure_ascii=False).encode("utf-8")
+
+
+def _constructed_detail(payload: Dict[str, Any]) -> PlanDetail:
+    nodes = [PlanNode.model_construct(**node) for node in payload["nodes"]]
+    return PlanDetail.model_construct(**{**payload, "nodes": nodes})
+
+
+async def _measure_async(func: Callable[[], Any], repeat: int = 5) -> Dict[str, Any]:
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        rounds.append((time.perf_counter() - start) * 1000)
+    return {
+        "number": 1,
+        "repeat": repeat,
+        "min_ms": min(rounds),
+        "median_ms": statistics.median(rounds),
+        "max_ms": max(rounds),
+    }
+
+
+def run_micro(
+    seed: int = 42,
+    plan_depth: int = 8,
+    plan_width: int = 4,
+    distribution_size: int = 100000,
+    repeat: int = 5,
+    mongodb_url: Optional[str] = None,
+    database_name: str = "sql_results_bench",
+    collection_name: str = "bench_records",
+) -> Dict[str, Dict[str, Any]]:
+    """运行全部微基准，返回 {基准名: 统计}"""
+    generator = PlanHistoryGenerator(seed=seed, scripts=20, plan_depth=plan_depth, plan_width=plan_width)
+    records = list(generator.generate(50))
+    # 选节点最多的计划，放大解析开销
+    record = max(records, key=lambda r: len(r["sql_plan_metrics"]["nodes"]))
+    plan_text = PlanParserService.extract_query_plan_json(record)
+    plan_json = json.loads(plan_text)
+    times: List[float] = [r["execution_time_ms"] for r in generator.generate(distribution_size)]
+    # 长SQL：多个脚本拼成UNION ALL，放大表提取开销
+    detail = PlanParserService.build_plan_detail("bench", record, plan_json).model_dump()
+    comparison = {"plans": [detail] * 10, "comparison_metrics": {"total_plans": 10}}
+    long_sql = "\nUNION ALL\n".join(script["sql_content"].split("GROUP BY")[0] for script in generator.scripts * 10)
+
+    results = {
+        "parse_json_string": measure(lambda: PlanParserService.parse_json_string(plan_text), repeat),
+        f"parse_execution_plan[{len(record['sql_plan_metrics']['nodes'])}nodes]":
+            measure(lambda: PlanParserService.parse_execution_plan(plan_json), repeat),
+        f"time_distribution[{distribution_size}]":
+            measure(lambda: AnalysisService._get_time_distribution(times), repeat),
+        # 详情/对比响应的序列化：原路径与快速路径（model_construct + 预编译序列化器）
+        f"plan_detail_json[{len(detail['nodes'])}nodes,validated]":
+            measure(lambda: _validated_json(PlanDetail, detail), repeat),
+        f"plan_detail_json[{len(detail['nodes'])}nodes,fast]":
+            measure(lambda: serialization.dump_json(_constructed_detail(detail)), repeat),
+        "compare_json[10plans,validated]":
+            measure(lambda: _validated_json(ComparisonData, comparison), repeat),
+        "compare_json[10plans,fast]":
+            measure(lambda: serialization.dump_json(ComparisonData.model_construct(
+                plans=[_constructed_detail(plan) for plan in comparison["plans"]],
+                comparison_metrics=comparison["comparison_metrics"],
+            )), repeat),
+        f"sql_analysis[{len(long_sql)}chars,uncached]":
+            measure(lambda: SqlAnalysisService._analyze_tokens(long_sql), repeat),
+        # 相似度索引：一条记录的计划/SQL特征、MinHash签名和LSH桶号
+        f"similarity_entry[{len(record['sql_plan_metrics']['nodes'])}nodes]":
+            measure(lambda: SimilarityService.build_entry({**record, "_id": 0}, plan_json), repeat),
+    }
+
+    if mongodb_url:
+        results.update(asyncio.run(_run_mongo_micro(mongodb_url, database_name, collection_name, repeat)))
+    return results
+
+
+async def _run_mongo_micro(mongodb_url: str, database_name: str, collection_name: str, repeat: int) -> Dict[str, Dict[str, Any]]:
+    import motor.motor_asyncio
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_url)
+    db = client[database_name]
+
+    async def slow_sql_stats():
+        AnalysisService.clear_cache()
+        await AnalysisService.get_slow_sql_stats(db, collection_name, 100.0)
+
+    async def collection_stats():
+        await AnalysisService.get_collection_stats(db, collection_name, 100.0)
+
+    try:
+        return {
+            "get_slow_sql_stats[uncached]": await _measure_async(slow_sql_stats, repeat),
+            "get_collection_stats": await _measure_async(collection_stats, repeat),
+        }
+    finally:
+        client.close()
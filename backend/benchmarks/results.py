@@ -0,0 +1,78 @@
+"""基准结果存储与回归对比"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# 对比时使用的指标，越小越好
+COMPARE_METRICS = ("median_ms", "p95_ms")
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, kind: str, results: Dict[str, Dict[str, Any]], params: Dict[str, Any]) -> Dict[str, Any]:
+    """保存结果及运行环境信息"""
+    document = {
+        "kind": kind,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return document
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.10) -> List[Dict[str, Any]]:
+    """逐项对比两份结果，变慢超过tolerance的标记为回归"""
+    rows = []
+    for name, current_stats in current["results"].items():
+        base_stats = baseline["results"].get(name)
+        if not base_stats:
+            continue
+        for metric in COMPARE_METRICS:
+            if metric not in current_stats or metric not in base_stats:
+                continue
+            base_value, current_value = base_stats[metric], current_stats[metric]
+            change = (current_value - base_value) / base_value if base_value else 0.0
+            rows.append({
+                "benchmark": name,
+                "metric": metric,
+                "baseline": base_value,
+                "current": current_value,
+                "change": change,
+                "regression": change > tolerance,
+            })
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'benchmark':<45} {'metric':<10} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(
+            f"{row['benchmark']:<45} {row['metric']:<10} {row['baseline']:>12.3f} "
+            f"{row['current']:>12.3f} {row['change']:>+8.1%}{flag}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,182 @@
+"""运维命令
+
+    python manage.py externalize-blobs --collection <name> [--threshold 65536] [--dry-run]
+    python manage.py storage-report --collection <name>
+    python manage.py dedupe-plans --collection <name> [--dry-run]
+    python manage.py export-parquet --collection <name> [--output-dir exports] [--format parquet|arrow] [--full]
+    python manage.py score-complexity --collection <name> [--rescore] [--dry-run]
+    python manage.py analyze-sql --collection <name> [--rescan] [--dry-run]
+    python manage.py index-similarity --collection <name> [--rebuild]
+    python manage.py mirror-sync [--collection <name>] [--full]
+    python manage.py refresh-trend [--collection <name>] [--full]
+    python manage.py retention [--collection <name> --raw-days 90 --archive collection|parquet|none] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from app.core.database import db_config
+from app.core.logger import setup_logging
+
+
+async def externalize_blobs(args) -> dict:
+    from app.services.blob_store import BlobStoreService
+    db = db_config.get_database()
+    return await BlobStoreService.migrate_collection(
+        db, args.collection, threshold=args.threshold, batch_size=args.batch_size, dry_run=args.dry_run
+    )
+
+
+async def storage_report(args) -> dict:
+    from app.services.blob_store import BlobStoreService
+    return await BlobStoreService.size_report(db_config.get_database(), args.collection)
+
+
+async def dedupe_plans(args) -> dict:
+    from app.services.plan_store import PlanStoreService
+    return await PlanStoreService.migrate_collection(
+        db_config.get_database(), args.collection, batch_size=args.batch_size, dry_run=args.dry_run
+    )
+
+
+async def export_parquet(args) -> dict:
+    from app.services.parquet_export import ParquetExportService
+    return await ParquetExportService.export_collection(
+        db_config.get_database(),
+        args.collection,
+        output_dir=args.output_dir,
+        file_format=args.format,
+        full=args.full,
+        batch_rows=args.batch_rows,
+        row_group_size=args.row_group_size,
+    )
+
+
+async def score_complexity(args) -> dict:
+    from app.services.complexity import ComplexityService
+    return await ComplexityService.score_collection(
+        db_config.get_database(), args.collection, batch_size=args.batch_size, rescore=args.rescore, dry_run=args.dry_run
+    )
+
+
+async def analyze_sql(args) -> dict:
+    from app.services.sql_analysis import SqlAnalysisService
+    return await SqlAnalysisService.backfill_collection(
+        db_config.get_database(), args.collection, batch_size=args.batch_size, rescan=args.rescan, dry_run=args.dry_run
+    )
+
+
+async def index_similarity(args) -> dict:
+    from app.services.similarity import SimilarityService
+    return await SimilarityService.index_collection(
+        db_config.get_database(), args.collection, rebuild=args.rebuild, batch_size=args.batch_size
+    )
+
+
+async def mirror_sync(args) -> dict:
+    from app.services.duckdb_mirror import DuckDBMirrorService, mirror_scheduler
+    db = db_config.get_database()
+    if args.collection:
+        return await DuckDBMirrorService.sync_collection(db, args.collection, full=args.full, batch_rows=args.batch_rows)
+    return {"results": await mirror_scheduler.sync_all(db)}
+
+
+async def refresh_trend(args) -> dict:
+    from app.services.trend import TrendService, trend_scheduler
+    db = db_config.get_database()
+    if args.collection:
+        return await TrendService.refresh_rollups(db, args.collection, full=args.full)
+    return {"results": await trend_scheduler.refresh_all(db)}
+
+
+async def retention(args) -> dict:
+    from app.services.retention import RetentionService
+    db = db_config.get_database()
+    if args.collection:
+        if args.raw_days is None:
+            policy = await RetentionService.get_policy(db, args.collection)
+            if not policy:
+                raise SystemExit(f"集合 {args.collection} 没有保留策略，请指定 --raw-days")
+            args.raw_days, args.archive = policy["raw_days"], args.archive or policy.get("archive", "collection")
+        return await RetentionService.apply(db, args.collection, args.raw_days, args.archive or "collection", args.dry_run)
+    return {"results": await RetentionService.apply_all(db, args.dry_run)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python manage.py", description="SQL计划可视化平台运维命令")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("externalize-blobs", help="把超过阈值的data/sql_plan压缩后移到GridFS")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--threshold", type=int, help="外置阈值（字节），默认BLOB_SIZE_THRESHOLD")
+    p.add_argument("--batch-size", type=int, default=200)
+    p.add_argument("--dry-run", action="store_true", help="只统计可节省的空间，不写入")
+    p.set_defaults(func=externalize_blobs)
+
+    p = sub.add_parser("storage-report", help="集合存储大小及外置节省的空间")
+    p.add_argument("--collection", required=True)
+    p.set_defaults(func=storage_report)
+
+    p = sub.add_parser("dedupe-plans", help="按结构哈希去重执行计划，记录只保留实际值")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--batch-size", type=int, default=200)
+    p.add_argument("--dry-run", action="store_true", help="只统计去重后的大小，不写入")
+    p.set_defaults(func=dedupe_plans)
+
+    p = sub.add_parser("export-parquet", help="导出记录和按节点展开的计划指标为Parquet/Arrow文件（需要pyarrow）")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--output-dir", help="输出目录，默认PARQUET_EXPORT_DIR")
+    p.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    p.add_argument("--full", action="store_true", help="忽略高水位，重新导出全部记录")
+    p.add_argument("--batch-rows", type=int, default=50000, help="每个RecordBatch的行数")
+    p.add_argument("--row-group-size", type=int, default=100000, help="Parquet行组大小")
+    p.set_defaults(func=export_parquet)
+
+    p = sub.add_parser("score-complexity", help="批量计算并写回复杂度分数和等级")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.add_argument("--rescore", action="store_true", help="重新计算已有等级的记录")
+    p.add_argument("--dry-run", action="store_true", help="只统计等级分布，不写入")
+    p.set_defaults(func=score_complexity)
+
+    p = sub.add_parser("analyze-sql", help="分析SQL文本，回填table_count、sql_fingerprint和连接/CTE/子查询数")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--rescan", action="store_true", help="重新分析已有指纹的记录")
+    p.add_argument("--dry-run", action="store_true", help="只统计table_count会变化的记录数，不写入")
+    p.set_defaults(func=analyze_sql)
+
+    p = sub.add_parser("index-similarity", help="为记录计算计划/SQL的MinHash签名并建立LSH分桶索引（相似计划检索）")
+    p.add_argument("--collection", required=True)
+    p.add_argument("--batch-size", type=int, default=500)
+    p.add_argument("--rebuild", action="store_true", help="删除已有签名后重建（修改SIMILARITY_*参数后需要）")
+    p.set_defaults(func=index_similarity)
+
+    p = sub.add_parser("mirror-sync", help="把记录和计划节点增量同步到DuckDB分析镜像（需要duckdb和pyarrow）")
+    p.add_argument("--collection", help="默认同步DUCKDB_SYNC_COLLECTIONS或全部业务集合")
+    p.add_argument("--full", action="store_true", help="删除该集合的镜像数据后重建")
+    p.add_argument("--batch-rows", type=int, default=20000, help="每个事务写入的记录数")
+    p.set_defaults(func=mirror_sync)
+
+    p = sub.add_parser("refresh-trend", help="创建趋势索引并增量刷新小时级趋势预聚合（不指定集合时刷新全部已有预聚合）")
+    p.add_argument("--collection")
+    p.add_argument("--full", action="store_true", help="从原始记录重建预聚合（执行过保留策略的集合不要使用）")
+    p.set_defaults(func=refresh_trend)
+
+    p = sub.add_parser("retention", help="按保留策略汇总、归档并删除旧记录（不指定集合时执行全部已配置策略）")
+    p.add_argument("--collection")
+    p.add_argument("--raw-days", type=int, help="原始记录保留天数，默认使用已配置的策略")
+    p.add_argument("--archive", choices=["collection", "parquet", "none"])
+    p.add_argument("--dry-run", action="store_true", help="只估算可释放的空间和执行时间")
+    p.set_defaults(func=retention)
+
+    args = parser.parse_args(argv)
+    setup_logging()
+    result = asyncio.run(args.func(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""生产环境启动入口
+
+    python server.py
+
+开发时仍使用 python main.py（单进程、自动重载）。
+
+- 多进程: 工作进程数默认等于CPU核数，可用WEB_CONCURRENCY覆盖
+- 安装了uvloop / httptools时自动使用
+- 优雅下线: 工作进程收到SIGTERM后先把/ready置为503，等待DRAIN_SECONDS让负载均衡摘除流量，
+  再停止接收连接，进行中的请求最多等待GRACEFUL_TIMEOUT秒
+
+环境变量:
+    API_HOST / API_PORT   监听地址，默认0.0.0.0:8000
+    WEB_CONCURRENCY       工作进程数，默认CPU核数
+    DRAIN_SECONDS         SIGTERM后继续服务的秒数，默认5
+    GRACEFUL_TIMEOUT      等待进行中请求的秒数，默认30
+    LOG_LEVEL             uvicorn日志级别，默认info
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import signal
+import sys
+from types import FrameType
+from typing import Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+class DrainingServer(uvicorn.Server):
+    """收到SIGTERM后延迟退出，期间/ready返回503"""
+
+    drain_seconds = float(os.getenv("DRAIN_SECONDS", "5"))
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        from app.core.runtime import runtime_state
+
+        if sig != signal.SIGTERM or runtime_state.draining or self.drain_seconds <= 0:
+            super().handle_exit(sig, frame)
+            return
+        runtime_state.begin_drain()
+        asyncio.get_event_loop().call_later(self.drain_seconds, super().handle_exit, sig, frame)
+
+
+class DrainingMultiprocess(Multiprocess):
+    """同时通知所有工作进程下线（默认实现逐个终止并等待，下线时间会随进程数累加）"""
+
+    def shutdown(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        logging.getLogger("uvicorn.error").info("Stopping parent process [%d]", self.pid)
+
+
+def main() -> int:
+    workers = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+    config = uvicorn.Config(
+        "app.main:app",
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=int(os.getenv("API_PORT", "8000")),
+        workers=workers,
+        loop="uvloop" if _available("uvloop") else "asyncio",
+        http="httptools" if _available("httptools") else "h11",
+        log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        proxy_headers=True,
+    )
+    server = DrainingServer(config=config)
+    if workers > 1:
+        sock = config.bind_socket()
+        DrainingMultiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
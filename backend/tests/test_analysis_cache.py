@@ -0,0 +1,33 @@
+"""统计缓存按集合失效"""
+from app.services.analysis import AnalysisService
+
+
+def test_invalidate_collection_does_not_touch_prefixed_names():
+    AnalysisService.clear_cache()
+    plans = AnalysisService._get_cache_key("plans", 100.0)
+    plans_basic = AnalysisService._get_cache_key("plans", is_basic=True)
+    archive = AnalysisService._get_cache_key("plans_archive", 100.0)
+    for key in (plans, plans_basic, archive):
+        AnalysisService.set_cached(key, {"key": key})
+
+    assert AnalysisService.invalidate_collection("plans", keep=(plans_basic,)) == 1
+    assert AnalysisService.get_cached(plans) is None
+    assert AnalysisService.get_cached(plans_basic) == {"key": plans_basic}
+    assert AnalysisService.get_cached(archive) == {"key": archive}
+    AnalysisService.clear_cache()
+
+
+def test_stats_cache_evicts_least_recently_used(monkeypatch):
+    AnalysisService.clear_cache()
+    monkeypatch.setattr(AnalysisService, "_cache_max_size", 2)
+    keys = [AnalysisService._get_cache_key("plans", 100.0, variant=f"trend_{i}") for i in range(3)]
+    AnalysisService.set_cached(keys[0], 0)
+    AnalysisService.set_cached(keys[1], 1)
+    assert AnalysisService.get_cached(keys[0]) == 0
+    AnalysisService.set_cached(keys[2], 2)
+
+    assert AnalysisService.get_cached(keys[1]) is None
+    assert keys[1] not in AnalysisService._key_collections
+    assert AnalysisService.get_cached(keys[0]) == 0
+    assert AnalysisService.get_cached(keys[2]) == 2
+    AnalysisService.clear_cache()
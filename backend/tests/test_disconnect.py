@@ -0,0 +1,112 @@
+"""客户端断开时取消统计请求（经过全部中间件）"""
+import asyncio
+
+from app.api import routes
+from app.core import execution, http_cache
+from app.core.execution import admission, execution_config, query_options
+from app.main import app
+from app.services.analysis import AnalysisService
+from app.services.sampling import ApproxStatsService
+
+
+class FakeDatabase:
+    """统计查询被替换，不访问集合；kill_tagged_operations访问不到MongoDB时只记录日志"""
+
+    def __getitem__(self, name):
+        return None
+
+
+def _call(path: str, query: bytes, disconnect_after: float = 0.1):
+    """经过ASGI调用应用，客户端在disconnect_after秒后断开，返回发送的消息"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "headers": [(b"host", b"test")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+    sent = []
+
+    async def main():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        disconnect_at = asyncio.get_running_loop().time() + disconnect_after
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # 与服务器相同：客户端断开前receive一直等待，断开后立即返回
+            remaining = disconnect_at - asyncio.get_running_loop().time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(app(scope, receive, send), timeout=3)
+        # 等待断开后启动的终止任务
+        await asyncio.sleep(0.05)
+
+    app.dependency_overrides[routes.get_database] = FakeDatabase
+    try:
+        asyncio.run(main())
+    finally:
+        app.dependency_overrides.clear()
+    return sent
+
+
+def test_disconnect_cancels_stats_request(monkeypatch):
+    cancelled = []
+
+    async def slow_list(*args, **kwargs):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def no_etag(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(AnalysisService, "get_slow_sql_list", slow_list)
+    monkeypatch.setattr(http_cache, "check_stats_etag", no_etag)
+
+    sent = _call("/api/stats/slow-sql-list", b"collection=plans")
+    assert cancelled
+    assert sent[0]["status"] == 499
+
+
+def test_disconnect_stops_progressive_stats(monkeypatch):
+    comments, killed = [], []
+
+    async def exact(*args, **kwargs):
+        return False
+
+    def sections(collection, threshold):
+        async def slow():
+            comments.append(query_options("stats").get("comment"))
+            await asyncio.sleep(5)
+        return {"counts": slow, "plan_nodes": slow}
+
+    async def kill(db, tag):
+        killed.append(tag)
+        return 0
+
+    AnalysisService.clear_cache()
+    monkeypatch.setattr(ApproxStatsService, "should_approximate", exact)
+    monkeypatch.setattr(AnalysisService, "slow_sql_sections", sections)
+    monkeypatch.setattr(execution, "kill_tagged_operations", kill)
+    # 每个测试使用新的事件循环，信号量重新创建
+    monkeypatch.setattr(admission, "_semaphores", {})
+    monkeypatch.setattr(execution_config, "max_concurrency", 1)
+
+    _call("/api/stats/slow-sql/stream", b"collection=plans")
+    assert len(comments) == 2 and comments[0] and comments[0] == comments[1]
+    assert killed == [comments[0]]
+    assert admission._semaphores["stats_slow_sql"]._value == 1
@@ -0,0 +1,32 @@
+"""执行历史的LTTB降采样"""
+import numpy as np
+
+from app.services.history import HistoryService
+
+
+def test_lttb_keeps_endpoints_and_size():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 20) + (x == 500) * 5
+    selected = HistoryService.lttb(x, y, 100)
+    assert len(selected) == 100
+    assert selected[0] == 0 and selected[-1] == 999
+    assert np.all(np.diff(selected) > 0)
+    # 尖峰所在的桶选中尖峰
+    assert 500 in selected
+
+
+def test_lttb_returns_all_points_below_threshold():
+    x = np.arange(10, dtype=float)
+    assert list(HistoryService.lttb(x, x, 10)) == list(range(10))
+    assert list(HistoryService.lttb(x, x, 2)) == list(range(10))
+
+
+def test_pinned_indices_respect_budget():
+    values = np.ones(200)
+    values[[10, 50]] = [100.0, 90.0]
+    errors = np.zeros(200, dtype=bool)
+    errors[[20, 30, 40]] = True
+    plans = ["a"] * 100 + ["b"] * 100
+    pinned = HistoryService.pinned_indices(values, errors, plans, budget=4)
+    assert len(pinned["all"]) <= 4
+    assert 10 in pinned["all"] and 100 in pinned["plan_changes"]
@@ -0,0 +1,14 @@
+"""大计划按需展开的节点构造"""
+from app.services.plan_tree import IndexedPlan
+
+
+def test_fractional_actual_rows_validate():
+    # PostgreSQL 18的Actual Rows是每次循环的平均值
+    plan = IndexedPlan({"Plan": {
+        "Node Type": "Nested Loop", "Actual Total Time": 2.0, "Actual Rows": 10.0, "Actual Loops": 1,
+        "Plans": [{"Node Type": "Index Scan", "Actual Total Time": 0.1, "Actual Rows": 0.5, "Actual Loops": 20}],
+    }})
+    nodes = plan.subtree(0, 1)
+    assert [node.actual_rows for node in nodes] == [10.0, 0.5]
+    assert nodes[1].subtree_time == 2.0
+    assert nodes[0].self_time == 0.0
@@ -0,0 +1,25 @@
+"""保留策略：迟到记录的按天汇总合并"""
+from app.services.retention import RetentionService
+
+
+def test_merge_summary_keeps_existing_and_adds_counts():
+    key = {"f": "a.sql", "fp": "x", "d": 0.0}
+    existing = {"_id": key, "n": 3, "sum": 30, "err": 1, "min": 5, "max": 15, "hist": [[1, 2], [3, 1]]}
+    late = {"_id": key, "n": 2, "sum": 8, "err": 0, "min": 1, "max": 7, "hist": [[0, 1], [3, 1]]}
+    merged = RetentionService._merge_summary(existing, late)
+    assert merged["_id"] == key
+    assert (merged["n"], merged["sum"], merged["err"], merged["min"], merged["max"]) == (5, 38, 1, 1, 15)
+    assert merged["hist"] == [[0, 1], [1, 2], [3, 2]]
+    assert sum(count for _, count in merged["hist"]) == merged["n"]
+
+
+def test_daily_pipeline_does_not_collect_record_ids():
+    # 高频脚本一天数十万次执行，ID数组会超过16MB的文档上限
+    match = {"timestamp": {"$gte": 0.0, "$lt": 86400.0}, "retention_batch": "b"}
+    pipeline = RetentionService._daily_pipeline(match)
+    assert pipeline[0] == {"$match": match}
+    assert "{'$push': '$_id'}" not in repr(pipeline)
+
+    median = RetentionService._median_pipeline(match, "a.sql", None, 900001)
+    assert median[0]["$match"] == dict(match, file_name="a.sql", sql_fingerprint=None)
+    assert median[-2:] == [{"$skip": 450000}, {"$limit": 1}]
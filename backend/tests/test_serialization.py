@@ -0,0 +1,29 @@
+"""响应序列化：非有限浮点数"""
+import json
+from typing import Any, Dict
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+from app.core.serialization import dump_json
+
+
+def _strict_loads(body: bytes) -> Any:
+    def reject(constant):
+        raise ValueError(f"非法JSON常量: {constant}")
+    return json.loads(body, parse_constant=reject)
+
+
+def test_non_finite_floats_become_null():
+    record_id = ObjectId()
+    body = dump_json({"a": float("nan"), "b": [float("-inf"), 1.5], "id": record_id, "text": "NaN"})
+    assert _strict_loads(body) == {"a": None, "b": [None, 1.5], "id": str(record_id), "text": "NaN"}
+
+
+def test_non_finite_floats_in_model_dict_fields():
+    class Payload(BaseModel):
+        x: float
+        extra: Dict[str, Any]
+
+    body = dump_json(Payload.model_construct(x=float("nan"), extra={"y": float("inf")}))
+    assert _strict_loads(body) == {"x": None, "extra": {"y": None}}
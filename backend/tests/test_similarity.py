@@ -0,0 +1,48 @@
+"""MinHash签名、LSH分桶与签名组"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from app.services.similarity import SimilarityService
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_signature_is_deterministic():
+    features = {"op:Seq Scan#1", "rel:orders#1", "edge:Hash Join>Seq Scan#1"}
+    first = SimilarityService.signature(features)
+    second = SimilarityService.signature(set(sorted(features, reverse=True)))
+    assert first.dtype == np.uint32 and len(first) == SimilarityService.num_perm
+    assert np.array_equal(first, second)
+    assert SimilarityService.signature(set()) is None
+    assert SimilarityService.band_keys(None) == []
+
+
+def test_group_id_is_stable_across_processes():
+    # 签名组ID写入数据库，不能依赖按进程随机化的内置hash
+    code = (
+        "from app.services.similarity import SimilarityService as S;"
+        "print(S.group_id('sql', S.signature(S.sql_features('SELECT * FROM t WHERE id = 1'))))"
+    )
+    ids = {
+        subprocess.run(
+            [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONHASHSEED=seed),
+        ).stdout.strip()
+        for seed in ("1", "2")
+    }
+    assert len(ids) == 1
+
+
+def test_identical_feature_sets_share_group():
+    first = SimilarityService.signature(SimilarityService.sql_features("SELECT * FROM t WHERE id = 1 AND name = 'a'"))
+    second = SimilarityService.signature(SimilarityService.sql_features("select * from T where id = 7 and name = 'b'"))
+    other = SimilarityService.signature(SimilarityService.sql_features("SELECT * FROM u WHERE id = 1 AND name = 'a'"))
+    assert SimilarityService.group_id("sql", first) == SimilarityService.group_id("sql", second)
+    assert SimilarityService.group_id("sql", first) != SimilarityService.group_id("sql", other)
+
+    bands = SimilarityService.band_keys(first)
+    assert len(bands) == SimilarityService.bands
+    assert bands == SimilarityService.band_keys(second)
@@ -0,0 +1,49 @@
+"""SQL文本分析：表引用、连接/CTE计数与指纹"""
+from app.services.sql_analysis import SqlAnalysisService
+
+
+def analyze(sql):
+    return SqlAnalysisService._analyze_tokens(sql)
+
+
+def test_explicit_and_implicit_joins():
+    result = analyze(
+        "SELECT * FROM orders o JOIN customers c ON c.id = o.cid LEFT JOIN public.items i ON i.oid = o.id"
+    )
+    assert result["relations"] == ["orders", "customers", "public.items"]
+    assert result["join_count"] == 2
+    assert analyze("SELECT * FROM a, b WHERE a.id = b.id")["join_count"] == 1
+
+    self_join = analyze("SELECT * FROM t a JOIN t b ON a.id = b.pid")
+    assert (self_join["table_count"], self_join["relation_refs"]) == (1, 2)
+
+
+def test_cte_names_are_not_tables():
+    result = analyze(
+        "WITH recent AS (SELECT * FROM orders WHERE ts > now() - interval '1 day') "
+        "SELECT * FROM recent r JOIN customers c ON c.id = r.cid"
+    )
+    assert result["relations"] == ["orders", "customers"]
+    assert (result["cte_count"], result["cte_refs"], result["subquery_count"]) == (1, 1, 0)
+
+
+def test_from_inside_functions_and_predicates():
+    result = analyze("SELECT EXTRACT(YEAR FROM o.created_at), SUBSTRING(name FROM 2 FOR 3) FROM orders o")
+    assert result["relations"] == ["orders"]
+    result = analyze("SELECT * FROM a WHERE a.x IS DISTINCT FROM a.y AND a.z IS NOT DISTINCT FROM 1")
+    assert result["relations"] == ["a"]
+
+
+def test_update_from():
+    result = analyze("UPDATE orders o SET total = s.total FROM staging s WHERE s.id = o.id")
+    assert result["relations"] == ["orders", "staging"]
+    assert result["table_count"] == 2
+
+
+def test_fingerprint_ignores_constants():
+    first = analyze("SELECT * FROM t WHERE id = 1 AND name = 'bob' AND k IN (1, 2, 3)")
+    second = analyze("select * from t where id = 42 and name = 'alice' and k in (7)")
+    other = analyze("SELECT * FROM t WHERE id = 1 AND owner = 'bob'")
+    assert first["fingerprint"] == second["fingerprint"]
+    assert first["fingerprint"] != other["fingerprint"]
+    assert analyze("")["fingerprint"] is None
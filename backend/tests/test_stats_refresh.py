@@ -0,0 +1,58 @@
+"""统计缓存后台刷新按请求的连接目标执行"""
+import asyncio
+
+from app.core.database import MongoTarget, db_config
+from app.services.analysis import AnalysisService
+from app.services.stats_refresh import StatsRefreshScheduler
+
+
+def test_background_refresh_runs_under_requested_target():
+    AnalysisService.clear_cache()
+    db_config.targets["staging"] = MongoTarget("staging", "mongodb://localhost:27017", "staging")
+    scheduler = StatsRefreshScheduler()
+
+    async def load():
+        # loader在刷新时按当前上下文的目标生成键
+        return db_config.qualify("plans")
+
+    async def main():
+        active_key = AnalysisService._get_cache_key("plans", is_basic=True)
+        AnalysisService.set_cached(active_key, 1)
+
+        async def request():
+            db_config.use_target("staging")
+            staging_key = AnalysisService._get_cache_key("plans", is_basic=True)
+            await scheduler.serve(staging_key, load)
+            return staging_key
+
+        # 请求在自己的上下文中选择目标，后台刷新在调度器的上下文中执行
+        staging_key = await asyncio.create_task(request())
+        refreshed = await scheduler._refresh(staging_key, scheduler._entries[staging_key])
+        await scheduler.stop()
+        return active_key, staging_key, refreshed
+
+    try:
+        active_key, staging_key, refreshed = asyncio.run(main())
+        assert refreshed == "staging/plans"
+        assert AnalysisService.get_cached(staging_key) == "staging/plans"
+        assert AnalysisService.get_cached(active_key) == 1
+    finally:
+        del db_config.targets["staging"]
+        AnalysisService.clear_cache()
+
+
+def test_idle_keys_drop_cached_value():
+    AnalysisService.clear_cache()
+    scheduler = StatsRefreshScheduler()
+    key = AnalysisService._get_cache_key("plans", is_basic=True)
+    AnalysisService.set_cached(key, 1)
+
+    async def load():
+        return 2
+
+    entry = scheduler._track(key, load)
+    entry["last_requested"] -= scheduler.idle_seconds
+    assert scheduler.tick() == 0
+    assert key not in scheduler._entries
+    assert AnalysisService.get_cached(key, allow_stale=True) is None
+    assert key not in AnalysisService._key_collections
@@ -0,0 +1,41 @@
+"""趋势索引按连接目标分别创建"""
+import asyncio
+
+from app.core.database import MongoTarget, db_config
+from app.services.trend import TrendService
+
+
+class FakeCollection:
+    def __init__(self, created, name):
+        self.created, self.name = created, name
+
+    async def create_index(self, keys, **kwargs):
+        self.created.append((self.name, tuple(keys)))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.created = []
+
+    def __getitem__(self, name):
+        return FakeCollection(self.created, name)
+
+
+def test_ensure_indexes_per_target():
+    TrendService._indexed_collections.clear()
+    db_config.targets["staging"] = MongoTarget("staging", "mongodb://staging:27017", "staging")
+    active, staging = FakeDatabase(), FakeDatabase()
+
+    async def main():
+        await TrendService.ensure_indexes(active, "plans")
+        await TrendService.ensure_indexes(active, "plans")
+        db_config.use_target("staging")
+        await TrendService.ensure_indexes(staging, "plans")
+
+    try:
+        asyncio.run(main())
+        assert len(active.created) == 3
+        assert staging.created == active.created
+    finally:
+        del db_config.targets["staging"]
+        TrendService._indexed_collections.clear()
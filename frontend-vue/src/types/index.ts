@@ -16,6 +16,7 @@ export interface SQLExecutionRecord {
   // 复杂度相关字段
   actual_processing_complexity?: number;
   complexity_level?: string;
+  complexity_score?: number;
   sql_plan_metrics?: any;
   enhanced_complexity_analysis?: {
     total_complexity?: number;
@@ -116,6 +117,8 @@ export interface Settings {
   slow_sql_threshold: number;
   default_collection?: string;
   page_size: number;
+  target?: string;
+  read_preference?: string;
 }
 
 export interface ConnectionTest {